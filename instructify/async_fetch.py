@@ -0,0 +1,212 @@
+import os
+import random
+import asyncio
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import aiohttp
+from tqdm import tqdm
+
+CHUNK_SIZE = 64 * 1024
+SNIFF_BYTES = 2048
+PART_SUFFIX = ".part"
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+FAILED_STATUS = 408  # Recorded when a fetch fails without an HTTP status (timeouts, connection errors)
+
+class FetchLedger:
+    """
+    Append-only record of finished fetches, one "key<TAB>status<TAB>size<TAB>mimetype" line per
+    key, read once into a dict so a restart can skip finished keys in O(1).
+
+    E.g.
+        ledger = FetchLedger(os.path.join(dataset_path, "download.ledger"))
+        if "12" not in ledger:
+            ...
+            ledger.add("12", 200, 48213, "image/jpeg")
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, Tuple[int, int, str]] = {}
+        self._f = None
+        if not os.path.exists(path):
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) != 4:
+                    continue  # A line cut by an interrupted run
+                key, status, size, mimetype = fields
+                self.entries[key] = (int(status), int(size), mimetype)
+        if os.path.getsize(path) > 0:
+            with open(path, "rb+") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")  # Start the next entry on a line of its own
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def items(self):
+        return self.entries.items()
+
+    def add(self, key: str, status: int, size: int = 0, mimetype: str = ""):
+        if self._f is None:
+            self._f = open(self.path, "a", encoding="utf-8")
+        self._f.write(f"{key}\t{status}\t{size}\t{mimetype}\n")
+        self.entries[key] = (status, size, mimetype)
+
+    def flush(self):
+        if self._f is not None:
+            self._f.flush()
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+async def _fetch(session: aiohttp.ClientSession, url: str, dest: str, retries: int, backoff: float) -> Tuple[int, int, bytes]:
+    """(status, size, first SNIFF_BYTES bytes) of a URL streamed to dest."""
+    for attempt in range(retries + 1):
+        try:
+            async with session.get(url, allow_redirects=True) as response:
+                status = response.status
+                if status == 200:
+                    head, size = b"", 0
+                    with open(dest + PART_SUFFIX, "wb") as f:
+                        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                            if len(head) < SNIFF_BYTES:
+                                head += chunk[:SNIFF_BYTES - len(head)]
+                            f.write(chunk)
+                            size += len(chunk)
+                    os.replace(dest + PART_SUFFIX, dest)
+                    return status, size, head
+                if status not in RETRY_STATUSES:
+                    return status, 0, b""
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError):
+            status = FAILED_STATUS
+        if attempt < retries:
+            # Exponential backoff with jitter, so retries of a struggling host spread out
+            await asyncio.sleep(min(60, backoff * 2 ** attempt) * random.uniform(0.5, 1.5))
+    return status, 0, b""
+
+async def _fetch_all(jobs: Iterable[Tuple[str, str, str]], ledger: FetchLedger, headers: Optional[Dict[str, str]],
+                     connections: int, per_host: int, retries: int, backoff: float, timeout: float,
+                     sniff: Optional[Callable[[List[bytes]], List[str]]], sniff_batch: int, progress: Optional[tqdm]):
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=connections * 4)
+    pending = []  # (key, status, size, head) waiting for their MIME types
+
+    failed = loop.create_future()  # Set to the error of the first worker that dies
+
+    async def record(batch):
+        heads = [head for _, status, _, head in batch if status == 200]
+        mimetypes = []
+        if sniff is not None and heads:
+            try:
+                mimetypes = await loop.run_in_executor(None, sniff, heads)
+            except Exception as e:
+                print(f"Failed to sniff the MIME types of {len(heads)} files: {e}")
+        mimetypes = iter(mimetypes)
+        for key, status, size, head in batch:
+            ledger.add(key, status, size, next(mimetypes, "") if status == 200 and sniff is not None else "")
+        ledger.flush()
+
+    async def finish(key, status, size, head):
+        nonlocal pending
+        pending.append((key, status, size, head))
+        if progress is not None:
+            progress.update(1)
+        if len(pending) >= sniff_batch:
+            batch, pending = pending, []
+            await record(batch)
+
+    async def worker(session):
+        while True:
+            job = await queue.get()
+            if job is None:
+                return
+            key, url, dest = job
+            try:
+                result = await _fetch(session, url, dest, retries, backoff)
+            except Exception as e:
+                print(f"Failed to fetch {url}: {e}")
+                result = (FAILED_STATUS, 0, b"")
+            await finish(key, *result)
+
+    def worker_done(task):
+        if not task.cancelled() and task.exception() is not None and not failed.done():
+            failed.set_result(task.exception())
+
+    async def put(job):
+        if queue.full():
+            # Wait for room in the queue, unless the workers that would make it die meanwhile
+            putter = asyncio.ensure_future(queue.put(job))
+            await asyncio.wait([putter, failed], return_when=asyncio.FIRST_COMPLETED)
+            if not putter.done():
+                putter.cancel()
+        else:
+            queue.put_nowait(job)
+        if failed.done():
+            raise failed.result()
+
+    connector = aiohttp.TCPConnector(limit=connections, limit_per_host=per_host, ttl_dns_cache=300)
+    async with aiohttp.ClientSession(connector=connector, headers=headers,
+                                     timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        workers = [asyncio.create_task(worker(session)) for _ in range(connections)]
+        for task in workers:
+            task.add_done_callback(worker_done)
+        try:
+            for key, url, dest in jobs:
+                if key in ledger:
+                    if progress is not None:
+                        progress.update(1)
+                    continue
+                if os.path.isfile(dest):
+                    # Fetched before the ledger recorded it
+                    with open(dest, "rb") as f:
+                        head = f.read(SNIFF_BYTES)
+                    await finish(key, 200, os.path.getsize(dest), head)
+                    continue
+                await put((key, url, dest))
+            for _ in workers:
+                await put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+            if pending:
+                await record(pending)
+
+def fetch_all(jobs: Iterable[Tuple[str, str, str]], ledger_path: str, headers: Optional[Dict[str, str]] = None,
+              connections: int = 256, per_host: int = 8, retries: int = 3, backoff: float = 1.0,
+              timeout: float = 30, sniff: Optional[Callable[[List[bytes]], List[str]]] = None,
+              sniff_batch: int = 256, total: Optional[int] = None, progress: bool = True) -> FetchLedger:
+    """
+    Fetch many small files (e.g. millions of image URLs) concurrently with asyncio.
+
+    Each (key, url, dest) job is streamed to dest + '.part' and renamed once complete. Requests
+    share one connection pool of `connections` connections, at most `per_host` to any one host.
+    Timeouts, connection errors and 429/5xx answers are retried with exponential backoff and
+    jitter. Every finished job, failed or not, is appended to the ledger at ledger_path (see
+    FetchLedger) and skipped when fetching again; files that exist without a ledger entry are
+    recorded without being fetched.
+
+    :param sniff: Called in a thread with the first bytes of up to sniff_batch fetched files,
+                  returns their MIME types for the ledger, e.g.
+                  lambda heads: [magic.from_buffer(head, mime=True) for head in heads]
+                  If it raises, that batch is recorded without MIME types.
+    :param total: Number of jobs, for the progress bar
+    :return: The ledger, mapping each key to (status, size, mimetype)
+    """
+    ledger = FetchLedger(ledger_path)
+    bar = tqdm(total=total, desc="Fetching", unit="file") if progress else None
+    try:
+        asyncio.run(_fetch_all(jobs, ledger, headers, connections, per_host, retries, backoff, timeout,
+                               sniff, sniff_batch, bar))
+    finally:
+        ledger.close()
+        if bar is not None:
+            bar.close()
+    return ledger
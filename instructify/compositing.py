@@ -0,0 +1,107 @@
+import io
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Dict, Hashable, Iterable, Optional, Tuple
+
+from PIL import Image
+from tqdm import tqdm
+
+PART_SUFFIX = ".part"
+
+def merge_images(img1: Image.Image, img2: Image.Image) -> Image.Image:
+    """Merge two images side by side."""
+
+    # Convert to RGB mode if needed
+    if img1.mode != 'RGB':
+        img1 = img1.convert('RGB')
+    if img2.mode != 'RGB':
+        img2 = img2.convert('RGB')
+
+    # Ensure both images have the same height
+    max_height = max(img1.height, img2.height)
+    img1 = img1.resize((int(img1.width * max_height / img1.height), max_height))
+    img2 = img2.resize((int(img2.width * max_height / img2.height), max_height))
+
+    # Create new image with combined width
+    merged_width = img1.width + img2.width
+    merged_image = Image.new('RGB', (merged_width, max_height))
+
+    # Paste images side by side
+    merged_image.paste(img1, (0, 0))
+    merged_image.paste(img2, (img1.width, 0))
+
+    return merged_image
+
+def open_image(source: Any) -> Image.Image:
+    """
+    Image from a file path, encoded bytes, an undecoded Hugging Face image ({'bytes': ..., 'path': ...})
+    or a PIL image.
+    """
+    if isinstance(source, Image.Image):
+        return source
+    if isinstance(source, dict):
+        source = source.get('bytes') or source['path']
+    if isinstance(source, (bytes, bytearray)):
+        return Image.open(io.BytesIO(source))
+    return Image.open(source)
+
+def composite_pair(first: Any, second: Any, dest: str, quality: int = 95):
+    """Merge two images (see open_image) side by side into dest, written atomically in the format of its extension."""
+    merged_image = merge_images(open_image(first), open_image(second))
+    image_format = Image.registered_extensions().get(os.path.splitext(dest)[1].lower(), "JPEG")
+    merged_image.save(dest + PART_SUFFIX, format=image_format, quality=quality)
+    os.replace(dest + PART_SUFFIX, dest)
+
+def composite_pairs(pairs: Iterable[Tuple[Hashable, Any, Any, str]], workers: Optional[int] = None, quality: int = 95,
+                    total: Optional[int] = None, progress: bool = True) -> Dict[Hashable, str]:
+    """
+    Composite (key, first image, second image, dest) pairs side by side in worker processes,
+    each decoding both images, resizing, pasting and encoding the result.
+
+    Pairs whose dest already exists are skipped, since outputs are only renamed into place once
+    fully written. Images are best passed undecoded (paths, bytes or {'bytes': ...} dicts), so
+    the decoding happens in the workers; at most a few pairs per worker are in flight at once.
+
+    :param workers: Number of worker processes, all cores by default
+    :param total: Number of pairs, for the progress bar
+    :return: Error message of each pair that failed, by key
+
+    E.g.
+        errors = composite_pairs((name, os.path.join(a_dir, name), os.path.join(b_dir, name),
+                                  os.path.join(merged_dir, name)) for name in names)
+    """
+    workers = workers or os.cpu_count() or 1
+    errors = {}
+    bar = tqdm(total=total, desc="Compositing", unit="pair") if progress else None
+
+    def collect(futures):
+        for future in futures:
+            key = in_flight.pop(future)
+            try:
+                future.result()
+            except Exception as e:
+                errors[key] = str(e)
+                if len(errors) < 5:  # Print first few errors for debugging
+                    print(f"Error compositing image pair {key}: {str(e)}")
+            if bar is not None:
+                bar.update(1)
+
+    # spawn, since forking after CUDA/vLLM initialization is unsafe
+    in_flight = {}
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            for key, first, second, dest in pairs:
+                if os.path.exists(dest):
+                    if bar is not None:
+                        bar.update(1)
+                    continue
+                if len(in_flight) >= workers * 4:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+                in_flight[executor.submit(composite_pair, first, second, dest, quality)] = key
+            collect(list(in_flight))
+    finally:
+        if bar is not None:
+            bar.close()
+    return errors
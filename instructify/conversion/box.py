@@ -177,9 +177,12 @@ class HierarchicalObjectOrganizer:
         self.max_sam_boxes = 20
         self.semaphore = Semaphore(1)
 
-    async def organize_objects_verbose(self, input_boxes, image_path, include_box_label=True, depth_calculation=False, include_x1y1x2y2_label=False):
-        # Load and process the image
-        img_pil = Image.open(image_path)
+    async def organize_objects_verbose(self, input_boxes, image_path, include_box_label=True, depth_calculation=False, include_x1y1x2y2_label=False, image=None):
+        # Load and process the image, unless an already decoded RGB array is given (e.g. from ImagePrefetcher)
+        if image is not None:
+            img_pil = Image.fromarray(image)
+        else:
+            img_pil = Image.open(image_path)
         img_pil.thumbnail((self.max_resolution, self.max_resolution))
         
         input_boxes = merge_bboxes(input_boxes, iou_threshold=self.initial_box_iou_threshold, format_the_labels=False)
@@ -190,7 +193,7 @@ class HierarchicalObjectOrganizer:
         input_boxes_torch[:, [1, 3]] *= img_pil.size[1]
 
         # Set image once
-        self.predictor.set_image(np.array(img_pil.convert("RGB")))
+        self.predictor.set_image(image if image is not None and image.shape[:2] == img_pil.size[::-1] else np.array(img_pil.convert("RGB")))
         
         # Process in batches (to avoid excessive memory usage with large number of boxes, the speed is nearly the same with batch size ~20)
         all_masks = []
@@ -238,16 +241,16 @@ class HierarchicalObjectOrganizer:
         # Format the hierarchy as a paragraph
         return self._format_hierarchy(hierarchy, include_box_label=include_box_label, include_x1y1x2y2_label=include_x1y1x2y2_label), merged_masks, merged_boxes
 
-    async def organize_objects(self, input_boxes, image_path, include_box_label=True, depth_calculation=False):
-        return (await self.organize_objects_verbose(input_boxes, image_path, include_box_label=include_box_label, depth_calculation=depth_calculation))[0]
+    async def organize_objects(self, input_boxes, image_path, include_box_label=True, depth_calculation=False, image=None):
+        return (await self.organize_objects_verbose(input_boxes, image_path, include_box_label=include_box_label, depth_calculation=depth_calculation, image=image))[0]
 
-    async def image_data_conversion(self, image_path, image_data, include_box_label=True, depth_calculation=False):
+    async def image_data_conversion(self, image_path, image_data, include_box_label=True, depth_calculation=False, image=None):
         aggregate_bbox = []
         for dataset in image_data:
             aggregate_bbox.extend(image_data[dataset]["bboxes"])
 
         if len(aggregate_bbox) > 0:
-            return await self.organize_objects(aggregate_bbox, image_path, include_box_label=include_box_label, depth_calculation=depth_calculation)
+            return await self.organize_objects(aggregate_bbox, image_path, include_box_label=include_box_label, depth_calculation=depth_calculation, image=image)
         else:
             return ""
 
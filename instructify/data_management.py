@@ -2,11 +2,20 @@ import os
 import random
 import importlib
 import json
-from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
+from array import array
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from dotenv import load_dotenv
-from typing import List, Dict
+from typing import List, Dict, Optional
 import shutil
-from multiprocessing import Pool
+from result_writer import GroupCommitWriter, FSYNC_POLICIES
+from segment_store import SegmentStore, _fsync_dir
+from results_cache import IncrementalResultsCache
+from save_scanner import scan_results, ResultEntry
+from dataset_cache import LoadCache, serialize, deserialize
+from record_store import RecordStore
+from dataset_index import DatasetIndex, Query
+from sharded_cache import ShardedDataset, SharedShardedDataset, write_sharded_cache, write_sharded_records, is_sharded_cache
 
 # Load environment variables
 load_dotenv()
@@ -15,19 +24,56 @@ class DatasetError(Exception):
     """Custom exception for dataset-related errors."""
     pass
 
+def _import_dataset_module(dataset_name: str):
+    try:
+        module = importlib.import_module(f"dataset.{dataset_name}")
+    except ImportError:
+        raise DatasetError(f"Dataset '{dataset_name}' not found or failed to import.")
+    if not hasattr(module, 'load'):
+        raise DatasetError(f"Dataset '{dataset_name}' does not have a load function.")
+    return module
+
+def _load_dataset_module(cache_dir: str, dataset_name: str, options: Optional[dict] = None):
+    module = _import_dataset_module(dataset_name)
+    try:
+        dataset = module.load(cache_dir, **(options or {}))
+        print(f"Loaded {dataset_name}")
+        return dataset
+    except Exception as e:
+        raise DatasetError(f"Error loading dataset '{dataset_name}': {str(e)}")
+
+def _load_dataset_process(cache_dir: str, dataset_name: str, options: Optional[dict] = None):
+    """
+    Load a dataset in a worker process and return it serialized, since marshal
+    (de)serializes plain dicts/lists/strings much faster than the default pickling.
+    """
+    dataset = _load_dataset_module(cache_dir, dataset_name, options)
+    return (dataset_name, ) + serialize(dataset)
+
 class DatasetManager:
     LOADED_DATA = None
 
-    def __init__(self, run_id="0", max_workers: int = 1, already_processed: List[str] = None):
+    def __init__(self, run_id="0", max_workers: int = 1, already_processed: List[str] = None, max_attempts: int = 3,
+                 result_store: str = "files", compress_segments: bool = False):
         self.cache_dir = os.getenv("INSTRUCTIFY_CACHE")
         self.run_id = run_id
         if not self.cache_dir:
             raise DatasetError("INSTRUCTIFY_CACHE environment variable is not set.")
         self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        if result_store not in ("files", "segments"):
+            raise DatasetError(f"Unknown result store '{result_store}', expected 'files' or 'segments'.")
+        self.result_store = result_store
+        self.compress_segments = compress_segments
+        self._segment_stores = {}
+        self.fsync = "none"
+        self._writer = None
+        self._known_dirs = set()
         self.already_processed = set(already_processed or [])
         
         # Initialize available images set
         self._available_images = None
+        self._index = None
         self._initialize_available_images()
     
     def _initialize_available_images(self):
@@ -35,21 +81,36 @@ class DatasetManager:
         if self.LOADED_DATA is None:
             return
 
-        # Convert LOADED_DATA keys to a set for O(1) lookup
-        all_images = set(self.LOADED_DATA.keys())
-        
         # Remove already processed images
-        available = all_images - self.already_processed
+        excluded = set(self.already_processed)
         
-        # Check existing files in one batch
+        # Check existing (reserved or finished) result files in one scan
         save_dir = os.path.join(self.cache_dir, "save")
-        if os.path.exists(save_dir):
-            existing_files = {f.split('-')[0] for f in os.listdir(save_dir) 
-                            if f.endswith(f'-{self.run_id}.jsonl')}
-            available -= existing_files
+        for batch in scan_results(save_dir, self.run_id, workers=self.max_workers):
+            excluded.update(entry.image for entry in batch)
+
+        # Remove images reserved or finished in the run's segment store
+        if self.result_store == "segments":
+            store = self.segment_store(self.run_id)
+            excluded |= store.reserved() | store.images()
+
+        # Remove images previously skipped by the admission checks
+        excluded |= set(self.load_skipped(self.run_id))
+
+        # Remove images that already failed max_attempts times
+        if self.max_attempts is not None:
+            excluded |= {img for img, entry in self.load_dead_letters(self.run_id).items()
+                         if entry["attempts"] >= self.max_attempts}
         
-        # Convert to list and shuffle once
-        self._available_images = list(available)
+        if isinstance(self.LOADED_DATA, SharedShardedDataset):
+            # Keep positions in the shared index rather than a private copy of every image name
+            data = self.LOADED_DATA
+            skipped = {data.position(img) for img in excluded | data._deleted}
+            self._available_images = array('q', (i for i in range(data._index_len()) if i not in skipped))
+        else:
+            self._available_images = [img for img in self.LOADED_DATA.keys() if img not in excluded]
+
+        # Shuffle once
         random.shuffle(self._available_images)
 
     def download(self, dataset_names: List[str]):
@@ -73,12 +134,24 @@ class DatasetManager:
             for future in futures:
                 future.result()  # This will raise any exceptions that occurred during download
 
-    def load(self, dataset_names: List[str]) -> Dict[str, Dict[str, any]]:
+    def load(self, dataset_names: List[str], processes: bool = False, use_cache: bool = True,
+             dataset_options: Optional[Dict[str, dict]] = None) -> Dict[str, Dict[str, any]]:
         """
         Load the specified datasets into memory.
 
-        E.g. manager.load(["coco_captions", "lvis"])
+        Datasets are merged one by one as soon as each finishes loading.
+
+        :param processes: Load the datasets in up to max_workers worker processes instead of
+                          threads, so GIL-bound JSON parsing scales with cores.
+        :param use_cache: Reuse the cached load() output of datasets whose source files and
+                          loader code did not change (see dataset_cache.LoadCache).
+        :param dataset_options: Keyword arguments for the load() of each dataset, which are part
+                                of its load cache key.
+
+        E.g. manager.load(["coco_captions", "lvis"], processes=True)
+             manager.load(["visual_genome"], dataset_options={"visual_genome": {"group_boxes": True}})
         """
+        dataset_options = dataset_options or {}
         # first check if all datasets are available for loading
         for dataset_name in dataset_names:
             dataset_folder = os.path.join(self.cache_dir, dataset_name)
@@ -86,16 +159,54 @@ class DatasetManager:
                 raise DatasetError(f"Dataset '{dataset_name}' not found. Please download it first.")
                 
         merged_data = {}
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            futures = [executor.submit(self._load_dataset, name) for name in dataset_names]
-            for future in futures:
-                dataset_name, dataset = future.result()
-                self._merge_dataset(merged_data, dataset_name, dataset)
+
+        # Take unchanged datasets from the load cache
+        load_cache = LoadCache(self.cache_dir)
+        cache_keys = {}
+        to_load = []
+        for dataset_name in dataset_names:
+            if not use_cache:
+                to_load.append(dataset_name)
+                continue
+            cache_keys[dataset_name] = load_cache.key(dataset_name, _import_dataset_module(dataset_name),
+                                                      dataset_options.get(dataset_name))
+            dataset = load_cache.get(dataset_name, cache_keys[dataset_name])
+            if dataset is None:
+                to_load.append(dataset_name)
+                continue
+            print(f"Loaded {dataset_name} (cached)")
+            self._merge_dataset(merged_data, dataset_name, dataset)
+
+        if to_load and processes:
+            # spawn, since forking after CUDA/vLLM initialization is unsafe
+            with ProcessPoolExecutor(max_workers=min(self.max_workers, len(to_load)),
+                                     mp_context=multiprocessing.get_context("spawn")) as executor:
+                futures = [executor.submit(_load_dataset_process, self.cache_dir, name, dataset_options.get(name))
+                           for name in to_load]
+                for future in as_completed(futures):
+                    dataset_name, serializer, payload = future.result()
+                    if use_cache:
+                        load_cache.put(dataset_name, cache_keys[dataset_name], serializer=serializer, payload=payload)
+                    dataset = deserialize(serializer, payload)
+                    del payload
+                    self._merge_dataset(merged_data, dataset_name, dataset)
+        elif to_load:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [executor.submit(self._load_dataset, name, dataset_options.get(name)) for name in to_load]
+                for future in as_completed(futures):
+                    dataset_name, dataset = future.result()
+                    if use_cache:
+                        load_cache.put(dataset_name, cache_keys[dataset_name], dataset)
+                    self._merge_dataset(merged_data, dataset_name, dataset)
         if self.LOADED_DATA is None:
             self.LOADED_DATA = merged_data
+            self._index = None
         else:
-            for dataset_name, dataset in merged_data.items():
-                self._merge_dataset(self.LOADED_DATA, dataset_name, dataset)
+            for image_path, image_data in merged_data.items():
+                existing = dict(self.LOADED_DATA[image_path]) if image_path in self.LOADED_DATA else {}
+                existing.update(image_data)
+                self.LOADED_DATA[image_path] = existing
+            self._index = None
         return merged_data
     
     def set_data(self, data: Dict[str, Dict[str, any]]):
@@ -105,18 +216,55 @@ class DatasetManager:
         E.g. manager.set_data({"coco_captions": {"coco/img_1.png": {"caption": "A cat"}}})
         """
         self.LOADED_DATA = data
+        self._index = None
         
+    def dataset_index(self) -> DatasetIndex:
+        """
+        Secondary indexes (dataset name, image folder, has bboxes/captions/QA, box counts) over
+        the loaded data, built on first use and kept in sync by the drop methods.
+        """
+        if self.LOADED_DATA is None:
+            raise DatasetError("No dataset loaded.")
+        if self._index is None:
+            self._index = DatasetIndex(self.LOADED_DATA)
+        return self._index
+
+    def query(self) -> Query:
+        """
+        Start a composable query over the loaded data; the result is a view, nothing is copied.
+
+        E.g. manager.query().folder("coco").min_boxes(5).has("captions").not_in_run("llava_v1")
+        """
+        return Query(self.dataset_index(), self.LOADED_DATA, on_run=self.run_images)
+
+    def run_images(self, run_id: str = None) -> set:
+        """Images with a result or reservation in the given run."""
+        if run_id is None:
+            run_id = self.run_id
+        save_dir = os.path.join(self.cache_dir, "save")
+        images = {entry.image for batch in scan_results(save_dir, run_id, workers=self.max_workers) for entry in batch}
+        store = self.segment_store(run_id)
+        return images | store.reserved() | store.images()
+
     def drop_imageset(self, image_folder: str):
         """
         Drop all data related to a specific image folder.
 
         E.g. manager.drop_imageset("ade20k")
         """
-        initial_len = len(self.LOADED_DATA)
         if self.LOADED_DATA is None:
             raise DatasetError("No dataset loaded.")
-        self.LOADED_DATA = {k: v for k, v in self.LOADED_DATA.items() if image_folder not in k}
-        if len(self.LOADED_DATA) == initial_len:
+        index = self.dataset_index()
+        positions = index.folder(image_folder)
+        if positions:
+            images = [index.images[i] for i in positions]
+        else:
+            # Not a folder prefix, fall back to matching anywhere in the path
+            images = [k for k in self.LOADED_DATA.keys() if image_folder in k]
+        for image in images:
+            del self.LOADED_DATA[image]
+            index.remove(image)
+        if not images:
             print(f"WARNING: No images dropped related to {image_folder}")
         return self.LOADED_DATA
     
@@ -128,20 +276,19 @@ class DatasetManager:
         """
         if self.LOADED_DATA is None:
             raise DatasetError("No dataset loaded.")
-        data_was_dropped = False
-        new_data = {}
-        for image_path, data in self.LOADED_DATA.items():
+        index = self.dataset_index()
+        images = [index.images[i] for i in index.by_dataset.get(dataset_name, ())]
+        for image in images:
+            data = self.LOADED_DATA[image]
             image_new_data = {k: v for k, v in data.items() if k != dataset_name}
-            if len(image_new_data) != len(data):
-                data_was_dropped = True
-            if len(image_new_data) > 0:
-                if only_when_alone:
-                    new_data[image_path] = data
-                else:
-                    new_data[image_path] = image_new_data
-        if not data_was_dropped:
+            if len(image_new_data) == 0:
+                del self.LOADED_DATA[image]
+                index.remove(image)
+            elif not only_when_alone:
+                self.LOADED_DATA[image] = image_new_data
+                index.remove_dataset(image, dataset_name, self.LOADED_DATA)
+        if not images:
             print(f"WARNING: No data dropped related to {dataset_name}")
-        self.LOADED_DATA = new_data
         return self.LOADED_DATA
 
     def sample(self, n: int):
@@ -152,7 +299,7 @@ class DatasetManager:
         """
         if self.LOADED_DATA is None:
             raise DatasetError("No dataset loaded.")
-        keys = random.sample(list(self.LOADED_DATA.keys()), n)
+        keys = self.dataset_index().sample(n)
         return {k: self.LOADED_DATA[k] for k in keys}
     
     def reserve(self, n: int = 1, run_id: str = None):
@@ -185,46 +332,160 @@ class DatasetManager:
             return {}
             
         # Reserve the images
-        reserved = self._available_images[:n_available]
-        self._available_images = self._available_images[n_available:]
+        reserved = self._available_images[-n_available:]
+        del self._available_images[-n_available:]
+        if isinstance(self._available_images, array):
+            reserved = [self.LOADED_DATA.key_at(i) for i in reserved]
         
-        # Batch create the reservation files
+        if self.result_store == "segments":
+            self.segment_store(self.run_id).reserve(reserved)
+            self.already_processed.update(reserved)
+            return {k: self.LOADED_DATA[k] for k in reserved}
+
+        # Batch create the reservation files (append mode so existing results are never truncated)
         for img in reserved:
             result_file = os.path.join(save_dir, f"{img}-{self.run_id}.jsonl")
             os.makedirs(os.path.dirname(result_file), exist_ok=True)
-            with open(result_file, 'w') as f:
+            with open(result_file, 'a') as f:
                 f.write("")
             self.already_processed.add(img)
             
         return {k: self.LOADED_DATA[k] for k in reserved}
 
-    def cache(self, name: str):
+    def cache(self, name: str, sharded: bool = False, shard_mb: int = 256):
         """
         Cache the loaded dataset to the output json file to self.cache_dir + name.
 
-        E.g. manager.cache("base_data.json")
+        :param sharded: Write a directory of JSONL shards plus an offset index instead, which
+                        load_cache opens lazily without parsing the whole dataset.
+        :param shard_mb: Approximate size of each shard in MB
+
+        E.g. manager.cache("base_data.json") or manager.cache("base_data", sharded=True)
         """
         if self.LOADED_DATA is None:
             raise DatasetError("No dataset loaded.")
+        if sharded:
+            count = write_sharded_cache(os.path.join(self.cache_dir, name), self.LOADED_DATA, shard_bytes=shard_mb * 1024**2)
+            print(f"Cached {count} images to {name}")
+            return
+        if os.path.isdir(os.path.join(self.cache_dir, name)):
+            shutil.rmtree(os.path.join(self.cache_dir, name))  # A sharded cache of the same name
         with open(os.path.join(self.cache_dir, name), "w") as f:
-            json.dump(self.LOADED_DATA, f)
+            if isinstance(self.LOADED_DATA, dict):
+                json.dump(self.LOADED_DATA, f)
+            else:
+                # Decode a compact record store one image at a time
+                f.write("{")
+                for i, image in enumerate(self.LOADED_DATA):
+                    f.write(("" if i == 0 else ", ") + json.dumps(image) + ": " + json.dumps(dict(self.LOADED_DATA[image])))
+                f.write("}")
+
+    def cache_dataset(self, dataset_name: str, name: str, shard_mb: int = 256, options: Optional[dict] = None):
+        """
+        Write a sharded cache (see cache()) of a single dataset straight from its loader, without
+        loading it into LOADED_DATA. Dataset modules with an `iter_load(cache)` generator of
+        (image, image_data) pairs (e.g. visual_genome) are streamed one image at a time.
+
+        :param shard_mb: Approximate size of each shard in MB
+        :param options: Keyword arguments for the loader, e.g. {"group_boxes": True}
+
+        E.g. manager.cache_dataset("visual_genome", "visual_genome_data")
+        """
+        module = _import_dataset_module(dataset_name)
+        try:
+            if hasattr(module, 'iter_load'):
+                records = module.iter_load(self.cache_dir, **(options or {}))
+            else:
+                records = module.load(self.cache_dir, **(options or {})).items()
+            count = write_sharded_records(os.path.join(self.cache_dir, name),
+                                          ((image, {dataset_name: data}) for image, data in records),
+                                          shard_bytes=shard_mb * 1024**2)
+        except Exception as e:
+            raise DatasetError(f"Error loading dataset '{dataset_name}': {str(e)}")
+        print(f"Cached {count} images of {dataset_name} to {name}")
 
-    def load_cache(self, name: str):
+    def load_cache(self, name: str, compact: bool = False, shared: bool = False):
         """
-        Load the dataset from the output json file.
+        Load the dataset from the output json file, or open a sharded cache (see cache()) lazily.
+
+        :param compact: Keep the data in a compact RecordStore instead of plain dicts
+        :param shared: Memory-map a sharded cache read-only (SharedShardedDataset), so processes
+                       using the same cache share its pages instead of each holding a copy
 
         E.g. manager.load_from_cache("base_data.json")
         """
-        if not os.path.exists(os.path.join(self.cache_dir, name)):
+        cache_path = os.path.join(self.cache_dir, name)
+        if not os.path.exists(cache_path):
             raise DatasetError(f"Cache file '{name}' not found.")
+        if os.path.isdir(cache_path):
+            if not is_sharded_cache(cache_path):
+                raise DatasetError(f"'{name}' is not a sharded dataset cache.")
+            data = SharedShardedDataset(cache_path) if shared else ShardedDataset(cache_path)
+            self.LOADED_DATA = RecordStore.from_data(data) if compact else data
+            self._index = None
+            return self.LOADED_DATA
+        if shared:
+            raise DatasetError(f"'{name}' is a JSON file, shared loading needs a sharded cache (see cache(name, sharded=True)).")
         with open(os.path.join(self.cache_dir, name), "r") as f:
-            self.LOADED_DATA = json.load(f)
+            data = json.load(f)
+        if compact:
+            # Encode and release the parsed dicts image by image, so both copies never coexist in full
+            store = RecordStore()
+            while data:
+                image, image_data = data.popitem()
+                store[image] = image_data
+            data = store
+        self.LOADED_DATA = data
+        self._index = None
+        return self.LOADED_DATA
+
+    def compact_records(self):
+        """
+        Convert the loaded data into a RecordStore: float32 box coordinates, int32 label ids
+        against an interned label table and interned dataset names/image sources, behind the
+        same image -> {dataset_name: {...}} mapping interface.
+
+        E.g. manager.compact_records()
+        """
+        if self.LOADED_DATA is None:
+            raise DatasetError("No dataset loaded.")
+        if not isinstance(self.LOADED_DATA, RecordStore):
+            self.LOADED_DATA = RecordStore.from_data(self.LOADED_DATA)
+            self._index = None
         return self.LOADED_DATA
     
+    def start_writer(self, max_batch: int = 64, max_delay: float = 5.0, fsync: str = "none"):
+        """
+        Route cache_image_result through an asynchronous group-commit writer.
+
+        :param max_batch: Commit once this many results are pending
+        :param max_delay: Commit once the oldest pending result has waited this many seconds
+        :param fsync: 'none' (leave it to the OS), 'commit' (fsync every file once per commit)
+                      or 'always' (fsync after every result)
+        """
+        if fsync not in FSYNC_POLICIES:
+            raise DatasetError(f"Unknown fsync policy '{fsync}', expected one of {FSYNC_POLICIES}.")
+        self.close_writer()
+        self.fsync = fsync
+        self._writer = GroupCommitWriter(self._commit_results, max_batch=max_batch, max_delay=max_delay)
+
+    def flush(self):
+        """Commit any results still pending in the group-commit writer."""
+        if self._writer is not None:
+            self._writer.flush()
+
+    def close_writer(self):
+        """Commit pending results and stop the group-commit writer, if one is running."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
     def cache_image_result(self, image_name: str, result_json: Dict, run_id: str = None):
         """
         Cache the result for a specific image.
 
+        Written immediately, or queued for the next group commit when start_writer() was called.
+
         :param image_name: The name of the image (e.g. 'coco/img_1.png')
         :param result_json: The JSON result to cache
         :param run_id: Optional run_id to override the default
@@ -232,130 +493,268 @@ class DatasetManager:
         if run_id is None:
             run_id = self.run_id
 
-        # Create the directory structure if it doesn't exist
-        dir_path = os.path.join(self.cache_dir, "save", os.path.dirname(image_name))
-        os.makedirs(dir_path, exist_ok=True)
-
-        # Create or append to the JSONL file
-        jsonl_path = os.path.join(self.cache_dir, "save", f"{image_name}-{run_id}.jsonl")
-        with open(jsonl_path, 'a') as f:
-            json.dump(result_json, f)
-            f.write('\n')
-
         # Add the result to the loaded data
         if self.LOADED_DATA is not None and image_name in self.LOADED_DATA:
             self.LOADED_DATA[image_name][f"result_{run_id}"] = result_json
-        
-    def cache_image_result(self, image_name: str, result_json: Dict, run_id: str = None):
+
+        if self._writer is not None:
+            self._writer.submit((image_name, result_json, run_id))
+        else:
+            self._commit_results([(image_name, result_json, run_id)])
+
+    def segment_store(self, run_id: str = None) -> SegmentStore:
         """
-        Cache the result for a specific image.
+        The append-only segment store holding a run's results when result_store='segments'.
 
-        :param image_name: The name of the image (e.g. 'coco/img_1.png')
-        :param result_json: The JSON result to cache
         :param run_id: Optional run_id to override the default
         """
         if run_id is None:
             run_id = self.run_id
+        if run_id not in self._segment_stores:
+            self._segment_stores[run_id] = SegmentStore(os.path.join(self.cache_dir, "save"), run_id, compress=self.compress_segments)
+        return self._segment_stores[run_id]
+
+    def compact_results(self, run_id: str = None, compress: bool = None) -> int:
+        """
+        Compact a run's segment store into a single segment (run while no workers are writing).
 
-        # Create the directory structure if it doesn't exist
-        dir_path = os.path.join(self.cache_dir, "save", os.path.dirname(image_name))
-        os.makedirs(dir_path, exist_ok=True)
+        :param run_id: Optional run_id to override the default
+        :param compress: Whether to zstd-compress the compacted segment, defaults to compress_segments
+        :return: Number of compacted records
+        """
+        return self.segment_store(run_id).compact(compress=compress)
+
+    def _commit_results(self, batch):
+        """
+        Append a group of (image_name, result_json, run_id) results to their JSONL files
+        (or to the run's segment), then update each run's indicator file once for the whole group.
+        """
+        save_dir = os.path.join(self.cache_dir, "save")
+        if self.result_store == "segments":
+            for run_id in {run_id for _, _, run_id in batch}:
+                records = [(image_name, result_json) for image_name, result_json, record_run_id in batch if record_run_id == run_id]
+                self.segment_store(run_id).append(records, fsync=self.fsync)
+            batch_files = []
+        else:
+            batch_files = batch
+        touched_files = set()
+        new_entry_dirs = set()  # Directories that got a new file or subdirectory in this group
+        for image_name, result_json, run_id in batch_files:
+            # Create the directory structure if it doesn't exist (once per directory)
+            dir_path = os.path.join(save_dir, os.path.dirname(image_name))
+            if dir_path not in self._known_dirs:
+                if self.fsync != "none":
+                    missing = dir_path
+                    while not os.path.exists(missing):
+                        new_entry_dirs.add(os.path.dirname(missing))
+                        missing = os.path.dirname(missing)
+                os.makedirs(dir_path, exist_ok=True)
+                self._known_dirs.add(dir_path)
+
+            # Create or append to the JSONL file
+            jsonl_path = os.path.join(save_dir, f"{image_name}-{run_id}.jsonl")
+            if self.fsync != "none" and jsonl_path not in touched_files and not os.path.exists(jsonl_path):
+                new_entry_dirs.add(os.path.dirname(jsonl_path))
+            with open(jsonl_path, 'a') as f:
+                f.write(json.dumps(result_json) + '\n')
+                if self.fsync == "always":
+                    f.flush()
+                    os.fsync(f.fileno())
+            touched_files.add(jsonl_path)
+
+        if self.fsync == "commit":
+            # One fsync per file for the whole group
+            for jsonl_path in touched_files:
+                fd = os.open(jsonl_path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+        if self.fsync != "none":
+            for directory in new_entry_dirs:
+                _fsync_dir(directory)
+
+        # Update the indicator file once per run_id in the group
+        indicator_dir = os.path.join(save_dir, "indicators")
+        os.makedirs(indicator_dir, exist_ok=True)
+        for run_id in {run_id for _, _, run_id in batch}:
+            indicator_file_path = os.path.join(indicator_dir, f"indicator_{run_id}.txt")
+            with open(indicator_file_path, 'w') as f:
+                f.write('')
 
-        # Create or append to the JSONL file
+    def has_result(self, image_name: str, run_id: str = None) -> bool:
+        """
+        Check if a non-empty result has already been cached for an image.
+
+        :param image_name: The name of the image (e.g. 'coco/img_1.png')
+        :param run_id: Optional run_id to override the default
+        """
+        if run_id is None:
+            run_id = self.run_id
+        if self.result_store == "segments":
+            return image_name in self.segment_store(run_id).index()
         jsonl_path = os.path.join(self.cache_dir, "save", f"{image_name}-{run_id}.jsonl")
-        with open(jsonl_path, 'a') as f:
-            json.dump(result_json, f)
+        try:
+            return os.path.getsize(jsonl_path) > 0
+        except OSError:
+            return False
+
+    def record_skip(self, image_name: str, reason: str, run_id: str = None):
+        """
+        Record that an image was skipped before processing, so it is not reserved again.
+
+        :param image_name: The name of the image (e.g. 'coco/img_1.png')
+        :param reason: Short reason code (e.g. 'information_length', 'not_found')
+        :param run_id: Optional run_id to override the default
+        """
+        if run_id is None:
+            run_id = self.run_id
+        skipped_dir = os.path.join(self.cache_dir, "save", "skipped")
+        os.makedirs(skipped_dir, exist_ok=True)
+        with open(os.path.join(skipped_dir, f"skipped_{run_id}.jsonl"), 'a') as f:
+            json.dump({"image": image_name, "reason": reason}, f)
             f.write('\n')
 
-        # Add the result to the loaded data
-        if self.LOADED_DATA is not None and image_name in self.LOADED_DATA:
-            self.LOADED_DATA[image_name][f"result_{run_id}"] = result_json
+    def load_skipped(self, run_id: str = None) -> Dict[str, str]:
+        """
+        Load the images skipped for a given run_id.
 
-        # Update the indicator file
-        indicator_dir = os.path.join(self.cache_dir, "save", "indicators")
-        os.makedirs(indicator_dir, exist_ok=True)
-        indicator_file_path = os.path.join(indicator_dir, f"indicator_{run_id}.txt")
-        with open(indicator_file_path, 'w') as f:
-            f.write('')
+        :param run_id: Optional run_id to override the default
+        :return: Dictionary mapping image names to their skip reason
+        """
+        if run_id is None:
+            run_id = self.run_id
+        skipped_path = os.path.join(self.cache_dir, "save", "skipped", f"skipped_{run_id}.jsonl")
+        skipped = {}
+        if not os.path.exists(skipped_path):
+            return skipped
+        with open(skipped_path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    skipped[entry["image"]] = entry["reason"]
+        return skipped
 
-    def collect_results(self, run_id: str = None):
+    def record_failure(self, image_name: str, stage: str, error_type: str, message: str = "", run_id: str = None):
         """
-        Collect all results for a given run_id.
+        Record a failed processing attempt for an image in the dead-letter store.
 
-        :param run_id: Optional run_id to override the default. If "ALL", collect all results.
-        :return: Dictionary mapping image names to results
+        :param image_name: The name of the image (e.g. 'coco/img_1.png')
+        :param stage: Pipeline stage that failed (e.g. 'qa_conversion', 'vision', 'process')
+        :param error_type: Reason code, e.g. PromptManagerError.error_type or 'empty_result'
+        :param message: Optional error details
+        :param run_id: Optional run_id to override the default
         """
         if run_id is None:
             run_id = self.run_id
+        dead_letter_dir = os.path.join(self.cache_dir, "save", "dead_letter")
+        os.makedirs(dead_letter_dir, exist_ok=True)
+        with open(os.path.join(dead_letter_dir, f"dead_letter_{run_id}.jsonl"), 'a') as f:
+            json.dump({"image": image_name, "stage": stage, "error_type": error_type, "message": message[:500]}, f)
+            f.write('\n')
 
-        cache_file_name = f"{run_id}_results_cache.json"
-        cache_file_path = os.path.join(self.cache_dir, "save", cache_file_name)
-        indicator_dir = os.path.join(self.cache_dir, "save", "indicators")
-        indicator_file_path = os.path.join(indicator_dir, f"indicator_{run_id}.txt")
+    def load_dead_letters(self, run_id: str = None) -> Dict[str, Dict]:
+        """
+        Load the dead-letter store for a given run_id, one entry per failed image.
 
-        # Check if cache file and indicator file exist
-        if os.path.exists(cache_file_path) and os.path.exists(indicator_file_path):
-            cache_mtime = os.path.getmtime(cache_file_path)
-            indicator_mtime = os.path.getmtime(indicator_file_path)
+        :param run_id: Optional run_id to override the default
+        :return: Dictionary mapping image names to their attempt count and latest failure
+        """
+        if run_id is None:
+            run_id = self.run_id
+        dead_letter_path = os.path.join(self.cache_dir, "save", "dead_letter", f"dead_letter_{run_id}.jsonl")
+        dead_letters = {}
+        if not os.path.exists(dead_letter_path):
+            return dead_letters
+        with open(dead_letter_path, 'r') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                failure = json.loads(line)
+                attempts = dead_letters.get(failure["image"], {}).get("attempts", 0) + 1
+                dead_letters[failure["image"]] = {
+                    "attempts": attempts,
+                    "stage": failure["stage"],
+                    "error_type": failure["error_type"],
+                    "message": failure.get("message", "")
+                }
+        return dead_letters
 
-            if cache_mtime >= indicator_mtime:
-                # Cache is up to date; load results from cache
-                with open(cache_file_path, 'r') as f:
-                    all_results = json.load(f)
-                return all_results
-        
-        # Else, need to reload all files and overwrite cache
-        all_results = {}
-        print("Loading results from files, may take awhile...")
+    def dead_letter_report(self, run_id: str = None) -> dict:
+        """
+        Summarize failed and skipped images for a given run_id.
+
+        :param run_id: Optional run_id to override the default
+        :return: Counts of failures by stage/error_type, attempts, and skip reasons
+        """
+        if run_id is None:
+            run_id = self.run_id
+        dead_letters = self.load_dead_letters(run_id)
+        failures = {}
+        attempts = {}
+        for entry in dead_letters.values():
+            key = f"{entry['stage']}/{entry['error_type']}"
+            failures[key] = failures.get(key, 0) + 1
+            attempts[entry["attempts"]] = attempts.get(entry["attempts"], 0) + 1
+        skipped = {}
+        for reason in self.load_skipped(run_id).values():
+            skipped[reason] = skipped.get(reason, 0) + 1
+        exhausted = 0
+        if self.max_attempts is not None:
+            exhausted = sum(1 for entry in dead_letters.values() if entry["attempts"] >= self.max_attempts)
+        return {
+            "failed_images": len(dead_letters),
+            "exhausted_images": exhausted,
+            "failures": failures,
+            "attempts": dict(sorted(attempts.items())),
+            "skipped": skipped
+        }
+
+    def collect_results(self, run_id: str = None, workers: int = 8):
+        """
+        Collect all results for a given run_id.
+
+        :param run_id: Optional run_id to override the default. If "ALL", collect all results.
+        :param workers: Number of threads scanning the save directory
+        :return: Dictionary mapping image names to results
+        """
+        if run_id is None:
+            run_id = self.run_id
 
         save_dir = os.path.join(self.cache_dir, "save")
-        for root, _, files in os.walk(save_dir):
-            for file in files:
-                # Skip the cache file and indicator files
-                if file == cache_file_name or file.startswith('indicator_'):
-                    continue
+        indicator_dir = os.path.join(save_dir, "indicators")
+        indicator_file_path = os.path.join(indicator_dir, f"indicator_{run_id}.txt")
 
-                # Check if the file corresponds to the run_id or if we're collecting all runs
-                if run_id == "ALL" or file.endswith(f"-{run_id}.jsonl"):
-                    file_path = os.path.join(root, file)
-                    with open(file_path, 'r') as f:
-                        # Read all JSON lines from the file
-                        results = [json.loads(line) for line in f]
-
-                    # Extract the image name from the file path
-                    rel_file_path = os.path.relpath(file_path, save_dir)
-                    # Remove the run_id and extension from the file name to get the image name
-                    if run_id == "ALL":
-                        # Remove the last suffix that matches '-<run_id>.jsonl'
-                        base_name = rel_file_path.rsplit('-', 1)[0]
-                        image_name = base_name
-                    else:
-                        suffix = f"-{run_id}.jsonl"
-                        if rel_file_path.endswith(suffix):
-                            image_name = rel_file_path[:-len(suffix)]
-                        else:
-                            image_name = rel_file_path[:-len('.jsonl')]
-
-                    # Normalize path separators
-                    image_name = image_name.replace(os.sep, '/')
-
-                    # If multiple results per image are possible, store them in a list
-                    if image_name in all_results:
-                        all_results[image_name].extend(results)
-                    else:
-                        all_results[image_name] = results
-
-        # Save the combined data into the cache file
-        with open(cache_file_path, 'w') as f:
-            json.dump(all_results, f)
-
-        return all_results
+        # Cache is up to date; load results from the aggregate
+        results_cache = IncrementalResultsCache(save_dir, run_id)
+        if results_cache.is_fresh(indicator_file_path):
+            return results_cache.results()
+
+        # Else, merge only new or changed result files and segments into the aggregate
+        print("Updating results cache...")
+        results_cache.load()
+
+        for batch in scan_results(save_dir, run_id, workers=workers):
+            for entry in batch:
+                results_cache.ingest_file(os.path.relpath(entry.path, save_dir), entry.path, entry.image, size=entry.size, mtime=entry.mtime)
+
+        # Read new records of the segment stores sequentially
+        segment_run_ids = SegmentStore.run_ids(save_dir) if run_id == "ALL" else [run_id]
+        for segment_run_id in segment_run_ids:
+            store = self.segment_store(segment_run_id)
+            for segment in store.segments():
+                results_cache.ingest_segment(f"segments/{segment_run_id}/{segment}", store, segment)
+
+        # Save the merged changes into the aggregate
+        results_cache.commit()
+        return results_cache.results()
     
-    def count_results(self, run_id: str = None) -> dict:
+    def count_results(self, run_id: str = None, workers: int = 8) -> dict:
         """
         Quickly count the number of result files for a given run_id without loading their contents.
 
         :param run_id: Optional run_id to override the default. If "ALL", count all results.
+        :param workers: Number of threads scanning the save directory
         :return: 'total_files' the total number of result files
         """
         if run_id is None:
@@ -364,32 +763,21 @@ class DatasetManager:
         save_dir = os.path.join(self.cache_dir, "save")
         file_count = 0
 
-        for root, _, files in os.walk(save_dir):
-            for file in files:
-                # Skip cache and indicator files
-                if file.endswith('_results_cache.json') or file.startswith('indicator_'):
-                    continue
+        for batch in scan_results(save_dir, run_id, workers=workers):
+            file_count += len(batch)
 
-                # Check if the file corresponds to the run_id or if we're collecting all runs
-                if run_id == "ALL" or file.endswith(f"-{run_id}.jsonl"):
-                    file_count += 1
+        segment_run_ids = SegmentStore.run_ids(save_dir) if run_id == "ALL" else [run_id]
+        for segment_run_id in segment_run_ids:
+            file_count += self.segment_store(segment_run_id).count()
 
         return file_count
 
-    @staticmethod
-    def _remove_file(file_path):
-        try:
-            os.remove(file_path)
-            return file_path
-        except FileNotFoundError:
-            return None
-
-    def clean(self, run_id: str = None, workers: int = 1, empty_only: bool = True):
+    def clean(self, run_id: str = None, workers: int = 8, empty_only: bool = True):
         """
-        Remove files of a given run_id using multiprocessing.
+        Remove files of a given run_id, scanning and checking files in parallel threads.
 
         :param run_id: The run_id to clean. If None, uses the default run_id.
-        :param workers: Number of worker processes to use. If None, uses os.cpu_count().
+        :param workers: Number of threads used to scan, check and remove files.
         :param empty_only: If True, only remove files with content length < 3 characters.
         """
         if run_id is None:
@@ -400,28 +788,32 @@ class DatasetManager:
             print(f"No data found in save directory: {save_dir}")
             return
 
-        def find_files(directory):
-            for root, _, files in os.walk(directory):
-                for file in files:
-                    if file.endswith(f"-{run_id}.jsonl"):
-                        yield os.path.join(root, file)
-
-        # Find all files to potentially remove
-        files_to_check = list(find_files(save_dir))
-
-        # Use multiprocessing to check and remove files
-        with Pool(workers) as pool:
-            removed_files = pool.starmap(self._check_and_remove_file, [(file, empty_only) for file in files_to_check])
-
-        removed_count = sum(1 for file in removed_files if file is not None)
+        # Segment stores: drop reservations without results, or the whole run
+        store = self.segment_store(run_id)
+        if empty_only:
+            store.clear_reservations()
+        else:
+            store.remove()
+
+        # Check and remove each scanned batch of files while the scan continues
+        removed_dirs = set()
+        removed_count = 0
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for batch in scan_results(save_dir, run_id, workers=workers):
+                for entry, removed in zip(batch, executor.map(lambda entry: self._check_and_remove_file(entry, empty_only), batch)):
+                    if removed:
+                        removed_count += 1
+                        removed_dirs.add(os.path.dirname(entry.path))
         print(f"Cleaned {removed_count} files for run_id: {run_id}")
 
-        # Remove empty directories
-        for root, dirs, files in os.walk(save_dir, topdown=False):
-            for dir_name in dirs:
-                dir_path = os.path.join(root, dir_name)
-                if not os.listdir(dir_path):
+        # Remove directories left empty, walking up from where files were removed
+        for dir_path in sorted(removed_dirs, key=len, reverse=True):
+            while dir_path != save_dir and dir_path.startswith(save_dir):
+                try:
                     os.rmdir(dir_path)
+                except OSError:
+                    break  # Not empty (or already removed)
+                dir_path = os.path.dirname(dir_path)
 
         # Optionally, remove the entire save directory if it's empty
         if not os.listdir(save_dir):
@@ -430,46 +822,31 @@ class DatasetManager:
 
         # Update the run id indicator file
         indicator_dir = os.path.join(save_dir, "indicators")
+        os.makedirs(indicator_dir, exist_ok=True)
         indicator_file_path = os.path.join(indicator_dir, f"indicator_{run_id}.txt")
         with open(indicator_file_path, 'w') as f:
             f.write('')
 
-    def _check_and_remove_file(self, file_path: str, empty_only: bool) -> str:
+    @staticmethod
+    def _check_and_remove_file(entry: ResultEntry, empty_only: bool) -> bool:
         """
-        Check if a file should be removed and remove it if necessary.
+        Check if a scanned result file should be removed and remove it if necessary.
 
-        :param file_path: Path to the file to check and potentially remove.
-        :param empty_only: If True, only remove files with minimal content length or 
-                        files that contain only an empty list '[]'.
-        :return: The path of the removed file, or None if not removed.
+        :param entry: ResultEntry from the save directory scan (its size avoids another stat).
+        :param empty_only: If True, only remove files with minimal content length or
+                        files that do not start with a JSON list.
+        :return: True if the file was removed.
         """
-        if empty_only:
-            try:
-                # Get file stats
-                file_info = os.stat(file_path)
-                file_size = file_info.st_size
-
-                # check if first 5 characters are "Error"
-                with open(file_path, 'r') as f:
-                    first_char = f.read(1)
-                    if first_char != '[':
-                        os.remove(file_path)
-                        return file_path
-                
-                # Check if file is very small
-                if file_size < 3:
-                    os.remove(file_path)
-                    return file_path
-                else:
-                    return None
-            except (IOError, OSError):
-                return None
-
         try:
-            os.remove(file_path)
-            return file_path
+            if empty_only and entry.size >= 3:
+                # Results are JSON lists, anything else is an error or a torn write
+                with open(entry.path, 'rb') as f:
+                    if f.read(1) == b'[':
+                        return False
+            os.remove(entry.path)
+            return True
         except OSError:
-            return None
+            return False
         
     def _download_dataset(self, dataset_name: str):
         try:
@@ -483,18 +860,8 @@ class DatasetManager:
         except Exception as e:
             raise DatasetError(f"Error downloading dataset '{dataset_name}': {str(e)}")
 
-    def _load_dataset(self, dataset_name: str):
-        try:
-            module = importlib.import_module(f"dataset.{dataset_name}")
-            if not hasattr(module, 'load'):
-                raise DatasetError(f"Dataset '{dataset_name}' does not have a load function.")
-            dataset = module.load(self.cache_dir)
-            print(f"Loaded {dataset_name}")
-            return dataset_name, dataset
-        except ImportError:
-            raise DatasetError(f"Dataset '{dataset_name}' not found or failed to import.")
-        except Exception as e:
-            raise DatasetError(f"Error loading dataset '{dataset_name}': {str(e)}")
+    def _load_dataset(self, dataset_name: str, options: Optional[dict] = None):
+        return dataset_name, _load_dataset_module(self.cache_dir, dataset_name, options)
 
     def _merge_dataset(self, merged_data: Dict[str, Dict[str, any]], dataset_name: str, dataset: any):
         for image_path, data in dataset.items():
@@ -508,12 +875,8 @@ class DatasetManager:
     def __str__(self):
         if self.LOADED_DATA is None or not self.LOADED_DATA:
             return "DatasetManager(LOADED_DATA=None)"
-        dataset_info = {}
-        for img, data in self.LOADED_DATA.items():
-            for dataset_name in data.keys():
-                if dataset_name not in dataset_info:
-                    dataset_info[dataset_name] = 0
-                dataset_info[dataset_name] += 1
+        index = self.dataset_index()
+        dataset_info = {k: len(v) for k, v in index.by_dataset.items() if v}
             
         dataset_info_str = "\t" + "\n\t".join([f"{k}: {v} images" for k, v in dataset_info.items()])
         return f"DatasetManager ({len(self.LOADED_DATA)} images) with loaded datasets:\n{dataset_info_str}"
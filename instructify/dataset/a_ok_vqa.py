@@ -1,6 +1,6 @@
 import os
 import json
-import requests
+from download import download_file
 import tarfile
 
 def download(cache):
@@ -20,9 +20,7 @@ def download(cache):
     
     # Download the dataset
     print(f"Downloading {dataset_name}...")
-    response = requests.get(url, stream=True)
-    with open(tar_path, 'wb') as f:
-        f.write(response.content)
+    download_file(url, tar_path)
     
     # Extract the tar.gz file
     print(f"Extracting {dataset_name}...")
@@ -1,9 +1,7 @@
 import os
 import os
-import re
-import json
-import requests
-from zipfile import ZipFile
+from zip_stream import extract_zip
+from json_stream import iter_json_arrays
 
 def download(cache):
     dataset_path = os.path.join(cache, "coco_captions")
@@ -12,7 +10,6 @@ def download(cache):
     
     # URL for the COCO captions dataset
     url = "http://images.cocodataset.org/annotations/annotations_trainval2017.zip"
-    zip_path = os.path.join(dataset_path, "annotations_trainval2017.zip")
     
     # Check if the dataset is already downloaded
     downloaded_flag = os.path.join(dataset_path, "downloaded")
@@ -20,19 +17,9 @@ def download(cache):
         print("Dataset already downloaded.")
         return
 
-    # Download the dataset
-    print("Downloading dataset...")
-    response = requests.get(url)
-    with open(zip_path, 'wb') as f:
-        f.write(response.content)
-
-    # Unzip the downloaded file
-    print("Extracting dataset...")
-    with ZipFile(zip_path, 'r') as zip_ref:
-        zip_ref.extractall(dataset_path)
-
-    # Remove the zip file
-    os.remove(zip_path)
+    # Stream the two annotation files load() reads out of the archive
+    print("Downloading and extracting dataset...")
+    extract_zip(url, dataset_path, members=["annotations/captions_train2017.json", "annotations/instances_train2017.json"])
 
     # Create a flag to indicate successful download
     with open(downloaded_flag, 'w') as f:
@@ -43,49 +30,38 @@ def load(cache):
     captions_file = os.path.join(dataset_path, "annotations", "captions_train2017.json")
     instances_file = os.path.join(dataset_path, "annotations", "instances_train2017.json")
 
-    with open(captions_file) as f:
-        coco_captions_total_data = json.load(f)
-        coco_captions_annotations = coco_captions_total_data["annotations"]
-
-    # Load instances file as text and remove the "segmentation" sections using regex
-    with open(instances_file) as f:
-        instances_data_text = f.read()
-
-    # Regular expression to remove the "segmentation": [...] sections
-    instances_data_text = re.sub(r'"segmentation": \[\[.*?\]\],?', '', instances_data_text)
-
-    # Parse the cleaned-up text as JSON
-    coco_instances_data = json.loads(instances_data_text)
-    coco_instances_annotations = coco_instances_data["annotations"]
-
-    # Create a mapping from category ID to category name
-    category_id_to_name = {category['id']: category['name'] for category in coco_instances_data['categories']}
-
-    # Create a mapping from image ID to image path
+    # Map image IDs to image paths and sizes, and group the captions by image
     coco_captions_image_id_mapping = {}
     coco_captions_image_size_mapping = {}
-    for row in coco_captions_total_data["images"]:
-        coco_captions_image_id_mapping[row["id"]] = "coco/train2017/" + row["file_name"]
-        coco_captions_image_size_mapping[row["id"]] = (row["width"], row["height"])
+    captions_by_image = {}
+    for key, row in iter_json_arrays(captions_file, ("images", "annotations")):
+        if key == "images":
+            coco_captions_image_id_mapping[row["id"]] = "coco/train2017/" + row["file_name"]
+            coco_captions_image_size_mapping[row["id"]] = (row["width"], row["height"])
+        else:
+            captions_by_image.setdefault(row["image_id"], []).append(row["caption"])
 
     coco_captions = {}
 
     # Load captions
-    for row in coco_captions_annotations:
-        image_id = row["image_id"]
+    for image_id, captions in captions_by_image.items():
         image_path = coco_captions_image_id_mapping[image_id]
-        if image_path not in coco_captions:
-            coco_captions[image_path] = {
-                "image_id": str(image_id),
-                "image_source": "coco/train2017",
-                "bboxes": [],
-                "captions": [],
-                "QA": []       # No QA
-            }
-        coco_captions[image_path]["captions"].append(row["caption"])
-
-    # Load bounding boxes with category names
-    for row in coco_instances_annotations:
+        coco_captions[image_path] = {
+            "image_id": str(image_id),
+            "image_source": "coco/train2017",
+            "bboxes": [],
+            "captions": captions,
+            "QA": []       # No QA
+        }
+
+    # Stream the instances, stepping over the "segmentation" polygons and RLE masks without decoding them.
+    # The categories come after the annotations, so boxes hold their category ID until the end
+    category_id_to_name = {}
+    boxes = []
+    for key, row in iter_json_arrays(instances_file, ("annotations", "categories"), skip_keys=("segmentation", )):
+        if key == "categories":
+            category_id_to_name[row["id"]] = row["name"]
+            continue
         image_id = row["image_id"]
         image_path = coco_captions_image_id_mapping.get(image_id)
 
@@ -99,10 +75,13 @@ def load(cache):
             x2 = (x + w) / width
             y2 = (y + h) / height
 
-            # Get the category name from the ID
-            category_name = category_id_to_name.get(row["category_id"], "unknown")
+            box = [row["category_id"], x1, y1, x2, y2]
+            coco_captions[image_path]["bboxes"].append(box)
+            boxes.append(box)
 
-            coco_captions[image_path]["bboxes"].append([category_name, x1, y1, x2, y2])
+    # Get the category names from the IDs
+    for box in boxes:
+        box[0] = category_id_to_name.get(box[0], "unknown")
 
     return coco_captions
 
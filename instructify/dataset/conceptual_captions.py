@@ -1,115 +1,28 @@
-import pandas as pd
-import numpy as np
-import requests
-import zlib
 import os
-import shelve
+import json
+import zlib
 import magic
-from multiprocessing import Pool
-from tqdm import tqdm
 from datasets import load_dataset
+from async_fetch import fetch_all
 
-def _df_split_apply(tup_arg):
-    split_ind, subset, func = tup_arg
-    r = subset.apply(func, axis=1)
-    return (split_ind, r)
-
-def _file_name(row):
-    return "%s/%s_%s" % (row['folder'], row.name, (zlib.crc32(row['url'].encode('utf-8')) & 0xffffffff))
-
-def check_if_downloaded(row):
-    fname = _file_name(row)
-    return os.path.isfile(fname)
-
-def df_multiprocess(df, processes, chunk_size, func, dataset_name):
-    print("Checking existing downloads and generating parts...")
-    with shelve.open('%s_%s_%s_results.tmp' % (dataset_name, func.__name__, chunk_size)) as results:
-        
-        # First, identify which chunks need processing
-        chunks_to_process = []
-        for index, i in enumerate(range(0, len(df), chunk_size)):
-            chunk = df[i:i + chunk_size]
-            
-            # Skip if chunk is already in results
-            if str(index) in results.keys():
-                continue
-                
-            # Check if any files in this chunk need downloading
-            needs_download = False
-            for _, row in chunk.iterrows():
-                if not check_if_downloaded(row):
-                    needs_download = True
-                    break
-            
-            if needs_download:
-                chunks_to_process.append((index, chunk))
-            else:
-                # If all files exist, create result entry with status 200
-                processed_chunk = chunk.copy()
-                processed_chunk['status'] = 200
-                processed_chunk['file'] = processed_chunk.apply(lambda x: _file_name(x), axis=1)
-                processed_chunk['mimetype'] = processed_chunk['file'].apply(lambda x: magic.from_file(x, mime=True))
-                processed_chunk['size'] = processed_chunk['file'].apply(lambda x: os.stat(x).st_size)
-                results[str(index)] = (index, processed_chunk)
+HEADERS = {
+    'User-Agent': 'Googlebot-Image/1.0',
+    'X-Forwarded-For': '64.18.15.200'
+}
 
-        total_chunks = len(chunks_to_process)
-        if total_chunks == 0:
-            print("All images already downloaded!")
-            return
-            
-        print(f"Found {total_chunks} chunks containing new images to download")
-        print(f"Using {processes} processes, {chunk_size} images per chunk")
+def _file_name(folder, index, url):
+    return "%s/%s_%s" % (folder, index, (zlib.crc32(url.encode('utf-8')) & 0xffffffff))
 
-        pbar = tqdm(total=sum(len(chunk) for _, chunk in chunks_to_process), position=0)
-        pbar.desc = "Downloading"
-        
-        pool_data = ((index, chunk, func) for index, chunk in chunks_to_process)
-        with Pool(processes) as pool:
-            for i, result in enumerate(pool.imap_unordered(_df_split_apply, pool_data, 2)):
-                results[str(result[0])] = result
-                pbar.update(len(result[1]))
-        pbar.close()
+def _sniff(heads):
+    return [magic.from_buffer(head, mime=True) for head in heads]
 
-    print("Finished Downloading.")
-    return
-    
-def download_image(row):
-    fname = _file_name(row)
-    headers = {
-        'User-Agent': 'Googlebot-Image/1.0',
-        'X-Forwarded-For': '64.18.15.200'
-    }
-    
-    # Skip Already downloaded
-    if os.path.isfile(fname):
-        row['status'] = 200
-        row['file'] = fname
-        row['mimetype'] = magic.from_file(row['file'], mime=True)
-        row['size'] = os.stat(row['file']).st_size
-        return row
-
-    try:
-        response = requests.get(row['url'], stream=False, timeout=10, allow_redirects=True, headers=headers)
-        row['status'] = response.status_code
-    except Exception as e:
-        row['status'] = 408
-        return row
-   
-    if response.ok:
-        try:
-            with open(fname, 'wb') as out_file:
-                response.raw.decode_content = True
-                out_file.write(response.content)
-            row['mimetype'] = magic.from_file(fname, mime=True)
-            row['size'] = os.stat(fname).st_size
-        except:
-            row['status'] = 408
-            return row
-        row['file'] = fname
-    return row
+def download(cache, connections=256, per_host=8):
+    """
+    Download and process the Conceptual Captions dataset.
 
-def download(cache):
-    """Download and process the Conceptual Captions dataset."""
+    The ~3M images are fetched with asyncio (see async_fetch.fetch_all), and every finished URL
+    is recorded in download.ledger, so an interrupted download skips them when restarted.
+    """
     dataset_path = os.path.join(cache, "conceptual_captions")
     if not os.path.exists(dataset_path):
         os.makedirs(dataset_path)
@@ -121,43 +34,33 @@ def download(cache):
     
     print("Loading Conceptual Captions dataset...")
     dataset = load_dataset("google-research-datasets/conceptual_captions", "labeled", split="train")
-    
-    # Convert dataset to dataframe
-    df = pd.DataFrame({
-        'url': dataset['image_url'],
-        'caption': dataset['caption'],
-        'labels': dataset['labels']
-    })
+    urls = dataset['image_url']
     
     # Set up folder for downloads
-    df['folder'] = os.path.join(dataset_path, "images")
-    if not os.path.exists(df['folder'].iloc[0]):
-        os.makedirs(df['folder'].iloc[0])
-    
-    # Download images using multiprocessing
-    num_processes = 32
-    images_per_part = 100
-    df_multiprocess(df=df, processes=num_processes, chunk_size=images_per_part, 
-                   func=download_image, dataset_name="train")
+    images_path = os.path.join(dataset_path, "images")
+    if not os.path.exists(images_path):
+        os.makedirs(images_path)
     
-    # Gather results
-    print("Collecting results...")
-    with shelve.open('train_download_image_%s_results.tmp' % images_per_part) as results:
-        keylist = sorted([int(k) for k in results.keys()])
-        final_df = pd.concat([results[str(k)][1] for k in keylist], sort=True)
+    # Download images, files are named by row index and URL checksum
+    jobs = ((str(index), url, _file_name(images_path, index, url)) for index, url in enumerate(urls))
+    ledger = fetch_all(jobs, os.path.join(dataset_path, "download.ledger"), headers=HEADERS,
+                       connections=connections, per_host=per_host, sniff=_sniff, total=len(urls))
     
     # Save metadata only for successful downloads
-    successful_downloads = final_df[final_df['status'] == 200]
+    captions = dataset['caption']
+    labels = dataset['labels']
     metadata = {}
-    for _, row in successful_downloads.iterrows():
-        filename = os.path.basename(row['file'])
+    for index in range(len(urls)):
+        status, size, mimetype = ledger.entries.get(str(index), (None, 0, ""))
+        if status != 200:
+            continue
+        filename = os.path.basename(_file_name(images_path, index, urls[index]))
         metadata[filename] = {
-            'caption': row['caption'],
-            'labels': row['labels']
+            'caption': captions[index],
+            'labels': labels[index]
         }
     
     # Save metadata as JSON
-    import json
     with open(os.path.join(dataset_path, "metadata.json"), 'w') as f:
         json.dump(metadata, f)
     
@@ -165,8 +68,8 @@ def download(cache):
     with open(processed_flag, 'w') as f:
         f.write("")
     
-    print(f"Download complete. Successfully downloaded: {len(successful_downloads)}")
-    print(f"Failed downloads: {len(final_df) - len(successful_downloads)}")
+    print(f"Download complete. Successfully downloaded: {len(metadata)}")
+    print(f"Failed downloads: {len(urls) - len(metadata)}")
 
 def load(cache):
     """Load the processed dataset."""
@@ -1,7 +1,6 @@
 import os
 import json
-import requests
-from zipfile import ZipFile
+from zip_stream import extract_zip
 
 # Requires Kaggle Authentication
 #   Get key from Kaggle account settings
@@ -21,7 +20,6 @@ def download(cache):
 
     # URL for the Kaggle dataset
     url = "https://www.kaggle.com/api/v1/datasets/download/hsankesara/flickr-image-dataset"
-    zip_path = os.path.join(dataset_path, "archive.zip")
     
     # Configure Kaggle API authentication
     # You need to have your Kaggle API token in ~/.kaggle/kaggle.json
@@ -34,27 +32,14 @@ def download(cache):
     except FileNotFoundError:
         raise Exception("Please set up your Kaggle API credentials in ~/.kaggle/kaggle.json")
 
-    # Download the dataset
-    print("Downloading dataset...")
-    response = requests.get(url, headers=headers, stream=True)
-    if response.status_code == 200:
-        with open(zip_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-    else:
-        raise Exception(f"Failed to download dataset: {response.status_code}")
-
-    # Unzip the downloaded file
-    print("Extracting dataset...")
-    with ZipFile(zip_path, 'r') as zip_ref:
-        zip_ref.extractall(dataset_path)
+    # Download and extract the dataset
+    print("Downloading and extracting dataset...")
+    extract_zip(url, dataset_path, headers=headers)
     
     # Get results.csv
     os.rename(os.path.join(dataset_path, "flickr30k_images/results.csv"), os.path.join(dataset_path, "results.csv"))
     os.rmdir(os.path.join(dataset_path, "flickr30k_images"))
 
-    # Remove the zip file
-    os.remove(zip_path)
 
     # Create a flag to indicate successful download
     with open(downloaded_flag, 'w') as f:
@@ -1,8 +1,7 @@
 import os
 import json
-import requests
+from zip_stream import extract_zip
 import tqdm
-from zipfile import ZipFile
 
 # Images download:
 # https://downloads.cs.stanford.edu/nlp/data/gqa/images.zip
@@ -34,13 +33,8 @@ def download(cache):
     for url in urls:
         file_name = os.path.join(dataset_dir, os.path.basename(url))
         if not os.path.exists(file_name.replace('.zip', '')):
-            print(f"Downloading {url} to {file_name}...")
-            response = requests.get(url)
-            with open(file_name, "wb") as f:
-                f.write(response.content)
-            with ZipFile(file_name, 'r') as zip_ref:
-                zip_ref.extractall(dataset_dir)
-            os.remove(file_name)
+            print(f"Downloading and extracting {url}...")
+            extract_zip(url, dataset_dir)
 
     # Create a file to indicate the dataset has been downloaded
     with open(os.path.join(dataset_dir, "downloaded"), "w") as f:
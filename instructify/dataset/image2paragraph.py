@@ -1,8 +1,7 @@
 import os
 import json
-import requests
+from zip_stream import extract_zip
 import pandas as pd
-from zipfile import ZipFile
 
 def download(cache):
     dataset_path = os.path.join(cache, "image2paragraph")
@@ -17,7 +16,6 @@ def download(cache):
 
     # URL for the dataset
     url = "https://www.kaggle.com/api/v1/datasets/download/vakadanaveen/stanford-image-paragraph-captioning-dataset"
-    zip_path = os.path.join(dataset_path, "archive.zip")
     
     # Configure Kaggle API authentication
     try:
@@ -29,20 +27,9 @@ def download(cache):
     except FileNotFoundError:
         raise Exception("Please set up your Kaggle API credentials in ~/.kaggle/kaggle.json")
 
-    # Download the dataset
-    print("Downloading dataset...")
-    response = requests.get(url, headers=headers, stream=True)
-    if response.status_code == 200:
-        with open(zip_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-    else:
-        raise Exception(f"Failed to download dataset: {response.status_code}")
-
-    # Unzip the downloaded file
-    print("Extracting dataset...")
-    with ZipFile(zip_path, 'r') as zip_ref:
-        zip_ref.extractall(dataset_path)
+    # Download and extract the dataset
+    print("Downloading and extracting dataset...")
+    extract_zip(url, dataset_path, headers=headers)
     
     # move stanford_img/content/stanford_images/ to images/
     stanford_images_path = os.path.join(dataset_path, "stanford_img/content/stanford_images")
@@ -51,8 +38,6 @@ def download(cache):
     os.rmdir(os.path.join(dataset_path, "stanford_img/content"))
     os.rmdir(os.path.join(dataset_path, "stanford_img"))
 
-    # Remove the zip file
-    os.remove(zip_path)
 
     # Create a flag to indicate successful download
     with open(downloaded_flag, 'w') as f:
@@ -1,35 +1,9 @@
 import os
 import json
-from PIL import Image
 import numpy as np
-from datasets import load_dataset
-import io
-from tqdm import tqdm
+from datasets import load_dataset, Image as HFImage
 import pandas as pd
-
-def merge_images(img1, img2):
-    """Merge two images side by side."""
-    
-    # Convert to RGB mode if needed
-    if img1.mode != 'RGB':
-        img1 = img1.convert('RGB')
-    if img2.mode != 'RGB':
-        img2 = img2.convert('RGB')
-    
-    # Ensure both images have the same height
-    max_height = max(img1.height, img2.height)
-    img1 = img1.resize((int(img1.width * max_height / img1.height), max_height))
-    img2 = img2.resize((int(img2.width * max_height / img2.height), max_height))
-    
-    # Create new image with combined width
-    merged_width = img1.width + img2.width
-    merged_image = Image.new('RGB', (merged_width, max_height))
-    
-    # Paste images side by side
-    merged_image.paste(img1, (0, 0))
-    merged_image.paste(img2, (img1.width, 0))
-    
-    return merged_image
+from compositing import composite_pairs
 
 def download(cache):
     """Process the ImageEditingRequestV1 dataset."""
@@ -51,37 +25,42 @@ def download(cache):
         os.makedirs(images_dir)
         
     # Prepare metadata for CSV
-    metadata_rows = []
+    metadata_rows = {}
     errors = []
     
+    def pairs():
+        for split in ['train']:
+            # Keep the images encoded, so they are decoded in the compositing workers
+            split_dataset = dataset[split].cast_column('img0', HFImage(decode=False)).cast_column('img1', HFImage(decode=False))
+            for idx, example in enumerate(split_dataset):
+                try:
+                    # Create merged image filename
+                    merged_filename = f"{example['uid']}.jpg"
+                    merged_path = os.path.join(images_dir, merged_filename)
+                    
+                    # Format the editing instruction to reference left/right images
+                    instruction = f"The left image was edited to create the right image: {example['sents'][0]}"
+                    
+                    # Add metadata row
+                    metadata_rows[idx] = {
+                        'image_path': f"image_editing_request/images/{merged_filename}",
+                        'instruction': instruction,
+                        'uid': example['uid'],
+                        'original_filename': example['img0_filename'],
+                        'edited_filename': example['img1_filename']
+                    }
+                except Exception as e:
+                    errors.append((idx, str(e)))
+                    if len(errors) < 5:  # Print first few errors for debugging
+                        print(f"Error processing image pair {idx}: {str(e)}")
+                    continue
+                yield idx, example['img0'], example['img1'], merged_path
+    
     print("Processing and merging images...")
-    for split in ['train']:
-        for idx, example in tqdm(enumerate(dataset[split])):
-            try:
-                # Create merged image filename
-                merged_filename = f"{example['uid']}.jpg"
-                merged_path = os.path.join(images_dir, merged_filename)
-                
-                # Merge images and save
-                merged_image = merge_images(example['img0'], example['img1'])
-                merged_image.save(merged_path, quality=95)
-                
-                # Format the editing instruction to reference left/right images
-                instruction = f"The left image was edited to create the right image: {example['sents'][0]}"
-                
-                # Add metadata row
-                metadata_rows.append({
-                    'image_path': f"image_editing_request/images/{merged_filename}",
-                    'instruction': instruction,
-                    'uid': example['uid'],
-                    'original_filename': example['img0_filename'],
-                    'edited_filename': example['img1_filename']
-                })
-            except Exception as e:
-                errors.append((idx, str(e)))
-                if len(errors) < 5:  # Print first few errors for debugging
-                    print(f"Error processing image pair {idx}: {str(e)}")
-                continue
+    # The pairs are decoded, merged and encoded in parallel worker processes
+    failed = composite_pairs(pairs(), total=len(dataset['train']))
+    errors.extend(failed.items())
+    metadata_rows = [row for idx, row in metadata_rows.items() if idx not in failed]
     
     # Save metadata to CSV
     csv_path = os.path.join(dataset_path, "metadata.csv")
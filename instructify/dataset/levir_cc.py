@@ -1,36 +1,9 @@
 import os
 import json
 import gdown
-import zipfile
-from PIL import Image
-from tqdm import tqdm
+from zip_stream import extract_zip
 import pandas as pd
-
-def merge_images(img1_path, img2_path):
-    """Merge two images side by side."""
-    img1 = Image.open(img1_path)
-    img2 = Image.open(img2_path)
-    
-    # Convert to RGB mode if needed
-    if img1.mode != 'RGB':
-        img1 = img1.convert('RGB')
-    if img2.mode != 'RGB':
-        img2 = img2.convert('RGB')
-    
-    # Ensure both images have the same height
-    max_height = max(img1.height, img2.height)
-    img1 = img1.resize((int(img1.width * max_height / img1.height), max_height))
-    img2 = img2.resize((int(img2.width * max_height / img2.height), max_height))
-    
-    # Create new image with combined width
-    merged_width = img1.width + img2.width
-    merged_image = Image.new('RGB', (merged_width, max_height))
-    
-    # Paste images side by side
-    merged_image.paste(img1, (0, 0))
-    merged_image.paste(img2, (img1.width, 0))
-    
-    return merged_image
+from compositing import composite_pairs
 
 def download(cache):
     """Download and process the Levir-CC dataset."""
@@ -52,8 +25,7 @@ def download(cache):
     
     # Extract dataset
     print("Extracting dataset...")
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        zip_ref.extractall(dataset_path)
+    extract_zip(zip_path, dataset_path)
     
     # Clean up zip file
     os.remove(zip_path)
@@ -70,44 +42,46 @@ def download(cache):
         os.makedirs(merged_images_dir)
     
     # Process images and prepare metadata
-    metadata_rows = []
+    metadata_rows = {}
     errors = []
     
+    def pairs():
+        for image_info in annotations['images']:
+            try:
+                # Get paths for both images
+                base_filename = image_info['filename']
+                img_a_path = os.path.join(dataset_path, "images", 
+                                        image_info['split'], "A", base_filename)
+                img_b_path = os.path.join(dataset_path, "images", 
+                                        image_info['split'], "B", base_filename)
+                
+                # Create merged image filename
+                merged_filename = f"merged_{image_info['split']}_{base_filename}"
+                merged_path = os.path.join(merged_images_dir, merged_filename)
+                
+                # Get all captions
+                captions = [sent['raw'].strip() for sent in image_info['sentences']]
+                
+                # Add metadata row
+                metadata_rows[merged_filename] = {
+                    'image_path': f"levir_cc/merged_images/{merged_filename}",
+                    'captions': json.dumps(captions),
+                    'split': image_info['split'],
+                    'change_flag': image_info['changeflag'],
+                    'image_id': image_info['imgid']
+                }
+            except Exception as e:
+                errors.append((image_info.get('filename'), str(e)))
+                if len(errors) < 5:
+                    print(f"Error processing {image_info.get('filename')}: {str(e)}")
+                continue
+            yield merged_filename, img_a_path, img_b_path, merged_path
+    
     print("Processing and merging images...")
-    for image_info in tqdm(annotations['images']):
-        try:
-            # Get paths for both images
-            base_filename = image_info['filename']
-            img_a_path = os.path.join(dataset_path, "images", 
-                                    image_info['split'], "A", base_filename)
-            img_b_path = os.path.join(dataset_path, "images", 
-                                    image_info['split'], "B", base_filename)
-            
-            # Create merged image filename
-            merged_filename = f"merged_{image_info['split']}_{base_filename}"
-            merged_path = os.path.join(merged_images_dir, merged_filename)
-            
-            # Merge and save images
-            merged_image = merge_images(img_a_path, img_b_path)
-            merged_image.save(merged_path, quality=95)
-            
-            # Get all captions
-            captions = [sent['raw'].strip() for sent in image_info['sentences']]
-            
-            # Add metadata row
-            metadata_rows.append({
-                'image_path': f"levir_cc/merged_images/{merged_filename}",
-                'captions': json.dumps(captions),
-                'split': image_info['split'],
-                'change_flag': image_info['changeflag'],
-                'image_id': image_info['imgid']
-            })
-            
-        except Exception as e:
-            errors.append((base_filename, str(e)))
-            if len(errors) < 5:
-                print(f"Error processing {base_filename}: {str(e)}")
-            continue
+    # The pairs are decoded, merged and encoded in parallel worker processes
+    failed = composite_pairs(pairs(), total=len(annotations['images']))
+    errors.extend(failed.items())
+    metadata_rows = [row for merged_filename, row in metadata_rows.items() if merged_filename not in failed]
     
     # Save metadata to CSV
     csv_path = os.path.join(dataset_path, "metadata.csv")
@@ -1,6 +1,7 @@
 import os
 import json
-import requests
+from download import download_file
+from parallel_lines import parse_lines
 import pandas as pd
 
 LOCALIZED_NARRATIVE_GROUPS = {
@@ -27,33 +28,34 @@ def download(cache):
         file_name = os.path.join(dataset_dir, url.split("/")[-1])
         if not os.path.exists(file_name):
             print(f"Downloading {url} to {file_name}...")
-            response = requests.get(url)
-            with open(file_name, "wb") as f:
-                f.write(response.content)
+            download_file(url, file_name)
 
     # Create a file to indicate the dataset has been downloaded
     with open(os.path.join(dataset_dir, "downloaded"), "w") as f:
         f.write("")
 
-def load(cache):
+def _parse_narratives(path, lines):
+    group = {file_name: group for group, file_name in LOCALIZED_NARRATIVE_GROUPS.items()}[os.path.basename(path)]
     localized_narratives = {}
-    for group, file_name in LOCALIZED_NARRATIVE_GROUPS.items():
-        with open(os.path.join(cache, "localized_narratives", file_name), "r") as f:
-            for line in f:
-                image_information = json.loads(line)
-                image_path = group + "/" + str(image_information["image_id"]).zfill(12) + ".jpg"
-                if image_path not in localized_narratives:
-                    localized_narratives[image_path] = {
-                        "image_id": str(image_information["image_id"]),
-                        "image_source": group,
-                        "bboxes": [],  # No bounding boxes
-                        "captions": [],
-                        "QA": []       # No QA
-                    }
-                localized_narratives[image_path]["captions"].append(image_information["caption"])
-
+    for line in lines:
+        image_information = json.loads(line)
+        image_path = group + "/" + str(image_information["image_id"]).zfill(12) + ".jpg"
+        if image_path not in localized_narratives:
+            localized_narratives[image_path] = {
+                "image_id": str(image_information["image_id"]),
+                "image_source": group,
+                "bboxes": [],  # No bounding boxes
+                "captions": [],
+                "QA": []       # No QA
+            }
+        localized_narratives[image_path]["captions"].append(image_information["caption"])
     return localized_narratives
 
+def load(cache):
+    # The JSONL files are parsed in chunks across all cores, and the captions merged per image
+    paths = [os.path.join(cache, "localized_narratives", file_name) for file_name in LOCALIZED_NARRATIVE_GROUPS.values()]
+    return parse_lines(paths, _parse_narratives)
+
 
 def info():
     return {
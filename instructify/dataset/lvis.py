@@ -1,9 +1,8 @@
 import os
 import os
-import json
-import zipfile
 import tarfile
-import requests
+from zip_stream import extract_zip
+from json_stream import iter_json_arrays
 from collections import defaultdict
 
 def download(cache):
@@ -20,18 +19,9 @@ def download(cache):
     # URLs for downloading LVIS and ImageNet datasets
     lvis_url = "https://s3-us-west-2.amazonaws.com/dl.fbaipublicfiles.com/LVIS/lvis_v1_train.json.zip"
 
-    # Download LVIS dataset
-    lvis_zip_path = os.path.join(lvis_dir, 'lvis_v1_train.json.zip')
-    if not os.path.exists(lvis_zip_path):
-        print("Downloading LVIS dataset...")
-        response = requests.get(lvis_url)
-        with open(lvis_zip_path, 'wb') as f:
-            f.write(response.content)
-
-    # Unzip LVIS dataset
-    with zipfile.ZipFile(lvis_zip_path, 'r') as zip_ref:
-        zip_ref.extractall(lvis_dir)
-    os.remove(lvis_zip_path)  # Remove zip file after extraction
+    # Download and extract LVIS dataset
+    print("Downloading LVIS dataset...")
+    extract_zip(lvis_url, lvis_dir)
 
     # Create the downloaded marker file
     open(downloaded_file_path, 'w').close()
@@ -41,73 +31,71 @@ def load(cache):
     lvis_dir = os.path.join(cache, 'lvis')
     lvis_file = os.path.join(lvis_dir, 'lvis_v1_train.json')
 
-    # Load the entire file content as a string
-    with open(lvis_file, 'r') as f:
-        lvis_data = f.read()
+    # Stream the file (annotations, then images, then categories) stepping over the "segmentation"
+    # polygons without decoding them. Annotations are kept as (category ID, box) per image until
+    # the image arrives, and the category names are filled in once the categories are read
+    annotations_dict = defaultdict(list)
+    categories_dict = {}
+    categories_read = False
+    unlabelled = []  # (image metadata, negative category IDs) waiting for the category names
+    lvis_image_metadata = {}
 
-    # Extract the 'annotations' and 'images' using string operations to speed up (40s vs 13s)
-    annotations_base_string = lvis_data.split('"annotations": ', 1)[1].split(', "images"')[0]
-    annotations_clean = "}, {".join([ann.split(', "segmentation"')[0] for ann in annotations_base_string.split("}, {")]) + "}]"
-    annotations_json = json.loads(annotations_clean)
-    images_base_string = lvis_data.split('"images": ', 1)[1].split(', "licenses"')[0]
-    images_json = json.loads(images_base_string)
+    for key, row in iter_json_arrays(lvis_file, ("annotations", "images", "categories"), skip_keys=("segmentation", )):
+        if key == "annotations":
+            annotations_dict[row['image_id']].append((row['category_id'], row['bbox']))
+            continue
+        if key == "categories":
+            categories_dict[row['id']] = row['name'].replace('_', ' ')
+            continue
+        categories_read = categories_read or bool(categories_dict)
 
-    # Create a mapping for categories by their ID for easy lookup
-    categories_base_string = lvis_data.split('"categories": ', 1)[1][:-1]
-    categories_dict = {cat['id']: cat['name'].replace('_', ' ') for cat in json.loads(categories_base_string)}
-    
-    # Initialize the dictionary to store image metadata
-    lvis_image_metadata = {}
+        image_id = row['coco_url'].split('/')[-1].split('.')[0]
+        image_path = "coco/train2017/" + row['coco_url'].split('/')[-1]
 
-    # Create a mapping from image_id to annotations
-    annotations_dict = defaultdict(list)
-    for ann in annotations_json:
-        annotations_dict[ann['image_id']].append(ann)
-
-    # Iterate over each image entry
-    for image_info in images_json:
-        image_id = image_info['coco_url'].split('/')[-1].split('.')[0]
-        image_path = "coco/train2017/" + image_info['coco_url'].split('/')[-1]
-        
-        # Retrieve annotations for the current image using the mapping
-        annotations = annotations_dict[image_info['id']]
-
-        # Collect category information for the annotations
-        categories = [categories_dict[ann['category_id']] for ann in annotations]
-
-        # Collect negative categories from images_json["neg_category_ids"] (for a caption)
-        neg_categories = [categories_dict[cat_id] for cat_id in image_info["neg_category_ids"]]
-        captions = []
-        if len(neg_categories) > 0:
-            captions.append(f"This image does not contain {', '.join(neg_categories)}.")
-        if len(categories) > 0:
-            captions.append(f"This image contains {', '.join(set(categories))}.")
-        
         # Get the image dimensions
-        image_width = image_info['width']
-        image_height = image_info['height']
+        image_width = row['width']
+        image_height = row['height']
 
-        # Convert from [x, y, w, h] -> [x1, y1, x2, y2] and normalize the bounding boxes
+        # Convert from [x, y, w, h] -> [x1, y1, x2, y2] and normalize the bounding boxes,
+        # dropping the annotations of this image as they are used
         normalized_bboxes = [
-            [categories[i]] + [
-                ann['bbox'][0] / image_width,
-                ann['bbox'][1] / image_height,
-                (ann['bbox'][0] + ann['bbox'][2]) / image_width,
-                (ann['bbox'][1] + ann['bbox'][3]) / image_height
-            ] for i, ann in enumerate(annotations)
+            [category_id, x / image_width, y / image_height, (x + w) / image_width, (y + h) / image_height]
+            for category_id, (x, y, w, h) in annotations_dict.pop(row['id'], [])
         ]
 
         # Create the metadata structure for this image
-        lvis_image_metadata[image_path] = {
+        metadata = {
             "image_id": str(image_id),
             "image_source": "lvis",
             "bboxes": normalized_bboxes,
-            "captions": captions,
+            "captions": [],
             "QA": []  # No QA
         }
-    
+        lvis_image_metadata[image_path] = metadata
+        if categories_read:
+            _label(metadata, row['neg_category_ids'], categories_dict)
+        else:
+            unlabelled.append((metadata, row['neg_category_ids']))
+
+    for metadata, neg_category_ids in unlabelled:
+        _label(metadata, neg_category_ids, categories_dict)
+
     return lvis_image_metadata
 
+def _label(metadata, neg_category_ids, categories_dict):
+    """Replace the category IDs of the boxes with names and add the (negative) category captions."""
+    categories = []
+    for box in metadata["bboxes"]:
+        box[0] = categories_dict[box[0]]
+        categories.append(box[0])
+
+    # Collect negative categories from the image's "neg_category_ids" (for a caption)
+    neg_categories = [categories_dict[cat_id] for cat_id in neg_category_ids]
+    if len(neg_categories) > 0:
+        metadata["captions"].append(f"This image does not contain {', '.join(neg_categories)}.")
+    if len(categories) > 0:
+        metadata["captions"].append(f"This image contains {', '.join(set(categories))}.")
+
 def info():
     return {
         "name": "LVIS Dataset",
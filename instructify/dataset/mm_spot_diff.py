@@ -1,39 +1,10 @@
 import os
 import csv
 import json
-from PIL import Image
 import numpy as np
 from datasets import load_dataset
-import io
-from tqdm import tqdm
 import pandas as pd
-
-def merge_images(img1_dict, img2_dict):
-    """Merge two images side by side."""
-    # Convert bytes directly to PIL Images - no need for base64 decoding
-    img1 = Image.open(io.BytesIO(img1_dict['bytes'])).convert("RGB")
-    img2 = Image.open(io.BytesIO(img2_dict['bytes'])).convert("RGB")
-    
-    # Convert to RGB mode if needed
-    if img1.mode != 'RGB':
-        img1 = img1.convert('RGB')
-    if img2.mode != 'RGB':
-        img2 = img2.convert('RGB')
-    
-    # Ensure both images have the same height
-    max_height = max(img1.height, img2.height)
-    img1 = img1.resize((int(img1.width * max_height / img1.height), max_height))
-    img2 = img2.resize((int(img2.width * max_height / img2.height), max_height))
-    
-    # Create new image with combined width
-    merged_width = img1.width + img2.width
-    merged_image = Image.new('RGB', (merged_width, max_height))
-    
-    # Paste images side by side
-    merged_image.paste(img1, (0, 0))
-    merged_image.paste(img2, (img1.width, 0))
-    
-    return merged_image
+from compositing import composite_pairs
 
 def download(cache):
     """Download and process the MM Spot the Diff dataset."""
@@ -55,48 +26,51 @@ def download(cache):
         os.makedirs(images_dir)
         
     # Prepare metadata for CSV
-    metadata_rows = []
+    metadata_rows = {}
     errors = []
     
+    def pairs():
+        for split in ['train']:
+            for idx, example in enumerate(dataset[split]):
+                # Create merged image filename
+                merged_filename = f"merged_{split}_{idx:06d}.jpg"
+                merged_path = os.path.join(images_dir, merged_filename)
+                
+                # Get images from the dataset
+                images = example['images']
+                if len(images) >= 2:  # Ensure we have both images
+                    try:
+                        # Extract conversation data
+                        conversation = []
+                        for item in example['data']:
+                            if isinstance(item, dict):
+                                role = item.get('role', '')
+                                data = item.get('data', '')
+                                modality = item.get('modality', '')
+                                conversation.append({
+                                    'role': role,
+                                    'data': data,
+                                    'modality': modality
+                                })
+                        
+                        # Add metadata row
+                        metadata_rows[idx] = {
+                            'image_path': f"mm_spot_diff/images/{merged_filename}",
+                            'conversation': json.dumps(conversation),
+                            'split': split
+                        }
+                    except Exception as e:
+                        errors.append((idx, str(e)))
+                        if len(errors) < 5:  # Print first few errors for debugging
+                            print(f"Error processing image pair {idx}: {str(e)}")
+                        continue
+                    yield idx, images[0], images[1], merged_path
+    
     print("Processing and merging images...")
-    for split in ['train']:
-        for idx, example in tqdm(enumerate(dataset[split])):
-            # Create merged image filename
-            merged_filename = f"merged_{split}_{idx:06d}.jpg"
-            merged_path = os.path.join(images_dir, merged_filename)
-            
-            # Get images from the dataset
-            images = example['images']
-            if len(images) >= 2:  # Ensure we have both images
-                try:
-                    # Merge images and save
-                    merged_image = merge_images(images[0], images[1])
-                    merged_image.save(merged_path, quality=95)
-                    
-                    # Extract conversation data
-                    conversation = []
-                    for item in example['data']:
-                        if isinstance(item, dict):
-                            role = item.get('role', '')
-                            data = item.get('data', '')
-                            modality = item.get('modality', '')
-                            conversation.append({
-                                'role': role,
-                                'data': data,
-                                'modality': modality
-                            })
-                    
-                    # Add metadata row
-                    metadata_rows.append({
-                        'image_path': f"mm_spot_diff/images/{merged_filename}",
-                        'conversation': json.dumps(conversation),
-                        'split': split
-                    })
-                except Exception as e:
-                    errors.append((idx, str(e)))
-                    if len(errors) < 5:  # Print first few errors for debugging
-                        print(f"Error processing image pair {idx}: {str(e)}")
-                    continue
+    # The pairs are decoded, merged and encoded in parallel worker processes
+    failed = composite_pairs(pairs(), total=len(dataset['train']))
+    errors.extend(failed.items())
+    metadata_rows = [row for idx, row in metadata_rows.items() if idx not in failed]
     
     # Save metadata to CSV
     csv_path = os.path.join(dataset_path, "metadata.csv")
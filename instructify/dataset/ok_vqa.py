@@ -1,7 +1,6 @@
 import os
 import json
-import requests
-import zipfile
+from zip_stream import extract_zip
 
 def download(cache):
     dataset_name = "ok_vqa"
@@ -15,34 +14,17 @@ def download(cache):
         print(f"{dataset_name} is already downloaded.")
         return
     
-    # URLs and paths for the question and annotation files
+    # URLs for the question and annotation files
     question_url = "https://okvqa.allenai.org/static/data/OpenEnded_mscoco_train2014_questions.json.zip"
     annotation_url = "https://okvqa.allenai.org/static/data/mscoco_train2014_annotations.json.zip"
-    question_zip_path = os.path.join(dataset_folder, "questions.zip")
-    annotation_zip_path = os.path.join(dataset_folder, "annotations.zip")
     
-    # Download the question file
+    # Download and extract the question file
     print(f"Downloading questions for {dataset_name}...")
-    response = requests.get(question_url)
-    with open(question_zip_path, 'wb') as f:
-        f.write(response.content)
+    extract_zip(question_url, dataset_folder)
     
-    # Download the annotation file
+    # Download and extract the annotation file
     print(f"Downloading annotations for {dataset_name}...")
-    response = requests.get(annotation_url)
-    with open(annotation_zip_path, 'wb') as f:
-        f.write(response.content)
-    
-    # Extract the zip files
-    print(f"Extracting {dataset_name}...")
-    with zipfile.ZipFile(question_zip_path, 'r') as zip_ref:
-        zip_ref.extractall(dataset_folder)
-    with zipfile.ZipFile(annotation_zip_path, 'r') as zip_ref:
-        zip_ref.extractall(dataset_folder)
-    
-    # Clean up the zip files
-    os.remove(question_zip_path)
-    os.remove(annotation_zip_path)
+    extract_zip(annotation_url, dataset_folder)
     
     # Create a 'downloaded' flag
     open(downloaded_flag, 'w').close()
@@ -1,7 +1,7 @@
 import os
 import json
 import gdown
-import zipfile
+from zip_stream import extract_zip
 from tqdm import tqdm
 
 def format_qa_string(problem):
@@ -75,8 +75,7 @@ def download(cache):
     
     # Extract images
     print("Extracting images...")
-    with zipfile.ZipFile(images_zip_path, 'r') as zip_ref:
-        zip_ref.extractall(os.path.join(dataset_path, "images"))
+    extract_zip(images_zip_path, os.path.join(dataset_path, "images"))
     
     # Process problems
     print("Processing problems...")
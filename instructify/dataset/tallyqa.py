@@ -1,8 +1,7 @@
 import os
 import json
 import re
-import zipfile
-import requests
+from zip_stream import extract_zip
 from utils import plural_to_singular
 
 def parse_how_many_question(question, count):
@@ -92,19 +91,9 @@ def download(cache):
     
     # Download the dataset
     url = "https://github.com/manoja328/TallyQA_dataset/blob/46cdc649ec79c3dcc2720ff227ad07d7ee51da6f/tallyqa.zip?raw=true"
-    zip_path = os.path.join(cache, "tallyqa.zip")
     
-    # Download and save the zip file
-    response = requests.get(url)
-    with open(zip_path, "wb") as f:
-        f.write(response.content)
-    
-    # Unzip the downloaded file
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        zip_ref.extractall(dataset_dir)
-    
-    # Remove the zip file after extraction
-    os.remove(zip_path)
+    # Download and extract the zip file
+    extract_zip(url, dataset_dir)
     
     # Create a file to indicate that the download is complete
     with open(downloaded_flag, "w") as f:
@@ -1,6 +1,6 @@
 import os
 import json
-import requests
+from download import download_file
 from collections import Counter
 from tqdm import tqdm
 
@@ -25,9 +25,7 @@ def download(cache):
     json_path = os.path.join(dataset_path, "TextVQA_train.json")
     
     if not os.path.exists(json_path):
-        response = requests.get(json_url)
-        with open(json_path, 'w') as f:
-            f.write(response.text)
+        download_file(json_url, json_path)
     
     # Process annotations
     print("Processing annotations...")
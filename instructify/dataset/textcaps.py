@@ -1,6 +1,6 @@
 import os
 import json
-import requests
+from download import download_file
 from zipfile import ZipFile
 
 def download(cache):
@@ -20,12 +20,7 @@ def download(cache):
 
     # Download annotations
     print("Downloading annotations...")
-    response = requests.get(annotations_url)
-    if response.status_code == 200:
-        with open(annotations_path, 'wb') as f:
-            f.write(response.content)
-    else:
-        raise Exception(f"Failed to download annotations: {response.status_code}")
+    download_file(annotations_url, annotations_path)
 
     # Create a flag to indicate successful download
     with open(downloaded_flag, 'w') as f:
@@ -1,9 +1,11 @@
 import os
 import json
-import zipfile
-import requests
+from zip_stream import extract_zip
 from utils import image_id_mapping
 
+# image_id_mapping reads the Visual Genome image data and lists the COCO and VG image folders
+REQUIRES = ["download:visual_genome", "images:coco/train2017", "images:vg"]
+
 def download(cache):
     dataset_name = "visual7w"
     dataset_folder = os.path.join(cache, dataset_name)
@@ -16,29 +18,27 @@ def download(cache):
         print(f"{dataset_name} is already downloaded.")
         return
     
-    # URL and paths
+    # URL of the dataset
     url = "https://ai.stanford.edu/~yukez/papers/resources/dataset_v7w_telling.zip"
-    zip_path = os.path.join(dataset_folder, "dataset_v7w_telling.zip")
-    json_path = os.path.join(dataset_folder, "dataset_v7w_telling.json")
     
-    # Download the dataset
+    # Download and extract the specific JSON file
     print(f"Downloading {dataset_name}...")
-    response = requests.get(url)
-    with open(zip_path, 'wb') as f:
-        f.write(response.content)
-    
-    # Extract the specific JSON file
-    print(f"Extracting {dataset_name}...")
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        zip_ref.extract('dataset_v7w_telling.json', dataset_folder)
-    
-    # Clean up the zip file
-    os.remove(zip_path)
+    extract_zip(url, dataset_folder, members='dataset_v7w_telling.json')
     
     # Create a 'downloaded' flag
     open(downloaded_flag, 'w').close()
     print(f"{dataset_name} downloaded and extracted successfully.")
 
+def sources(cache):
+    """Files load() reads, for invalidating its cached output."""
+    return [
+        os.path.join(cache, "visual7w", "dataset_v7w_telling.json"),
+        os.path.join(cache, "visual_genome", "image_data.json"),
+        os.path.join(cache, "images/vg/VG_100K"),
+        os.path.join(cache, "images/vg/VG_100K_2"),
+        os.path.join(cache, "images/coco/train2017"),
+    ]
+
 def load(cache):
     dataset_name = "visual7w"
     dataset_folder = os.path.join(cache, dataset_name)
@@ -1,8 +1,10 @@
 import os
-import json
 import pandas as pd
-import requests
-from zipfile import ZipFile
+from zip_stream import extract_zip
+from json_stream import iter_json_arrays
+
+# Besides its own files, load() reads the COCO instances annotations and lists the VG image folders
+REQUIRES = ["download:coco_captions", "images:vg"]
 
 def download(cache):
     # Directory where the dataset files will be stored
@@ -27,19 +29,59 @@ def download(cache):
     for url in urls:
         file_name = os.path.join(dataset_dir, os.path.basename(url))
         if not os.path.exists(file_name.replace('.zip', '.json')):
-            print(f"Downloading {url} to {file_name}...")
-            response = requests.get(url)
-            with open(file_name, "wb") as f:
-                f.write(response.content)
-            with ZipFile(file_name, 'r') as zip_ref:
-                zip_ref.extractall(dataset_dir)
-            os.remove(file_name)
+            print(f"Downloading and extracting {url}...")
+            extract_zip(url, dataset_dir)
 
     # Create a file to indicate the dataset has been downloaded
     with open(os.path.join(dataset_dir, "downloaded"), "w") as f:
         f.write("")
 
-def load(cache):
+def sources(cache):
+    """Files load() reads, for invalidating its cached output."""
+    dataset_dir = os.path.join(cache, "visual_genome")
+    return [os.path.join(dataset_dir, name) for name in ("objects.json", "attributes.json", "relationships.json", "image_data.json")] + [
+        os.path.join(cache, "coco_captions", "annotations", "instances_train2017.json"),
+        os.path.join(cache, "images/vg/VG_100K"),
+        os.path.join(cache, "images/vg/VG_100K_2"),
+    ]
+
+class _ImageRows:
+    """Rows of one of the per-image Visual Genome files, read in step with image_data.json."""
+    def __init__(self, path):
+        self.path = path
+        self.rows = (row for _, row in iter_json_arrays(path))
+        self.next = next(self.rows, None)
+
+    def take(self, image_id):
+        """The row of image_id if it is the next one in the file, else None."""
+        row = self.next
+        if row is None or int(row["image_id"]) != image_id:
+            return None
+        self.next = next(self.rows, None)
+        return row
+
+    def check_done(self):
+        if self.next is not None:
+            raise ValueError(f"{self.path} has rows for image {self.next['image_id']} out of the order of image_data.json.")
+
+def load(cache, group_boxes=False):
+    return dict(iter_load(cache, group_boxes=group_boxes))
+
+def iter_load(cache, group_boxes=False):
+    """
+    Stream the Visual Genome records as (image path, record) pairs, e.g. into a sharded cache
+    (see DatasetManager.cache_dataset).
+
+    objects.json, attributes.json and relationships.json hold one row per image in the order of
+    image_data.json, so the four files are merge-joined one image at a time and memory stays
+    bounded by the largest image instead of the whole dataset.
+
+    By default each object gives a box labelled with its category plus one box per attribute and
+    relationship, all with the object's coordinates. With group_boxes, each distinct set of
+    coordinates gives a single box labelled with its categories and their attributes and
+    relationships, e.g. "man (tall, holding the umbrella)", which cuts the boxes per image
+    several-fold before merge_bboxes and SAM2.
+    """
     dataset_dir = os.path.join(cache, "visual_genome")
     
     # Check if COCO annotations file exists
@@ -47,23 +89,8 @@ def load(cache):
     if not os.path.exists(coco_annotations_path):
         raise FileNotFoundError("COCO annotations file not found. Please download coco_captions dataset first.")
 
-    # Load COCO images data
-    with open(coco_annotations_path, 'r') as f:
-        coco_images_data = json.loads(f.read().split('"images": ', 1)[1].split(',"annotations":', 1)[0])
-    
-    coco_image_ids = {img['id']: img['file_name'] for img in coco_images_data}
-
-    # Load JSON data
-    with open(os.path.join(dataset_dir, 'objects.json')) as f:
-        visual_genome_objects = json.load(f)
-    with open(os.path.join(dataset_dir, 'attributes.json')) as f:
-        visual_genome_attributes = json.load(f)
-    with open(os.path.join(dataset_dir, 'relationships.json')) as f:
-        visual_genome_relationships = json.load(f)
-    with open(os.path.join(dataset_dir, 'image_data.json')) as f:
-        visual_genome_image_data = json.load(f)
-
-    visual_genome_info = {}
+    # Stream the COCO images data, reading stops before the annotations
+    coco_image_ids = {img['id']: img['file_name'] for _, img in iter_json_arrays(coco_annotations_path, ("images", ))}
 
     vg_100k_path = os.path.join(cache, "images/vg/VG_100K")
     vg_100k_2_path = os.path.join(cache, "images/vg/VG_100K_2")
@@ -74,108 +101,89 @@ def load(cache):
     vg_100k_2_images = os.listdir(vg_100k_2_path)
     vg_100k_2_image_mapping = {int(img.split(".")[0]): img for img in vg_100k_2_images}
 
-    # Create a mapping from image_id to image path
-    visual_genome_images = {}
-    for img in visual_genome_image_data:
-        img_id = img["image_id"]
+    visual_genome_objects = _ImageRows(os.path.join(dataset_dir, 'objects.json'))
+    visual_genome_attributes = _ImageRows(os.path.join(dataset_dir, 'attributes.json'))
+    visual_genome_relationships = _ImageRows(os.path.join(dataset_dir, 'relationships.json'))
+
+    for _, img in iter_json_arrays(os.path.join(dataset_dir, 'image_data.json')):
+        image_id = int(img["image_id"])
+        objects_row = visual_genome_objects.take(image_id)
+        attributes_row = visual_genome_attributes.take(image_id)
+        relationships_row = visual_genome_relationships.take(image_id)
+
+        # Find the image path
         if img["coco_id"] and img["coco_id"] in coco_image_ids:
-            visual_genome_images[img_id] = {
-                "image": f"coco/train2017/{coco_image_ids[img['coco_id']]}", 
-                "width": img["width"], 
-                "height": img["height"]
-            }
+            image_path = f"coco/train2017/{coco_image_ids[img['coco_id']]}"
+        elif image_id in vg_100k_image_mapping:
+            image_path = f"vg/VG_100K/{vg_100k_image_mapping[image_id]}"
+        elif image_id in vg_100k_2_image_mapping:
+            image_path = f"vg/VG_100K_2/{vg_100k_2_image_mapping[image_id]}"
         else:
-            if img_id in vg_100k_image_mapping:
-                visual_genome_images[img_id] = {
-                    "image": f"vg/VG_100K/{vg_100k_image_mapping[img_id]}",
-                    "width": img["width"], 
-                    "height": img["height"]
-                }
-            elif img_id in vg_100k_2_image_mapping:
-                visual_genome_images[img_id] = {
-                    "image": f"vg/VG_100K_2/{vg_100k_2_image_mapping[img_id]}",
-                    "width": img["width"], 
-                    "height": img["height"]
-                }
-    
-    # Create a mapping from object_id to object name
-    visual_genome_info = {}
-    for row in visual_genome_objects:
-        image_id = int(row["image_id"])
-        if image_id not in visual_genome_images:
+            image_path = None
+        if objects_row is None:
+            continue
+        if image_path is None:
             print(f"WARNING: Image {image_id} not found in image data, skipping.")
             continue
 
-        image_path = visual_genome_images[image_id]["image"]
+        # Create a mapping from object_id to object name
+        width, height = img["width"], img["height"]
         objects = {}
-        for obj in row["objects"]:
+        for obj in objects_row["objects"]:
             bbox = [obj["x"], obj["y"], obj["x"] + obj["w"], obj["y"] + obj["h"]]
             # normalize by image width and height
-            bbox = [bbox[0]/visual_genome_images[row["image_id"]]["width"], bbox[1]/visual_genome_images[row["image_id"]]["height"], bbox[2]/visual_genome_images[row["image_id"]]["width"], bbox[3]/visual_genome_images[row["image_id"]]["height"]]
+            bbox = [bbox[0]/width, bbox[1]/height, bbox[2]/width, bbox[3]/height]
             objects[obj["object_id"]] = {
                 "category": obj["names"][0],
                 "bbox": bbox,
                 "attributes": []
             }
-        if visual_genome_images[row["image_id"]]["image"] in visual_genome_info:
-            visual_genome_info[visual_genome_images[row["image_id"]]["image"]] = objects
-        else:
-            visual_genome_info[visual_genome_images[row["image_id"]]["image"]] = objects
 
-    # Add attributes to the objects
-    for row in visual_genome_attributes:
-        image_id = row["image_id"]
-        if image_id not in visual_genome_images:
-            continue
-        image_path = visual_genome_images[image_id]["image"]
-        for obj in row["attributes"]:
-            if image_path in visual_genome_info:
-                object_id = obj["object_id"]
-                if object_id in visual_genome_info[image_path] and "attributes" in obj:
-                    visual_genome_info[image_path][object_id]["attributes"].extend(obj["attributes"])
-
-    # Add relationships to the objects
-    for row in visual_genome_relationships:
-        image_id = row["image_id"]
-        if image_id not in visual_genome_images:
-            continue
-        image_path = visual_genome_images[image_id]["image"]
-        
-        relationships = row["relationships"]
-        for rel_info in relationships:
+        # Add attributes to the objects
+        for obj in attributes_row["attributes"] if attributes_row else []:
+            object_id = obj["object_id"]
+            if object_id in objects and "attributes" in obj:
+                objects[object_id]["attributes"].extend(obj["attributes"])
+
+        # Add relationships to the objects
+        for rel_info in relationships_row["relationships"] if relationships_row else []:
             rel = rel_info["predicate"]
             subject_id = rel_info["subject"]["object_id"]
             object_name = rel_info["object"]["name"] if "name" in rel_info["object"] else rel_info["object"]["names"][0]
-            if image_path in visual_genome_info:
-                if subject_id in visual_genome_info[image_path]:
-                    visual_genome_info[image_path][subject_id]["attributes"].append(f"{rel.lower()} the {object_name}")
-
-    # cast attributes to set and then back to list
-    for k, v in visual_genome_info.items():
-        for obj_id, obj_info in v.items():
-            obj_info["attributes"] = list(set(obj_info["attributes"]))
-
-    # Construct the dataset
-    visual_genome_dataset = {}
-    for k, v in visual_genome_info.items():
+            if subject_id in objects:
+                objects[subject_id]["attributes"].append(f"{rel.lower()} the {object_name}")
+
+        # Construct the record
         bboxes_formated = []
-        for obj in v.values():
-            # if len(obj["attributes"]) > 0:
-            #     label_str = f"{obj['category']} ({', '.join(obj['attributes'])})"
-            # else:
-            #     label_str = obj["category"]
-            # bboxes_formated.append([label_str] + obj["bbox"])
+        grouped = {}
+        for obj in objects.values():
+            # cast attributes to set and then back to list
+            obj["attributes"] = list(set(obj["attributes"]))
+            if group_boxes:
+                # Objects with identical coordinates share one box
+                categories, attributes = grouped.setdefault(tuple(obj["bbox"]), ({}, {}))
+                categories[obj["category"]] = None
+                attributes.update(dict.fromkeys(obj["attributes"]))
+                continue
             bboxes_formated.append([obj['category']] + obj["bbox"])
             for attr in obj["attributes"]:
                 bboxes_formated.append([attr] + obj["bbox"])
-        visual_genome_dataset[k] = {
-                    "image_id": k.split("/")[1].split(".")[0],
-                    "image_source": k.split("/")[0],
+        for bbox, (categories, attributes) in grouped.items():
+            if len(attributes) > 0:
+                label_str = f"{', '.join(categories)} ({', '.join(attributes)})"
+            else:
+                label_str = ", ".join(categories)
+            bboxes_formated.append([label_str] + list(bbox))
+        yield image_path, {
+                    "image_id": image_path.split("/")[1].split(".")[0],
+                    "image_source": image_path.split("/")[0],
                     "bboxes": bboxes_formated,
                     "captions": [],  # No captions
                     "QA": []         # No QA
                 }
-    return visual_genome_dataset
+
+    for rows in (visual_genome_objects, visual_genome_attributes, visual_genome_relationships):
+        rows.check_done()
 
 def info():
     return {
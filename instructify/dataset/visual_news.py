@@ -1,6 +1,6 @@
 import os
 import json
-import requests
+from download import download_file
 import tarfile
 from typing import Dict, Any
 
@@ -30,13 +30,8 @@ def download(cache: str) -> None:
     # Download and extract each file
     for name, url in urls.items():
         print(f"Downloading {name} dataset...")
-        response = requests.get(url, stream=True)
         file_path = os.path.join(dataset_path, os.path.basename(url))
-        
-        with open(file_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
+        download_file(url, file_path)
         
         print(f"Extracting {name} dataset...")
         if url.endswith('.tar.gz'):
@@ -1,8 +1,7 @@
 import os
 import json
 import pandas as pd
-import requests
-from zipfile import ZipFile
+from zip_stream import extract_zip
 
 def download(cache):
     # Directory where the dataset files will be stored
@@ -13,29 +12,13 @@ def download(cache):
     annotation_url = "https://s3.amazonaws.com/cvmlp/vqa/mscoco/vqa/v2_Annotations_Train_mscoco.zip"
     question_url = "https://s3.amazonaws.com/cvmlp/vqa/mscoco/vqa/v2_Questions_Train_mscoco.zip"
 
-    # File names for the downloads
-    annotation_zip_file = os.path.join(dataset_dir, "v2_Annotations_Train_mscoco.zip")
-    question_zip_file = os.path.join(dataset_dir, "v2_Questions_Train_mscoco.zip")
-    
-    # Download the annotations file
-    if not os.path.exists(annotation_zip_file):
-        print(f"Downloading {annotation_url} to {annotation_zip_file}...")
-        response = requests.get(annotation_url)
-        with open(annotation_zip_file, "wb") as f:
-            f.write(response.content)
-
-    # Download the questions file
-    if not os.path.exists(question_zip_file):
-        print(f"Downloading {question_url} to {question_zip_file}...")
-        response = requests.get(question_url)
-        with open(question_zip_file, "wb") as f:
-            f.write(response.content)
+    # Download and extract the annotations file
+    print(f"Downloading and extracting {annotation_url}...")
+    extract_zip(annotation_url, dataset_dir)
 
-    # Unzip the files
-    with ZipFile(annotation_zip_file, 'r') as zip_ref:
-        zip_ref.extractall(dataset_dir)
-    with ZipFile(question_zip_file, 'r') as zip_ref:
-        zip_ref.extractall(dataset_dir)
+    # Download and extract the questions file
+    print(f"Downloading and extracting {question_url}...")
+    extract_zip(question_url, dataset_dir)
 
     # Create a file to indicate the dataset has been downloaded
     with open(os.path.join(dataset_dir, "downloaded"), "w") as f:
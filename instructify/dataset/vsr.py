@@ -1,6 +1,6 @@
 import os
 import json
-import requests
+from download import download_file
 
 def download(cache):
     dataset_name = "vsr"
@@ -20,9 +20,7 @@ def download(cache):
     
     # Download the JSONL file
     print(f"Downloading {dataset_name}...")
-    response = requests.get(url)
-    with open(jsonl_path, 'wb') as f:
-        f.write(response.content)
+    download_file(url, jsonl_path)
     
     # Create a 'downloaded' flag
     open(downloaded_flag, 'w').close()
@@ -0,0 +1,148 @@
+import os
+import sys
+import types
+import marshal
+import pickle
+import hashlib
+from typing import Any, List, Optional, Tuple
+
+# Bump to invalidate every cached load() result after a change to the cache format
+CACHE_VERSION = 1
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tif', '.tiff')
+
+def default_sources(cache: str, dataset_name: str) -> List[str]:
+    """
+    Source paths of a dataset without a sources() function: the files under <cache>/<dataset_name>.
+
+    Image files are left out, and folders of images (e.g. 'images', 'merged_images') are
+    fingerprinted by their own mtime instead of being walked.
+    """
+    sources = []
+    dataset_dir = os.path.join(cache, dataset_name)
+    for root, dirs, files in os.walk(dataset_dir):
+        for directory in list(dirs):
+            if "images" in directory:
+                dirs.remove(directory)
+                sources.append(os.path.join(root, directory))
+        sources.extend(os.path.join(root, f) for f in files if not f.lower().endswith(IMAGE_EXTENSIONS))
+    return sorted(sources)
+
+def fingerprint(paths: List[str]) -> List[Tuple[str, int, int]]:
+    """(path, size, mtime_ns) of each path, (path, -1, -1) if it does not exist. Directories are not walked."""
+    fingerprints = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            fingerprints.append((path, stat.st_size, stat.st_mtime_ns))
+        except FileNotFoundError:
+            fingerprints.append((path, -1, -1))
+    return fingerprints
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def _local_modules(module) -> List:
+    """The module plus the repo-local modules it imports from (e.g. json_stream, parallel_lines), transitively."""
+    found, stack = {}, [module]
+    while stack:
+        current = stack.pop()
+        path = getattr(current, '__file__', None)
+        if path is None or current.__name__ in found or not os.path.abspath(path).startswith(REPO_DIR + os.sep):
+            continue
+        found[current.__name__] = current
+        for value in vars(current).values():
+            if isinstance(value, types.ModuleType):
+                stack.append(value)
+            elif getattr(value, '__module__', None) in sys.modules:
+                stack.append(sys.modules[value.__module__])
+    return [found[name] for name in sorted(found)]
+
+def code_hash(module) -> str:
+    """
+    sha256 of the source files of a dataset module and of the repo-local helpers it imports, so a
+    fix to a shared parser (e.g. json_stream) invalidates the cached output of its loaders too.
+    """
+    digest = hashlib.sha256()
+    for local_module in _local_modules(module):
+        with open(local_module.__file__, 'rb') as f:
+            digest.update(local_module.__name__.encode() + b"\0" + hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+class LoadCache:
+    """
+    Cache of the normalized output of each dataset's load(cache), under <cache>/.load_cache/.
+
+    Entries are keyed by the fingerprints (size, mtime) of the dataset's source files, the hash
+    of the loader's code (including the repo-local helpers it imports) and its options. A dataset
+    module can list its sources with `sources(cache) -> List[str]`, e.g. when it reads files of
+    another dataset; otherwise the files of its own folder are used (see default_sources).
+
+    Each entry is one file holding the marshalled key followed by the marshalled dataset (or
+    pickled, if it holds values marshal can't serialize), so the key can be checked without
+    reading the dataset.
+
+    E.g.
+        load_cache = LoadCache(cache_dir)
+        key = load_cache.key("lvis", module)
+        dataset = load_cache.get("lvis", key)
+        if dataset is None:
+            dataset = module.load(cache_dir)
+            load_cache.put("lvis", key, dataset)
+    """
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self.root = os.path.join(cache_dir, ".load_cache")
+
+    def key(self, dataset_name: str, module, options: Optional[dict] = None) -> tuple:
+        if hasattr(module, 'sources'):
+            sources = list(module.sources(self.cache_dir))
+        else:
+            sources = default_sources(self.cache_dir, dataset_name)
+        return (CACHE_VERSION, dataset_name, code_hash(module),
+                tuple(fingerprint(sources)), repr(sorted((options or {}).items())))
+
+    def path(self, dataset_name: str) -> str:
+        return os.path.join(self.root, f"{dataset_name}.marshal")
+
+    def is_fresh(self, dataset_name: str, key: tuple) -> bool:
+        """True if the cached entry matches the key, reading only the key."""
+        try:
+            with open(self.path(dataset_name), 'rb') as f:
+                return marshal.load(f) == key
+        except (OSError, EOFError, ValueError, TypeError):
+            return False
+
+    def get(self, dataset_name: str, key: tuple) -> Any:
+        """The cached dataset, or None if there is no entry for this key."""
+        try:
+            with open(self.path(dataset_name), 'rb') as f:
+                if marshal.load(f) != key:
+                    return None
+                serializer = marshal.load(f)
+                return marshal.load(f) if serializer == "marshal" else pickle.load(f)
+        except (OSError, EOFError, ValueError, TypeError, pickle.UnpicklingError):
+            return None
+
+    def put(self, dataset_name: str, key: tuple, dataset: Any = None, serializer: str = None, payload: bytes = None):
+        """
+        Store a dataset, or an already serialized payload (serializer 'marshal' or 'pickle').
+        """
+        if payload is None:
+            serializer, payload = serialize(dataset)
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = f"{self.path(dataset_name)}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            marshal.dump(key, f)
+            marshal.dump(serializer, f)
+            f.write(payload)
+        os.replace(tmp_path, self.path(dataset_name))
+
+def serialize(dataset: Any) -> Tuple[str, bytes]:
+    """marshal the dataset if it only holds plain values, which is much faster to load; pickle otherwise."""
+    try:
+        return "marshal", marshal.dumps(dataset)
+    except ValueError:
+        return "pickle", pickle.dumps(dataset, protocol=pickle.HIGHEST_PROTOCOL)
+
+def deserialize(serializer: str, payload: bytes) -> Any:
+    return marshal.loads(payload) if serializer == "marshal" else pickle.loads(payload)
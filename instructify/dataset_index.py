@@ -0,0 +1,230 @@
+import random
+from array import array
+from collections.abc import Mapping
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+FEATURES = ("bboxes", "captions", "QA")
+
+class DatasetIndex:
+    """
+    Secondary indexes over a LOADED_DATA style mapping (dict, RecordStore or sharded cache).
+
+    Images get a position in build order, and each index is a set of positions:
+        by_dataset   dataset name -> images with an entry of that dataset
+        by_folder    every folder prefix of the image paths ('coco', 'coco/train2017') -> images
+        by_feature   'bboxes' / 'captions' / 'QA' -> images where some dataset has a non-empty one
+        box_counts   total boxes per image (int32 array)
+
+    Building scans the data once; afterwards filters, counts and samples cost O(matches).
+    Removals through remove()/remove_dataset() keep the indexes in sync. result_<run_id>
+    entries added while processing are not indexed.
+
+    E.g.
+        index = DatasetIndex(manager.LOADED_DATA)
+        len(index.by_dataset["coco_captions"])
+    """
+    def __init__(self, data: Mapping):
+        self.images: List[str] = []
+        self.positions: Dict[str, int] = {}
+        self.by_dataset: Dict[str, Set[int]] = {}
+        self.by_folder: Dict[str, Set[int]] = {}
+        self.by_feature: Dict[str, Set[int]] = {feature: set() for feature in FEATURES}
+        self.box_counts = array('i')
+        self.removed: Set[int] = set()
+        self.version = 0  # Bumped on every change, so queries know when to re-evaluate
+        for image in data:
+            self.add(image, data)
+
+    def add(self, image: str, data: Mapping):
+        position = self.positions.get(image)
+        if position is not None and position not in self.removed:
+            self.remove(image)
+        self.version += 1
+        position = len(self.images)
+        self.images.append(image)
+        self.positions[image] = position
+
+        folder = image
+        while "/" in folder:
+            folder = folder.rsplit("/", 1)[0]
+            self.by_folder.setdefault(folder, set()).add(position)
+
+        box_count = 0
+        dataset_names = data.dataset_names(image) if hasattr(data, "dataset_names") else list(data[image])
+        image_data = None
+        for dataset_name in dataset_names:
+            if dataset_name.startswith("result_"):
+                continue
+            self.by_dataset.setdefault(dataset_name, set()).add(position)
+            if image_data is None:
+                image_data = data[image]
+            entry = image_data[dataset_name]
+            if not isinstance(entry, dict):
+                continue
+            for feature in FEATURES:
+                if entry.get(feature):
+                    self.by_feature[feature].add(position)
+            box_count += len(entry.get("bboxes") or [])
+        self.box_counts.append(box_count)
+
+    def remove(self, image: str):
+        """Drop an image from every index."""
+        position = self.positions.pop(image, None)
+        if position is None:
+            return
+        self.removed.add(position)
+        self.version += 1
+        folder = image
+        while "/" in folder:
+            folder = folder.rsplit("/", 1)[0]
+            self.by_folder[folder].discard(position)
+        for positions in (*self.by_dataset.values(), *self.by_feature.values()):
+            positions.discard(position)
+
+    def remove_dataset(self, image: str, dataset_name: str, data: Mapping):
+        """Re-index an image after one of its datasets was dropped."""
+        self.remove(image)
+        if image in data:
+            self.add(image, data)
+
+    def __len__(self) -> int:
+        return len(self.images) - len(self.removed)
+
+    def all(self) -> Set[int]:
+        return set(self.positions.values())
+
+    def folder(self, image_folder: str) -> Set[int]:
+        return self.by_folder.get(image_folder.strip("/"), set())
+
+    def sample(self, n: int, positions: Optional[Set[int]] = None) -> List[str]:
+        """n distinct random images, among the given positions or all images."""
+        if positions is None and not self.removed:
+            return random.sample(self.images, n)
+        pool = list(positions if positions is not None else self.positions.values())
+        return [self.images[i] for i in random.sample(pool, n)]
+
+class Query(Mapping):
+    """
+    Composable, lazily evaluated filter over a DatasetIndex, usable as a read-only view
+    image -> image_data of the matching images (nothing is copied).
+
+    Filters narrow the candidate set starting from the index sets, so a query costs O(matches):
+        query.dataset("coco_captions").min_boxes(5).has("captions").exclude(done_images)
+
+    Queries combine with & (both), | (either) and - (difference).
+
+    E.g.
+        view = manager.query().folder("coco").min_boxes(5).has("captions").not_in_run("llava_v1")
+        len(view), view.sample(10), list(view)
+    """
+    def __init__(self, index: DatasetIndex, data: Mapping, positions: Optional[Set[int]] = None,
+                 predicates: tuple = (), on_run: Optional[Callable[[str], Set[str]]] = None):
+        self.index = index
+        self.data = data
+        self._positions = positions  # None means all images
+        self._predicates = predicates
+        self._on_run = on_run
+        self._result = None
+        self._result_version = None
+
+    def _derive(self, positions: Optional[Set[int]] = None, predicate: Callable[[int], bool] = None) -> "Query":
+        if positions is not None and self._positions is not None:
+            small, large = sorted((positions, self._positions), key=len)
+            positions = {i for i in small if i in large}
+        elif positions is None:
+            positions = self._positions
+        predicates = self._predicates + ((predicate, ) if predicate is not None else ())
+        return Query(self.index, self.data, positions, predicates, self._on_run)
+
+    # ------------------------------------------------------------------ filters
+
+    def dataset(self, *dataset_names: str) -> "Query":
+        """Images with an entry of any of the given datasets."""
+        return self._derive(positions=set().union(*(self.index.by_dataset.get(name, set()) for name in dataset_names)))
+
+    def folder(self, *image_folders: str) -> "Query":
+        """Images under any of the given folder prefixes, e.g. 'coco' or 'vg/VG_100K'."""
+        return self._derive(positions=set().union(*(self.index.folder(folder) for folder in image_folders)))
+
+    def has(self, *features: str) -> "Query":
+        """Images with non-empty 'bboxes', 'captions' and/or 'QA' (all of the given features)."""
+        query = self
+        for feature in features:
+            if feature not in FEATURES:
+                raise ValueError(f"Unknown feature '{feature}', expected one of {FEATURES}")
+            query = query._derive(positions=self.index.by_feature[feature])
+        return query
+
+    def min_boxes(self, n: int) -> "Query":
+        counts = self.index.box_counts
+        if n > 0 and self._positions is None:
+            # Images with boxes are a cheaper starting set than every image
+            return self._derive(positions=self.index.by_feature["bboxes"], predicate=lambda i: counts[i] >= n)
+        return self._derive(predicate=lambda i: counts[i] >= n)
+
+    def max_boxes(self, n: int) -> "Query":
+        counts = self.index.box_counts
+        return self._derive(predicate=lambda i: counts[i] <= n)
+
+    def exclude(self, images: Iterable[str]) -> "Query":
+        """Images not in the given collection of image names."""
+        excluded = {self.index.positions[image] for image in images if image in self.index.positions}
+        return self._derive(predicate=lambda i: i not in excluded)
+
+    def not_in_run(self, run_id: str) -> "Query":
+        """Images without a result or reservation in the given run."""
+        if self._on_run is None:
+            raise ValueError("This query has no access to run results.")
+        return self.exclude(self._on_run(run_id))
+
+    def where(self, predicate: Callable[[str, Mapping], bool]) -> "Query":
+        """Images for which predicate(image, image_data) is true (decodes each candidate)."""
+        images, data = self.index.images, self.data
+        return self._derive(predicate=lambda i: predicate(images[i], data[images[i]]))
+
+    def __and__(self, other: "Query") -> "Query":
+        return self._derive(positions=other.positions())
+
+    def __or__(self, other: "Query") -> "Query":
+        return Query(self.index, self.data, self.positions() | other.positions(), on_run=self._on_run)
+
+    def __sub__(self, other: "Query") -> "Query":
+        return Query(self.index, self.data, self.positions() - other.positions(), on_run=self._on_run)
+
+    # ------------------------------------------------------------------ evaluation
+
+    def positions(self) -> Set[int]:
+        if self._result is None or self._result_version != self.index.version:
+            self._result_version = self.index.version
+            candidates = self._positions if self._positions is not None else self.index.positions.values()
+            self._result = {i for i in candidates if i not in self.index.removed and all(p(i) for p in self._predicates)}
+        return self._result
+
+    def images(self) -> List[str]:
+        return [self.index.images[i] for i in sorted(self.positions())]
+
+    def sample(self, n: int) -> Dict[str, Mapping]:
+        return {image: self.data[image] for image in self.index.sample(n, self.positions())}
+
+    def count_by_dataset(self) -> Dict[str, int]:
+        positions = self.positions()
+        return {name: len(members & positions) for name, members in self.index.by_dataset.items()}
+
+    def __getitem__(self, image: str):
+        position = self.index.positions.get(image)
+        if position is None or position not in self.positions():
+            raise KeyError(image)
+        return self.data[image]
+
+    def __contains__(self, image) -> bool:
+        position = self.index.positions.get(image)
+        return position is not None and position in self.positions()
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.images())
+
+    def __len__(self) -> int:
+        return len(self.positions())
+
+    def __repr__(self):
+        return f"Query({len(self)} images)"
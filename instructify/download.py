@@ -0,0 +1,225 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+
+CHUNK_SIZE = 1024 * 1024
+SEGMENT_SIZE = 64 * 1024**2
+PARALLEL_MIN_SIZE = 256 * 1024**2
+PART_SUFFIX = ".part"
+STATE_SUFFIX = ".part.json"
+
+class DownloadError(Exception):
+    """Raised when a download fails after all retries or does not verify."""
+    pass
+
+_local = threading.local()
+
+def get_session(pool_size: int = 16) -> requests.Session:
+    """Session of the calling thread, reusing pooled keep-alive connections across downloads."""
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _local.session = session
+    return session
+
+def file_checksum(path: str, algorithm: str = "sha256") -> str:
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _probe(url: str, headers: Dict[str, str], timeout: float) -> Tuple[Optional[int], bool, Optional[str]]:
+    """(size, accepts byte ranges, validator) of a URL, from a HEAD request (or a 1 byte GET if HEAD fails)."""
+    session = get_session()
+    try:
+        response = session.head(url, headers=headers, allow_redirects=True, timeout=timeout)
+        response.raise_for_status()
+        size = response.headers.get("Content-Length")
+        accepts_ranges = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+        validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+        if size is not None and "Content-Encoding" not in response.headers:
+            return int(size), accepts_ranges, validator
+    except requests.RequestException:
+        pass
+    # Some servers do not answer HEAD properly, ask for the first byte instead
+    try:
+        with session.get(url, headers={**headers, "Range": "bytes=0-0"}, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+            if response.status_code == 206 and "/" in response.headers.get("Content-Range", ""):
+                total = response.headers["Content-Range"].rsplit("/", 1)[1]
+                return (int(total) if total != "*" else None), True, validator
+            size = response.headers.get("Content-Length")
+            return (int(size) if size is not None else None), False, validator
+    except requests.RequestException:
+        return None, False, None
+
+def _retrying(fn, retries: int, what: str):
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except (requests.RequestException, OSError) as e:
+            if attempt == retries:
+                raise DownloadError(f"{what} failed after {retries + 1} attempts: {e}") from e
+            delay = min(60, 2 ** attempt)
+            print(f"{what} failed ({e}), retrying in {delay}s...")
+            time.sleep(delay)
+
+def _stream(response, f, progress, limit: Optional[int] = None) -> int:
+    written = 0
+    for chunk in response.iter_content(CHUNK_SIZE):
+        if limit is not None and written + len(chunk) > limit:
+            chunk = chunk[:limit - written]
+        f.write(chunk)
+        written += len(chunk)
+        if progress is not None:
+            progress.update(len(chunk))
+        if limit is not None and written >= limit:
+            break
+    return written
+
+def _download_sequential(url: str, part_path: str, headers: Dict[str, str], size: Optional[int], accepts_ranges: bool,
+                         timeout: float, retries: int, progress):
+    """Stream into part_path, resuming from its current size with a Range request when possible."""
+    def attempt():
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if size is not None and offset >= size:
+            return
+        request_headers = dict(headers)
+        if offset and accepts_ranges:
+            request_headers["Range"] = f"bytes={offset}-"
+        with get_session().get(url, headers=request_headers, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            if offset and response.status_code != 206:
+                # The server ignored the range, start over
+                offset = 0
+                if progress is not None:
+                    progress.reset(total=size)
+            with open(part_path, "r+b" if offset else "wb") as f:
+                f.seek(offset)
+                f.truncate()
+                _stream(response, f, progress)
+        if size is not None and os.path.getsize(part_path) < size:
+            raise requests.ConnectionError(f"connection closed at {os.path.getsize(part_path)} of {size} bytes")
+
+    _retrying(attempt, retries, f"Download of {url}")
+
+def _download_segmented(url: str, part_path: str, headers: Dict[str, str], size: int, validator: Optional[str],
+                        segment_size: int, max_workers: int, timeout: float, retries: int, progress):
+    """Download byte ranges in parallel into a preallocated part file, recording finished segments for resume."""
+    state_path = part_path[:-len(PART_SUFFIX)] + STATE_SUFFIX
+    segments: List[Tuple[int, int]] = [(start, min(start + segment_size, size) - 1) for start in range(0, size, segment_size)]
+    done = set()
+    if os.path.exists(state_path) and os.path.exists(part_path):
+        with open(state_path) as f:
+            state = json.load(f)
+        if state.get("size") == size and state.get("validator") == validator and state.get("segment_size") == segment_size:
+            done = set(state["done"])
+    if not done:
+        with open(part_path, "wb") as f:
+            f.truncate(size)
+    if progress is not None:
+        progress.update(sum(segments[i][1] - segments[i][0] + 1 for i in done))
+
+    lock = threading.Lock()
+    def save_state():
+        tmp_path = state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"url": url, "size": size, "validator": validator, "segment_size": segment_size, "done": sorted(done)}, f)
+        os.replace(tmp_path, state_path)
+
+    def fetch(i: int):
+        start, end = segments[i]
+        def attempt():
+            with get_session().get(url, headers={**headers, "Range": f"bytes={start}-{end}"}, stream=True, timeout=timeout) as response:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise DownloadError(f"Server ignored the byte range of {url}")
+                with open(part_path, "r+b") as f:
+                    f.seek(start)
+                    written = _stream(response, f, None, limit=end - start + 1)
+            if written != end - start + 1:
+                raise requests.ConnectionError(f"segment {start}-{end} ended after {written} bytes")
+        _retrying(attempt, retries, f"Segment {start}-{end} of {url}")
+        with lock:
+            done.add(i)
+            save_state()
+            if progress is not None:
+                progress.update(end - start + 1)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(fetch, [i for i in range(len(segments)) if i not in done]))
+
+def download_file(url: str, dest: str, headers: Dict[str, str] = None, sha256: str = None, md5: str = None,
+                  segment_size: int = SEGMENT_SIZE, parallel_min_size: int = PARALLEL_MIN_SIZE, max_workers: int = 8,
+                  timeout: float = 60, retries: int = 5, progress: bool = True) -> str:
+    """
+    Download a URL to dest, streaming to disk.
+
+    The data goes to <dest>.part and is renamed to dest once complete (and verified), so dest
+    only ever holds a finished file and an existing dest is not downloaded again. Interrupted
+    downloads resume: small files with a Range request from the current size, files of at
+    least parallel_min_size in parallel byte-range segments, whose progress is kept in
+    <dest>.part.json. Connections come from a pooled per-thread session.
+
+    :param headers: Extra request headers, e.g. authorization
+    :param sha256: Expected hex digest, verified before the rename
+    :param md5: Expected hex digest, verified before the rename
+    :param segment_size: Bytes per parallel segment
+    :param parallel_min_size: Files at least this large (with range support) are downloaded in segments
+    :param max_workers: Parallel segment downloads
+    :param retries: Retries per request, with exponential backoff, resuming where it stopped
+    :return: dest
+
+    E.g. download_file("http://images.cocodataset.org/annotations/annotations_trainval2017.zip", zip_path)
+    """
+    headers = dict(headers or {})
+    if os.path.exists(dest) and not os.path.exists(dest + PART_SUFFIX):
+        return dest
+    os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+    part_path = dest + PART_SUFFIX
+    state_path = dest + STATE_SUFFIX
+
+    size, accepts_ranges, validator = _probe(url, headers, timeout)
+    bar = tqdm(total=size, unit="B", unit_scale=True, desc=os.path.basename(dest)) if progress else None
+    try:
+        if size is not None and accepts_ranges and size >= parallel_min_size:
+            _download_segmented(url, part_path, headers, size, validator, segment_size, max_workers, timeout, retries, bar)
+        else:
+            if os.path.exists(state_path):
+                # Left over from a segmented attempt of a file that changed, its part file can't be resumed sequentially
+                os.remove(state_path)
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+            if bar is not None and os.path.exists(part_path):
+                bar.update(os.path.getsize(part_path))
+            _download_sequential(url, part_path, headers, size, accepts_ranges, timeout, retries, bar)
+    finally:
+        if bar is not None:
+            bar.close()
+
+    if size is not None and os.path.getsize(part_path) != size:
+        raise DownloadError(f"Downloaded {os.path.getsize(part_path)} bytes of {url}, expected {size}")
+    for algorithm, expected in (("sha256", sha256), ("md5", md5)):
+        if expected is not None and file_checksum(part_path, algorithm) != expected.lower():
+            os.remove(part_path)
+            if os.path.exists(state_path):
+                os.remove(state_path)
+            raise DownloadError(f"{algorithm} checksum mismatch for {url}")
+
+    os.replace(part_path, dest)
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    return dest
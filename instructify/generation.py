@@ -48,4 +48,7 @@ def get_async_model(model_name, gpu_memory_utilization=0.99, engine_args={}):
             result = request_output.outputs[0].text
         
         return result
+
+    # Used by PromptBudget to count tokens against per-image budgets
+    generate_response.count_tokens = lambda text: len(tokenizer.encode(text, add_special_tokens=False))
     return generate_response
\ No newline at end of file
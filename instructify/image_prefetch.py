@@ -0,0 +1,127 @@
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Iterable
+
+import numpy as np
+from PIL import Image
+
+def decode_image(image_path: str, max_resolution: int = 1920) -> np.ndarray:
+    """
+    Read and decode an image into an RGB uint8 array, downscaled to fit max_resolution.
+    """
+    with Image.open(image_path) as img_pil:
+        img_pil.thumbnail((max_resolution, max_resolution))
+        return np.array(img_pil.convert("RGB"))
+
+class ImagePrefetcher:
+    """
+    Reads and decodes upcoming images in background threads into a bounded LRU cache.
+
+    Images are keyed by path and the cache is bounded by the total bytes of the decoded arrays,
+    so storage latency overlaps with GPU work instead of sitting on the critical path. Decodes
+    only start while the cached images plus a worst-case estimate for those in flight fit in
+    max_bytes; the remaining images wait their turn, so prefetching ahead never evicts images
+    that are still needed. Images that will not be used should be released with pop().
+
+    E.g.
+        prefetcher = ImagePrefetcher(max_bytes=2 * 1024**3)
+        prefetcher.prefetch(["/cache/coco/train2017/1.jpg", "/cache/coco/train2017/2.jpg"])
+        image = await prefetcher.get_async("/cache/coco/train2017/1.jpg")
+        prefetcher.pop("/cache/coco/train2017/1.jpg")
+    """
+    def __init__(self, max_bytes: int = 2 * 1024**3, max_resolution: int = 1920, workers: int = 8):
+        self.max_bytes = max_bytes
+        self.max_resolution = max_resolution
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self._lock = threading.RLock()  # Reentrant, as a decode finishing right away stores itself while submitted
+        self._cache = OrderedDict()    # path -> decoded array, least recently used first
+        self._pending = {}             # path -> Future of an in-flight decode
+        self._waiting = OrderedDict()  # paths to prefetch once the budget allows, in order
+        self._discard = set()          # in-flight paths popped before their decode finished
+        self._bytes = 0
+        self._estimate = max_resolution * max_resolution * 3  # Bytes reserved per in-flight decode
+
+    def prefetch(self, image_paths: Iterable[str]):
+        """Decode the given images in the background as the budget allows, skipping ones already cached or in flight."""
+        with self._lock:
+            for image_path in image_paths:
+                self._discard.discard(image_path)
+                if image_path not in self._cache and image_path not in self._pending:
+                    self._waiting[image_path] = None
+            self._fill()
+
+    def get(self, image_path: str) -> np.ndarray:
+        """Return the decoded image, waiting for an in-flight prefetch or decoding it now if needed."""
+        return self._future(image_path).result()
+
+    async def get_async(self, image_path: str) -> np.ndarray:
+        """Like get, without blocking the event loop while the image is read and decoded."""
+        return await asyncio.wrap_future(self._future(image_path))
+
+    def pop(self, image_path: str):
+        """Release an image once it has been consumed, or drop it if it will not be used."""
+        with self._lock:
+            image = self._cache.pop(image_path, None)
+            if image is not None:
+                self._bytes -= image.nbytes
+            self._waiting.pop(image_path, None)
+            if image_path in self._pending:
+                self._discard.add(image_path)
+            self._fill()
+
+    def close(self):
+        with self._lock:
+            self._waiting.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _future(self, image_path: str) -> Future:
+        with self._lock:
+            self._discard.discard(image_path)
+            if image_path in self._cache:
+                self._cache.move_to_end(image_path)
+                future = Future()
+                future.set_result(self._cache[image_path])
+                return future
+            if image_path in self._pending:
+                return self._pending[image_path]
+            # Needed now, so decode it whatever the budget
+            self._waiting.pop(image_path, None)
+            return self._submit(image_path)
+
+    def _fill(self):
+        # Start waiting decodes while they fit, and at least one when nothing is cached or in flight
+        while self._waiting and (self._bytes + (len(self._pending) + 1) * self._estimate <= self.max_bytes
+                                 or not (self._cache or self._pending)):
+            image_path, _ = self._waiting.popitem(last=False)
+            self._submit(image_path)
+
+    def _submit(self, image_path: str) -> Future:
+        future = self._executor.submit(decode_image, image_path, self.max_resolution)
+        self._pending[image_path] = future
+        future.add_done_callback(lambda f, path=image_path: self._store(path, f))
+        return future
+
+    def _store(self, image_path: str, future: Future):
+        with self._lock:
+            self._pending.pop(image_path, None)
+            try:
+                if image_path in self._discard:
+                    self._discard.discard(image_path)
+                    return
+                if future.cancelled() or future.exception() is not None:
+                    return  # Errors are raised to whoever waits on the future
+                image = future.result()
+                if image.nbytes > self.max_bytes:
+                    return
+                self._cache[image_path] = image
+                self._bytes += image.nbytes
+                while self._bytes > self.max_bytes:
+                    _, evicted = self._cache.popitem(last=False)
+                    self._bytes -= evicted.nbytes
+            finally:
+                self._fill()
+
+    def __len__(self):
+        return len(self._cache)
@@ -0,0 +1,217 @@
+import re
+import json
+from json.decoder import scanstring
+from typing import Any, Iterable, Iterator, Optional, Tuple
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_STRUCTURE = re.compile(r'[\[\]{}"]')
+_STRING_TAIL = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+_SCALAR = re.compile(r"[^,}\]\s]*")
+_NUMBER_CHARS = frozenset("0123456789.eE+-")
+_NUMBER_ARRAY = re.compile(r"\[[\[\]0-9.,eE+\- \t\n\r]*")
+_decoder = json.JSONDecoder()
+
+class _Incomplete(Exception):
+    """The buffer ends inside the value being read."""
+    pass
+
+def _skip_value(text: str, i: int) -> int:
+    """Index just past the JSON value starting at or after i, without decoding it."""
+    i = _WHITESPACE.match(text, i).end()
+    if i >= len(text):
+        raise _Incomplete
+    if text[i] == '"':
+        match = _STRING_TAIL.match(text, i + 1)
+        if match is None:
+            raise _Incomplete
+        return match.end()
+    if text[i] not in "[{":
+        end = _SCALAR.match(text, i).end()
+        if end >= len(text):
+            raise _Incomplete
+        return end
+    if text[i] == "[":
+        # Fast path for (nested) arrays of numbers like polygons: the run of number characters
+        # ends at the first quote or brace after the value, so the value is that run without its
+        # trailing separators, if the brackets balance there
+        match = _NUMBER_ARRAY.match(text, i)
+        if match.end() < len(text):
+            span = text[i:match.end()].rstrip(" \t\n\r,")
+            if span.count("[") == span.count("]"):
+                return i + len(span)
+    # Only brackets and quotes are visited, numbers are stepped over by the regex engine
+    depth = 0
+    position = i
+    while True:
+        match = _STRUCTURE.search(text, position)
+        if match is None:
+            raise _Incomplete
+        char = match.group()
+        if char == '"':
+            tail = _STRING_TAIL.match(text, match.end())
+            if tail is None:
+                raise _Incomplete
+            position = tail.end()
+            continue
+        position = match.end()
+        depth += 1 if char in "[{" else -1
+        if depth == 0:
+            return position
+
+class _Stream:
+    """
+    Text of a JSON file read in chunks, with the values of skip_keys replaced by null
+    (wherever they appear) before anything is decoded.
+    """
+    def __init__(self, f, skip_keys: Iterable[str], chunk_size: int):
+        self.f = f
+        self.chunk_size = chunk_size
+        skip_keys = list(skip_keys)
+        self.skip = re.compile('"(?:' + "|".join(re.escape(key) for key in skip_keys) + r')"\s*:') if skip_keys else None
+        self.keep = max((len(key) for key in skip_keys), default=0) + 16  # Room for a key cut by the chunk end
+        self.raw = ""
+        self.eof = False
+        self.buffer = ""
+        self.position = 0
+
+    def _clean(self, raw: str) -> Tuple[str, str]:
+        """(cleaned text, raw rest that needs more data)"""
+        if self.skip is None:
+            return raw, ""
+        out, i = [], 0
+        while True:
+            match = self.skip.search(raw, i)
+            if match is None:
+                safe = len(raw) if self.eof else max(i, len(raw) - self.keep)
+                out.append(raw[i:safe])
+                return "".join(out), raw[safe:]
+            if match.start() > 0 and raw[match.start() - 1] == "\\":
+                # Escaped quote inside a string, not a key
+                out.append(raw[i:match.end()])
+                i = match.end()
+                continue
+            try:
+                end = _skip_value(raw, match.end())
+            except _Incomplete:
+                if self.eof:
+                    raise ValueError(f"Truncated JSON in {getattr(self.f, 'name', 'stream')}")
+                out.append(raw[i:match.start()])
+                return "".join(out), raw[match.start():]
+            out.append(raw[i:match.end()])
+            out.append("null")
+            i = end
+
+    def fill(self) -> bool:
+        """Append more cleaned text to the buffer, False at the end of the file."""
+        while not self.eof:
+            chunk = self.f.read(self.chunk_size)
+            self.eof = not chunk
+            cleaned, self.raw = self._clean(self.raw + chunk)
+            if cleaned or self.eof:
+                self.buffer = self.buffer[self.position:] + cleaned
+                self.position = 0
+                return bool(cleaned)
+        return False
+
+    def peek(self) -> str:
+        """Next non-whitespace character, '' at the end."""
+        while True:
+            self.position = _WHITESPACE.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.fill():
+                return ""
+
+    def expect(self, chars: str) -> str:
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"Expected one of {chars!r} at {self.position}, got {char!r}")
+        self.position += 1
+        return char
+
+    def string(self) -> str:
+        self.expect('"')
+        while True:
+            try:
+                value, end = scanstring(self.buffer, self.position)
+                self.position = end
+                return value
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.position)
+                # A number cut by the chunk end (e.g. after '12', '1.' or '1e-') decodes to a prefix
+                # of itself, so it may continue in the next chunk
+                cut = isinstance(value, (int, float)) and not isinstance(value, bool) and (
+                    end == len(self.buffer) or self.buffer[end] in _NUMBER_CHARS)
+                if not cut or self.eof:
+                    self.position = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+    def items(self) -> Iterator[Any]:
+        """Items of the array starting at the current position."""
+        self.expect("[")
+        if self.peek() == "]":
+            self.position += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(",]") == "]":
+                return
+
+def iter_json_arrays(path: str, keys: Optional[Iterable[str]] = None, skip_keys: Iterable[str] = (),
+                     chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[Optional[str], Any]]:
+    """
+    Stream the items of the top-level arrays of a JSON file as (key, item) events, e.g. the
+    'images', 'annotations' and 'categories' of a COCO-format file, in file order.
+
+    Memory stays proportional to one item plus a read chunk. Values of skip_keys (at any depth,
+    e.g. 'segmentation' polygons or RLE dicts) are stepped over without being decoded and come
+    back as None. Top-level values not in keys are decoded item by item and dropped, and
+    reading stops once every key in keys has been seen. A file whose root is an array yields
+    (None, item) for each item. A selected key with a non-array value yields (key, value) once.
+
+    E.g.
+        for key, item in iter_json_arrays(instances_file, ("categories", "annotations"), skip_keys=("segmentation", )):
+            ...
+    """
+    keys = set(keys) if keys is not None else None
+    with open(path, "r", encoding="utf-8") as f:
+        stream = _Stream(f, skip_keys, chunk_size)
+        if stream.peek() == "[":
+            for item in stream.items():
+                yield None, item
+            return
+        stream.expect("{")
+        remaining = set(keys) if keys is not None else None
+        if stream.peek() == "}":
+            return
+        while True:
+            key = stream.string()
+            stream.expect(":")
+            selected = keys is None or key in keys
+            if stream.peek() == "[":
+                for item in stream.items():
+                    if selected:
+                        yield key, item
+            else:
+                value = stream.value()
+                if selected:
+                    yield key, value
+            if remaining is not None:
+                remaining.discard(key)
+                if not remaining:
+                    return
+            if stream.expect(",}") == "}":
+                return
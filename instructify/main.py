@@ -12,12 +12,57 @@ from generation import get_async_model
 from prompt_manager import PromptManager
 from data_management import DatasetManager
 from utils import old_format_bboxes
+from image_prefetch import ImagePrefetcher
 from examples import PROMPT_DISTRIBUTIONS
 
+def template_run_ids(run_id, prompt_templates):
+    """
+    Map each prompt template to the run_id its results are cached under.
+
+    A single template keeps the given run_id, several templates each get their own
+    run_id (e.g. llava_replacement_LVIS) so results can be processed separately.
+    """
+    if len(prompt_templates) == 1:
+        return {prompt_templates[0]: run_id}
+    return {template: f"{run_id}_{template}" for template in prompt_templates}
+
+def count_boxes(image_data):
+    """Count the bounding boxes an image has across all of its datasets."""
+    return sum(len(data.get("bboxes", [])) for data in image_data.values() if isinstance(data, dict))
+
+def information_length(image_data):
+    """Total length of the caption and QA text an image has across all of its datasets."""
+    return sum(
+        len(text)
+        for data in image_data.values() if isinstance(data, dict)
+        for key in ("captions", "QA")
+        for text in data.get(key, [])
+    )
+
+def admission_check(img, image_data, data_manager, run_ids, args):
+    """
+    Cheap checks run before any LLM or GPU work, ordered by cost (in-memory, then file system).
+
+    Returns the reason code an image would produce nothing, or None if it should be processed.
+    """
+    # Without enough boxes for the vision stage, the text alone has to carry the image
+    if count_boxes(image_data) < args.min_box_count and information_length(image_data) < args.min_information_length:
+        return "information_length"
+
+    # Already processed for every template (e.g. by another worker or a previous run)
+    if all(data_manager.has_result(img, run_id=run_id) for run_id in run_ids.values()):
+        return "duplicate"
+
+    # Make sure image exists
+    if not os.path.exists(os.path.join(os.environ['INSTRUCTIFY_CACHE'], img)):
+        return "not_found"
+    return None
+
 async def main_async(args):
-    PROMPT_DISTRIBUTION = PROMPT_DISTRIBUTIONS.get(args.prompt_template, None)
-    if PROMPT_DISTRIBUTION is None:
-        raise ValueError(f"Prompt distribution {args.prompt_template} not found, available prompt distributions are {list(PROMPT_DISTRIBUTIONS.keys())}")
+    for prompt_template in args.prompt_template:
+        if prompt_template not in PROMPT_DISTRIBUTIONS:
+            raise ValueError(f"Prompt distribution {prompt_template} not found, available prompt distributions are {list(PROMPT_DISTRIBUTIONS.keys())}")
+    run_ids = template_run_ids(args.run_id, args.prompt_template)
 
     # Setup remains the same...
     num_gpus = torch.cuda.device_count()
@@ -38,14 +83,18 @@ async def main_async(args):
     from conversion.box import HierarchicalObjectOrganizer # import locally to avoid conflicts with vllm
     if args.disable_bbox_tree:
         organizer = None
+        prefetcher = None
     else:
         organizer = HierarchicalObjectOrganizer()
+        prefetcher = ImagePrefetcher(max_bytes=args.prefetch_cache_mb * 1024**2, max_resolution=organizer.max_resolution, workers=args.prefetch_workers)
     prompt_manager = PromptManager()
 
     # Data Manager (where data is saved)
     os.makedirs(args.output_path, exist_ok=True)
-    data_manager = DatasetManager(args.output_path, max_workers=8)
-    data = data_manager.load_cache(args.dataset_name)
+    data_manager = DatasetManager(args.output_path, max_workers=8, max_attempts=args.max_attempts,
+                                  result_store=args.result_store, compress_segments=args.compress_segments)
+    data = data_manager.load_cache(args.dataset_name, compact=args.compact_records, shared=args.shared_dataset)
+    data_manager.start_writer(max_batch=args.commit_batch, max_delay=args.commit_delay, fsync=args.fsync)
 
     # Loop to process images
     async def process_image():
@@ -54,15 +103,29 @@ async def main_async(args):
             image_dataset = data_manager.reserve(10, run_id=args.run_id)
             if image_dataset is None:
                 continue
-            
+
+            # Cheap admissibility checks first, so rejected images never reach the LLM or GPU (or the prefetcher)
+            admitted = []
             for img in image_dataset:
-                image_data = image_dataset[img]
+                skip_reason = admission_check(img, image_dataset[img], data_manager, run_ids, args)
+                if skip_reason is not None:
+                    data_manager.record_skip(img, skip_reason, run_id=args.run_id)
+                    print(f"Skipping image {img}: {skip_reason}")
+                else:
+                    admitted.append(img)
 
-                # Make sure image exists
+            # Start reading and decoding the images that will reach the vision stage in the background
+            if prefetcher is not None:
+                prefetcher.prefetch([
+                    os.path.join(os.environ['INSTRUCTIFY_CACHE'], img) for img in admitted
+                    if count_boxes(image_dataset[img]) >= args.min_box_count
+                ])
+            
+            for img in admitted:
+                image_data = image_dataset[img]
                 img_path = os.path.join(os.environ['INSTRUCTIFY_CACHE'], img)
-                if not os.path.exists(img_path):
-                    print(f"Image {img} not found")
-                    continue
+
+                use_boxes = count_boxes(image_data) >= args.min_box_count
                 
                 # Process information and image
                 information = []
@@ -74,15 +137,35 @@ async def main_async(args):
                         qa_sections.extend(data[img][dataset]["QA"])
 
                 if len(qa_sections) > 0:
-                    information += await prompt_manager.run_prompt("conversion/qa", data[img], model_callable)
+                    qa_information = await prompt_manager.run_prompt("conversion/qa", data[img], model_callable)
+                    if qa_information:
+                        information += qa_information
 
-                if not args.disable_bbox_tree:
-                    box_str = await organizer.image_data_conversion(
-                        img_path,
-                        image_data,
-                        include_box_label=True,
-                        depth_calculation=True
-                    )
+                # Last check before the GPU stage, now that the QA conversion is known
+                if not use_boxes and sum(len(info) for info in information) < args.min_information_length:
+                    if prefetcher is not None:
+                        prefetcher.pop(img_path)
+                    data_manager.record_skip(img, "information_length", run_id=args.run_id)
+                    print(f"Skipping image {img}: information_length")
+                    continue
+
+                if not use_boxes:
+                    box_captioned = []
+                elif not args.disable_bbox_tree:
+                    try:
+                        box_str = await organizer.image_data_conversion(
+                            img_path,
+                            image_data,
+                            include_box_label=True,
+                            depth_calculation=True,
+                            image=await prefetcher.get_async(img_path)
+                        )
+                    except Exception as e:
+                        data_manager.record_failure(img, "vision", type(e).__name__, str(e), run_id=args.run_id)
+                        print(f"Failed vision stage for image {img}: {e}")
+                        continue
+                    finally:
+                        prefetcher.pop(img_path)
 
                     if len(box_str) > 20:
                         box_captioned = await prompt_manager.run_prompt("conversion.to_caption", box_str, model_callable, max_retries=1)
@@ -100,14 +183,30 @@ async def main_async(args):
                 
                 information += box_captioned
 
-                result = await prompt_manager.process(information, model_callable, PROMPT_DISTRIBUTION, max_count=args.max_sample_count, filtering_enabled=(not args.disable_filtering), min_information_length=10)
-                
-                if result:
-                    data_manager.cache_image_result(img, result, run_id=args.run_id)
-                    last_success_time = time.time()  # Update timestamp on successful cache
-                    print("Finished processing image", img)
-                else:
-                    print(f"Failed to process image {img}, result is {result}")
+                # Only templates without a result yet, since results are appended (e.g. after another template failed)
+                pending_run_ids = {template: run_id for template, run_id in run_ids.items()
+                                   if not data_manager.has_result(img, run_id=run_id)}
+                if not pending_run_ids:
+                    continue
+
+                # Information is built once per image, then shared by every prompt template
+                results = await asyncio.gather(*[
+                    prompt_manager.process(information, model_callable, PROMPT_DISTRIBUTIONS[template], max_count=args.max_sample_count, filtering_enabled=(not args.disable_filtering), min_information_length=args.min_information_length, max_seconds=args.max_image_seconds, max_tokens=args.max_image_tokens, max_calls=args.max_image_calls)
+                    for template in pending_run_ids
+                ])
+
+                for (template, run_id), result in zip(pending_run_ids.items(), results):
+                    if result:
+                        data_manager.cache_image_result(img, result, run_id=run_id)
+                        last_success_time = time.time()  # Update timestamp on successful cache
+                        print(f"Finished processing image {img} ({template})")
+                    else:
+                        print(f"Failed to process image {img} ({template}), result is {result}")
+
+                # Dead-letter the image when no template produced anything, so it is retried at most max_attempts times
+                if not any(results):
+                    error_type = getattr(results[0], "error_type", "empty_result")
+                    data_manager.record_failure(img, "process", error_type, str(results[0]), run_id=args.run_id)
 
     # Global variable to track last successful cache
     last_success_time = time.time()
@@ -116,25 +215,44 @@ async def main_async(args):
             await asyncio.sleep(60)  # Check every minute
             if time.time() - last_success_time > 600:  # 10 minutes
                 print("No progress detected for 10 minutes. Exiting.")
+                data_manager.close_writer()  # Commit pending results before exiting
                 os._exit(1)  # Force quit the program
 
     # Run workers and monitor
     workers = [asyncio.create_task(process_image()) for _ in range(args.num_workers)]
     monitor = asyncio.create_task(monitor_progress())
-    await asyncio.gather(*workers, monitor)
+    try:
+        await asyncio.gather(*workers, monitor)
+    finally:
+        data_manager.close_writer()  # Commit pending results however the run ends
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process images with captioning and bounding box analysis using language models")
     parser.add_argument("--run_id", type=str, help="Unique identifier to track this processing run in the cache")
-    parser.add_argument("--dataset_name", type=str, help="Name of JSON dataset file previously cached via DatasetManager.cache()")
+    parser.add_argument("--dataset_name", type=str, help="Name of JSON dataset file (or sharded cache directory) previously cached via DatasetManager.cache()")
+    parser.add_argument("--shared_dataset", action="store_true", help="Memory-map a sharded dataset cache read-only so processes on a node share one copy")
+    parser.add_argument("--compact_records", action="store_true", help="Keep the dataset in a compact columnar record store (float32 boxes, interned labels) to reduce memory")
     parser.add_argument("--num_workers", type=int, default=80, help="Number of concurrent processing workers, usually ~40 per GPU is sufficient")
     parser.add_argument("--model", type=str, default="google/gemma-2-27b-it", help="HuggingFace model ID for language processing")
     parser.add_argument("--vllm_gpu_mem_fraction", type=float, default=0.85, help="Fraction of GPU memory to allocate for language model (0.0-0.85), need space for SAM2 and Depth Anything V2 if not disabled")
     parser.add_argument("--output_path", type=str, default="./data", help="Directory to save processing files, use dataset_manager to load from this cache.")
     parser.add_argument("--max_sequence_length", type=int, default=4096, help="Maximum number of tokens for model input")
-    parser.add_argument("--prompt_template", type=str, default="LLaVA", help="Template name from PROMPT_DISTRIBUTIONS in examples.py")
+    parser.add_argument("--prompt_template", type=str, nargs="+", default=["LLaVA"], help="Template name(s) from PROMPT_DISTRIBUTIONS in examples.py, several templates share one pass over each image and are saved under <run_id>_<template>")
     parser.add_argument("--disable_bbox_tree", action="store_true", help="Skip hierarchical bounding box analysis of images")
     parser.add_argument("--disable_filtering", action="store_true", help="Allow all generated samples without quality filtering (recommended when max_sample_count = 1)")
     parser.add_argument("--max_sample_count", type=int, default=10, help="Maximum number of language model samples per image")
+    parser.add_argument("--min_information_length", type=int, default=10, help="Minimum characters of information needed to process an image, shorter images are skipped before any GPU work")
+    parser.add_argument("--result_store", type=str, default="files", choices=["files", "segments"], help="Save results as one JSONL file per image, or in append-only segments per worker (see process_results.py --compact)")
+    parser.add_argument("--compress_segments", action="store_true", help="zstd-compress result segments (requires zstandard)")
+    parser.add_argument("--commit_batch", type=int, default=64, help="Number of completed images written together in one group commit")
+    parser.add_argument("--commit_delay", type=float, default=5.0, help="Maximum seconds a completed image waits before its group is committed")
+    parser.add_argument("--fsync", type=str, default="none", choices=["none", "commit", "always"], help="When to fsync result files: never, once per group commit, or after every result")
+    parser.add_argument("--prefetch_cache_mb", type=int, default=2048, help="Memory budget (MB) for images decoded ahead of the SAM2 and depth stage")
+    parser.add_argument("--prefetch_workers", type=int, default=8, help="Number of background threads reading and decoding upcoming images")
+    parser.add_argument("--max_image_seconds", type=float, default=None, help="Wall-clock budget per image and template for instruction generation, partial results are kept when exhausted")
+    parser.add_argument("--max_image_tokens", type=int, default=None, help="Token budget (prompt + response) per image and template for instruction generation")
+    parser.add_argument("--max_image_calls", type=int, default=None, help="LLM call budget per image and template for instruction generation")
+    parser.add_argument("--max_attempts", type=int, default=3, help="Failed attempts after which an image is no longer reserved, see process_results.py --dead-letter")
+    parser.add_argument("--min_box_count", type=int, default=1, help="Minimum number of bounding boxes needed to run the SAM2 and depth stage on an image")
     args = parser.parse_args()
     asyncio.run(main_async(args))
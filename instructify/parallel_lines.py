@@ -0,0 +1,99 @@
+import io
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, TextIO, Tuple
+
+from dataset_cache import serialize, deserialize
+
+CHUNK_BYTES = 32 * 1024**2
+
+def line_ranges(path: str, chunk_bytes: int = CHUNK_BYTES) -> List[Tuple[int, int]]:
+    """
+    Split a file into (start, end) byte ranges of about chunk_bytes each, every range starting
+    and ending at a line boundary.
+    """
+    size = os.path.getsize(path)
+    ranges, start = [], 0
+    with open(path, "rb") as f:
+        while start < size:
+            end = start + chunk_bytes
+            if end >= size:
+                end = size
+            else:
+                f.seek(end)
+                f.readline()  # Finish the line the range would cut
+                end = f.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+def read_range(path: str, start: int, end: int, encoding: str = "utf-8") -> TextIO:
+    """Lines of a byte range of a file, read like `for line in open(path)` would read them."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return io.TextIOWrapper(io.BytesIO(data), encoding=encoding)
+
+def _parse_range(parse_chunk: Callable, path: str, start: int, end: int, encoding: str) -> Tuple[str, bytes]:
+    # Marshal (see dataset_cache.serialize) returns plain dicts/lists/strings much faster than pickling
+    return serialize(parse_chunk(path, read_range(path, start, end, encoding)))
+
+def merge_records(merged: Dict[str, dict], records: Dict[str, dict]) -> Dict[str, dict]:
+    """
+    Merge the per-image records of one chunk into merged: new images are added, and the list
+    fields (captions, QA, bboxes) of images seen in an earlier chunk are extended.
+    """
+    for image, record in records.items():
+        existing = merged.get(image)
+        if existing is None:
+            merged[image] = record
+            continue
+        for key, value in record.items():
+            if isinstance(value, list):
+                existing[key].extend(value)
+    return merged
+
+def parse_lines(paths: Iterable[str], parse_chunk: Callable[[str, Iterable[str]], Any],
+                merge: Callable[[Any, Any], Any] = merge_records, workers: Optional[int] = None,
+                chunk_bytes: int = CHUNK_BYTES, encoding: str = "utf-8") -> Any:
+    """
+    Parse line-based files (JSONL, CSV with one record per line) in parallel.
+
+    The files are split at line boundaries into byte ranges of about chunk_bytes, each range is
+    parsed by parse_chunk(path, lines) in a worker process, and the chunk results are merged in
+    file order with merge(merged, result), starting from the first chunk's result. The default
+    merge combines per-image records (see merge_records).
+
+    parse_chunk must be a module-level function so the workers can import it. Records may not
+    span lines (e.g. CSV fields with quoted newlines), since a range can end between them.
+
+    :param workers: Number of worker processes, all cores by default. Files smaller than one
+                    chunk, or workers=1, are parsed in this process.
+
+    E.g.
+        def _parse_chunk(path, lines):
+            records = {}
+            for line in lines:
+                row = json.loads(line)
+                ...
+            return records
+
+        data = parse_lines([captions_file], _parse_chunk)
+    """
+    ranges = [(path, start, end) for path in paths for start, end in line_ranges(path, chunk_bytes)]
+    workers = min(workers or os.cpu_count() or 1, len(ranges))
+    if workers <= 1:
+        results = (parse_chunk(path, read_range(path, start, end, encoding)) for path, start, end in ranges)
+        return _merge_all(results, merge)
+
+    # spawn, since forking after CUDA/vLLM initialization is unsafe
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [executor.submit(_parse_range, parse_chunk, path, start, end, encoding) for path, start, end in ranges]
+        return _merge_all((deserialize(*future.result()) for future in futures), merge)
+
+def _merge_all(results: Iterable[Any], merge: Callable[[Any, Any], Any]) -> Any:
+    merged = None
+    for i, result in enumerate(results):
+        merged = result if i == 0 else merge(merged, result)
+    return merged if merged is not None else {}
@@ -0,0 +1,348 @@
+import os
+assert 'INSTRUCTIFY_CACHE' in os.environ, "INSTRUCTIFY_CACHE environment variable must be set with the path to the cache directory"
+
+import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, List, Optional
+
+from data_management import DatasetManager, DatasetError, _import_dataset_module, _load_dataset_process
+from dataset_cache import LoadCache
+
+RESOURCES = ("network", "cpu", "disk")
+DOWNLOADED_FLAGS = ("downloaded", "processed")
+
+def _download_coco_train2017(cache_dir: str):
+    # utils fetches NLTK data on import, so only import it when the images are needed
+    from utils import download_coco_train2017_images
+    download_coco_train2017_images(cache_dir)
+
+def _vg_images_present(cache_dir: str) -> bool:
+    return all(os.path.exists(os.path.join(cache_dir, "images", "vg", folder)) for folder in ("VG_100K", "VG_100K_2"))
+
+def _check_vg_images(cache_dir: str):
+    if not _vg_images_present(cache_dir):
+        raise DatasetError("Images for Visual Genome (images/vg/VG_100K and VG_100K_2) not found. Please download them.")
+
+# Image folders datasets can require, as (is_done(cache_dir), fetch(cache_dir))
+IMAGE_TASKS = {
+    "coco/train2017": (lambda cache_dir: os.path.exists(os.path.join(cache_dir, "images/coco/train2017/downloaded")),
+                       _download_coco_train2017),
+    "vg": (_vg_images_present, _check_vg_images),
+}
+
+class Task:
+    """
+    One step of the preparation graph.
+
+    :param resource: 'network', 'cpu' or 'disk', the pool whose limit the task counts against
+    :param run: Called without arguments in a worker thread
+    :param process: (function, args) run in a worker process instead, its result goes to finish
+    :param is_done: Checked when the task becomes ready, True skips it (e.g. matching fingerprints)
+    :param finish: Called in the scheduler with the result of run/process
+    """
+    def __init__(self, name: str, resource: str, deps: List[str] = (), run: Callable = None, process: tuple = None,
+                 is_done: Callable[[], bool] = None, finish: Callable = None):
+        if resource not in RESOURCES:
+            raise ValueError(f"Unknown resource '{resource}', expected one of {RESOURCES}")
+        self.name = name
+        self.resource = resource
+        self.deps = list(deps)
+        self.run = run
+        self.process = process
+        self.is_done = is_done
+        self.finish = finish
+
+    def __repr__(self):
+        return f"Task({self.name}, {self.resource}, deps={self.deps})"
+
+class PreparationGraph:
+    """
+    Dependency graph of download -> convert -> load -> cache tasks over a set of datasets.
+
+        download:<dataset>   the dataset's download() (network), skipped once its downloaded flag exists
+        images:<folder>      image folders other datasets need, e.g. images:coco/train2017 (network)
+        convert:<dataset>    the dataset's load() in a worker process, stored in the load cache (cpu),
+                             skipped while the cached entry matches its source fingerprints
+        load                 merge of the converted datasets (cpu)
+        cache:<name>         the merged data written under INSTRUCTIFY_CACHE (disk), skipped while
+                             the datasets' fingerprints match the ones it was written from
+        verify:<name>        reads the written cache back (disk)
+
+    A dataset module declares what its load() needs besides its own download in REQUIRES, e.g.
+    REQUIRES = ["download:coco_captions", "images:vg"]. Required tasks are added to the graph
+    even for datasets that are not prepared themselves. dataset_options holds keyword arguments
+    for the load() of each dataset, e.g. {"visual_genome": {"group_boxes": True}}.
+
+    E.g.
+        graph = PreparationGraph(["coco_captions", "visual_genome"], cache_name="llava")
+        graph.run({"network": 4, "cpu": 2, "disk": 1})
+    """
+    def __init__(self, dataset_names: List[str], cache_name: Optional[str] = None, download: bool = True,
+                 convert: bool = True, sharded: bool = False, verify: bool = False, force: bool = False,
+                 dataset_options: Optional[Dict[str, dict]] = None):
+        self.cache_dir = os.environ['INSTRUCTIFY_CACHE']
+        self.dataset_names = list(dataset_names)
+        self.dataset_options = dataset_options or {}
+        self.cache_name = cache_name
+        self.sharded = sharded
+        self.force = force
+        self.load_cache = LoadCache(self.cache_dir)
+        self.tasks: Dict[str, Task] = {}
+        self._manager = None
+        self._convert_keys = {}
+
+        for dataset_name in self.dataset_names:
+            module = _import_dataset_module(dataset_name)
+            requires = list(getattr(module, "REQUIRES", []))
+            if download:
+                self._add_download(dataset_name)
+                for required in requires:
+                    kind, _, target = required.partition(":")
+                    if kind == "download":
+                        self._add_download(target)
+                    elif kind == "images":
+                        self._add_images(target)
+                    else:
+                        raise DatasetError(f"Unknown requirement '{required}' of dataset '{dataset_name}'.")
+            if convert:
+                self._add(Task(f"convert:{dataset_name}", "cpu", [f"download:{dataset_name}"] + requires,
+                               process=(_load_dataset_process, (self.cache_dir, dataset_name, self.dataset_options.get(dataset_name))),
+                               is_done=lambda name=dataset_name: self._convert_done(name),
+                               finish=lambda result, name=dataset_name: self._store_converted(name, result)))
+
+        if convert and cache_name is not None:
+            self._add(Task("load", "cpu", [f"convert:{name}" for name in self.dataset_names],
+                           run=self._load, is_done=self._cache_done))
+            self._add(Task(f"cache:{cache_name}", "disk", ["load"], run=self._write_cache, is_done=self._cache_done))
+        if verify and cache_name is not None:
+            self._add(Task(f"verify:{cache_name}", "disk", [f"cache:{cache_name}"], run=self._verify))
+
+        # Dependencies on tasks outside the graph (e.g. downloads when only converting) count as met
+        for task in self.tasks.values():
+            task.deps = [dep for dep in task.deps if dep in self.tasks]
+
+    def _add(self, task: Task):
+        self.tasks.setdefault(task.name, task)
+
+    def _add_download(self, dataset_name: str):
+        def run():
+            _import_dataset_module(dataset_name).download(self.cache_dir)
+            print(f"Downloaded {dataset_name}")
+        dataset_folder = os.path.join(self.cache_dir, dataset_name)
+        self._add(Task(f"download:{dataset_name}", "network", run=run,
+                       is_done=lambda: any(os.path.exists(os.path.join(dataset_folder, flag)) for flag in DOWNLOADED_FLAGS)))
+
+    def _add_images(self, folder: str):
+        if folder not in IMAGE_TASKS:
+            raise DatasetError(f"Unknown image folder '{folder}', expected one of {list(IMAGE_TASKS)}")
+        is_done, fetch = IMAGE_TASKS[folder]
+        self._add(Task(f"images:{folder}", "network", run=lambda: fetch(self.cache_dir), is_done=lambda: is_done(self.cache_dir)))
+
+    # ------------------------------------------------------------------ fingerprints
+
+    def _convert_key(self, dataset_name: str) -> tuple:
+        # Computed once the task is ready, after its downloads changed the files
+        self._convert_keys[dataset_name] = self.load_cache.key(dataset_name, _import_dataset_module(dataset_name),
+                                                               self.dataset_options.get(dataset_name))
+        return self._convert_keys[dataset_name]
+
+    def _convert_done(self, dataset_name: str) -> bool:
+        key = self._convert_key(dataset_name)
+        return not self.force and self.load_cache.is_fresh(dataset_name, key)
+
+    def _store_converted(self, dataset_name: str, result):
+        _, serializer, payload = result
+        self.load_cache.put(dataset_name, self._convert_keys[dataset_name], serializer=serializer, payload=payload)
+
+    def _state_path(self) -> str:
+        return os.path.join(self.cache_dir, ".prepare", f"{self.cache_name}.json")
+
+    def _cache_state(self) -> dict:
+        keys = [self.load_cache.key(name, _import_dataset_module(name), self.dataset_options.get(name))
+                for name in sorted(self.dataset_names)]
+        return {"datasets": sorted(self.dataset_names), "sharded": self.sharded, "keys": repr(keys)}
+
+    def _cache_done(self) -> bool:
+        if self.force or not os.path.exists(os.path.join(self.cache_dir, self.cache_name)):
+            return False
+        try:
+            with open(self._state_path(), "r") as f:
+                return json.load(f) == self._cache_state()
+        except (OSError, ValueError):
+            return False
+
+    # ------------------------------------------------------------------ load and cache
+
+    def _load(self):
+        self._manager = DatasetManager(max_workers=len(self.dataset_names))
+        self._manager.load(self.dataset_names, dataset_options=self.dataset_options)
+
+    def _write_cache(self):
+        self._manager.cache(self.cache_name, sharded=self.sharded)
+        self._manager = None
+        os.makedirs(os.path.dirname(self._state_path()), exist_ok=True)
+        with open(self._state_path(), "w") as f:
+            json.dump(self._cache_state(), f)
+        print(f"Cached {', '.join(self.dataset_names)} to {self.cache_name}")
+
+    def _verify(self):
+        manager = DatasetManager()
+        data = manager.load_cache(self.cache_name)
+        print(f"Loaded {len(data)} images from {self.cache_name}")
+
+    # ------------------------------------------------------------------ scheduling
+
+    def order(self) -> List[Task]:
+        """Tasks in a dependency respecting order."""
+        ordered, visiting, visited = [], set(), set()
+        def visit(name: str):
+            if name in visited:
+                return
+            if name in visiting:
+                raise DatasetError(f"Dependency cycle through '{name}'.")
+            visiting.add(name)
+            for dep in self.tasks[name].deps:
+                visit(dep)
+            visiting.discard(name)
+            visited.add(name)
+            ordered.append(self.tasks[name])
+        for name in self.tasks:
+            visit(name)
+        return ordered
+
+    def run(self, limits: Dict[str, int]) -> Dict[str, str]:
+        """
+        Run the graph, starting every task whose dependencies finished as long as its resource is
+        below its limit. A failed task blocks its dependents, independent branches keep going.
+
+        :param limits: Concurrent tasks per resource, e.g. {"network": 4, "cpu": 2, "disk": 1}
+        :return: Status per task: 'done', 'skipped', 'failed' or 'blocked'
+        """
+        limits = {resource: max(1, limits.get(resource, 1)) for resource in RESOURCES}
+        status: Dict[str, str] = {}
+        pending = [task.name for task in self.order()]
+        running, in_use = {}, {resource: 0 for resource in RESOURCES}
+        started = {}
+
+        with ThreadPoolExecutor(max_workers=sum(limits.values())) as threads, \
+             ProcessPoolExecutor(max_workers=limits["cpu"], mp_context=multiprocessing.get_context("spawn")) as processes:
+            while pending or running:
+                for name in list(pending):
+                    task = self.tasks[name]
+                    dep_status = [status.get(dep) for dep in task.deps]
+                    if any(s in ("failed", "blocked") for s in dep_status):
+                        pending.remove(name)
+                        status[name] = "blocked"
+                        print(f"Blocked {name}, a dependency failed")
+                        continue
+                    if not all(s in ("done", "skipped") for s in dep_status) or in_use[task.resource] >= limits[task.resource]:
+                        continue
+                    pending.remove(name)
+                    try:
+                        if task.is_done is not None and task.is_done():
+                            status[name] = "skipped"
+                            print(f"Skipped {name} (up to date)")
+                            continue
+                    except Exception as e:
+                        status[name] = "failed"
+                        print(f"Failed {name}: {e}")
+                        continue
+                    print(f"Started {name}")
+                    started[name] = time.time()
+                    in_use[task.resource] += 1
+                    if task.process is not None:
+                        function, args = task.process
+                        running[processes.submit(function, *args)] = name
+                    else:
+                        running[threads.submit(task.run)] = name
+
+                if not running:
+                    # Pending tasks come in dependency order, so one pass resolves everything not waiting on a running task
+                    if pending:
+                        raise DatasetError(f"Tasks can't be scheduled: {pending}")
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    task = self.tasks[name]
+                    in_use[task.resource] -= 1
+                    try:
+                        result = future.result()
+                        if task.finish is not None:
+                            task.finish(result)
+                        status[name] = "done"
+                        print(f"Finished {name} in {time.time() - started[name]:.1f}s")
+                    except Exception as e:
+                        status[name] = "failed"
+                        print(f"Failed {name}: {e}")
+        return status
+
+def main():
+    parser = argparse.ArgumentParser(description="Download, convert and cache datasets, running independent steps concurrently")
+    parser.add_argument("--datasets", type=str, nargs="+", required=True,
+                        help="Datasets to prepare, e.g. coco_captions lvis visual_genome")
+    parser.add_argument("--download", action="store_true",
+                        help="Download the datasets and everything they require")
+    parser.add_argument("--cache", action="store_true",
+                        help="Convert (load) the datasets and write the merged cache --cache-name")
+    parser.add_argument("--cache-name", type=str, default=None,
+                        help="Name of the merged cache under INSTRUCTIFY_CACHE")
+    parser.add_argument("--sharded", action="store_true",
+                        help="Write the cache as JSONL shards plus an index instead of one JSON file")
+    parser.add_argument("--dataset-option", type=str, action="append", default=[], metavar="DATASET:KEY=VALUE",
+                        help="Option for a dataset's loader, e.g. visual_genome:group_boxes=true (repeatable)")
+    parser.add_argument("--test-load-from-cache", action="store_true",
+                        help="Read the written cache back")
+    parser.add_argument("--network-jobs", type=int, default=4,
+                        help="Concurrent download tasks")
+    parser.add_argument("--cpu-jobs", type=int, default=min(4, os.cpu_count() or 1),
+                        help="Concurrent convert/load tasks (worker processes)")
+    parser.add_argument("--disk-jobs", type=int, default=1,
+                        help="Concurrent cache writing tasks")
+    parser.add_argument("--force", action="store_true",
+                        help="Convert and cache again even if the fingerprints match")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Print the task graph without running it")
+    args = parser.parse_args()
+
+    if (args.cache or args.test_load_from_cache) and args.cache_name is None:
+        parser.error("--cache and --test-load-from-cache need --cache-name")
+    if not (args.download or args.cache or args.test_load_from_cache):
+        parser.error("Nothing to do, pass --download, --cache and/or --test-load-from-cache")
+
+    dataset_options = {}
+    for option in args.dataset_option:
+        dataset_name, _, assignment = option.partition(":")
+        key, equals, value = assignment.partition("=")
+        if not (dataset_name and key and equals):
+            parser.error(f"--dataset-option expects DATASET:KEY=VALUE, got '{option}'")
+        try:
+            value = json.loads(value)
+        except ValueError:
+            pass  # A plain string
+        dataset_options.setdefault(dataset_name, {})[key] = value
+
+    graph = PreparationGraph(args.datasets, cache_name=args.cache_name, download=args.download, convert=args.cache,
+                             sharded=args.sharded, verify=args.test_load_from_cache, force=args.force,
+                             dataset_options=dataset_options)
+    if args.dry_run:
+        for task in graph.order():
+            print(f"{task.name} [{task.resource}]" + (f" <- {', '.join(task.deps)}" if task.deps else ""))
+        return
+
+    start = time.time()
+    status = graph.run({"network": args.network_jobs, "cpu": args.cpu_jobs, "disk": args.disk_jobs})
+    print(f"Prepared in {time.time() - start:.1f}s")
+    for state in ("done", "skipped", "failed", "blocked"):
+        names = [name for name, s in status.items() if s == state]
+        if names:
+            print(f"\t{state}: {', '.join(names)}")
+    if any(s in ("failed", "blocked") for s in status.values()):
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -84,31 +84,39 @@ def main():
                       help="Remove all result files")
     group.add_argument("--export", type=str,
                       help="Export formatted results to specified JSON path")
+    group.add_argument("--dead-letter", action="store_true",
+                      help="Report failed and skipped images")
+    group.add_argument("--compact", action="store_true",
+                      help="Compact the run's result segments into one segment")
     
     # Additional options
     parser.add_argument("--detailed-count", action="store_true",
                        help="Show detailed conversation statistics")
     parser.add_argument("--max-workers", type=int, default=8,
-                       help="Number of workers for parallel processing")
+                       help="Number of threads scanning the save directory (count, clean, export)")
+    parser.add_argument("--compress", action="store_true",
+                       help="zstd-compress the segment written by --compact")
+    parser.add_argument("--max-attempts", type=int, default=3,
+                       help="Failed attempts after which an image counts as exhausted")
     
     args = parser.parse_args()
     
     # Initialize manager
-    manager = DatasetManager(max_workers=args.max_workers)
+    manager = DatasetManager(max_workers=args.max_workers, max_attempts=args.max_attempts)
     
     if args.count:
-        count = manager.count_results(args.run_id)
+        count = manager.count_results(args.run_id, workers=args.max_workers)
         print(f"Total files: {count}")
         
         if args.detailed_count:
-            results = manager.collect_results(args.run_id)
+            results = manager.collect_results(args.run_id, workers=args.max_workers)
             stats = count_conversation_stats(results)
             print(f"Images processed: {stats['image_count']}")
             print(f"Total conversations: {stats['conv_count']}")
             print(f"Total turns: {stats['turn_count']}")
     
     elif args.clean:
-        manager.clean(args.run_id, empty_only=True)
+        manager.clean(args.run_id, workers=args.max_workers, empty_only=True)
         print(f"Cleaned empty results for {args.run_id}")
     
     elif args.remove:
@@ -119,9 +127,25 @@ def main():
             print("Operation cancelled")
             return
 
-        manager.clean(args.run_id, empty_only=False)
+        manager.clean(args.run_id, workers=args.max_workers, empty_only=False)
         print(f"Removed all results for {args.run_id}")
     
+    elif args.compact:
+        count = manager.compact_results(args.run_id, compress=args.compress)
+        print(f"Compacted {count} results for {args.run_id}")
+
+    elif args.dead_letter:
+        report = manager.dead_letter_report(args.run_id)
+        print(f"Failed images: {report['failed_images']} ({report['exhausted_images']} at max attempts)")
+        for failure, count in sorted(report["failures"].items(), key=lambda x: -x[1]):
+            print(f"\t{failure}: {count}")
+        print("Attempts per failed image:")
+        for attempts, count in report["attempts"].items():
+            print(f"\t{attempts}: {count}")
+        print(f"Skipped images: {sum(report['skipped'].values())}")
+        for reason, count in sorted(report["skipped"].items(), key=lambda x: -x[1]):
+            print(f"\t{reason}: {count}")
+
     elif args.export:
         # Validate json path
         export_path = args.export
@@ -131,7 +155,7 @@ def main():
         os.makedirs(os.path.dirname(os.path.abspath(export_path)), exist_ok=True)
         
         # Collect and format results
-        results = manager.collect_results(args.run_id)
+        results = manager.collect_results(args.run_id, workers=args.max_workers)
         formatted_results = format_results(results)
         
         # Save to JSON
@@ -5,7 +5,8 @@ import importlib
 import json
 import asyncio
 import random
-from typing import Any, Callable, Dict, List, Tuple
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 class PromptManagerError:
     """
@@ -31,6 +32,56 @@ class PromptManagerError:
         """
         raise TypeError(f"PromptManagerError is not JSON serializable: {self.message}")
 
+class PromptBudgetExceeded(Exception):
+    """Raised by a budgeted model callable once a PromptBudget is exhausted."""
+    pass
+
+class PromptBudget:
+    """
+    Per-image limits on wall-clock time, total tokens and total LLM calls (None means unlimited).
+
+    Tokens are counted with `count_tokens` (e.g. the model tokenizer), or estimated as 4 characters per token.
+    """
+    def __init__(self, max_seconds: Optional[float] = None, max_tokens: Optional[int] = None, max_calls: Optional[int] = None, count_tokens: Optional[Callable[[str], int]] = None):
+        self.deadline = time.monotonic() + max_seconds if max_seconds is not None else None
+        self.max_tokens = max_tokens
+        self.max_calls = max_calls
+        self.count_tokens = count_tokens or (lambda text: len(text) // 4)
+        self.tokens = 0
+        self.calls = 0
+
+    def remaining_seconds(self) -> Optional[float]:
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def exhausted(self) -> Optional[str]:
+        """Return which budget is exhausted ('time', 'tokens' or 'calls'), or None."""
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return "time"
+        if self.max_tokens is not None and self.tokens >= self.max_tokens:
+            return "tokens"
+        if self.max_calls is not None and self.calls >= self.max_calls:
+            return "calls"
+        return None
+
+    def wrap(self, model_callable: Callable) -> Callable:
+        """Wrap an async model callable so every call is counted against (and bounded by) this budget."""
+        async def budgeted_model(messages, *args, **kwargs):
+            exhausted = self.exhausted()
+            if exhausted:
+                raise PromptBudgetExceeded(f"{exhausted} budget exhausted")
+            self.calls += 1
+            self.tokens += sum(self.count_tokens(message["content"]) for message in messages)
+            remaining = self.remaining_seconds()
+            if remaining is None:
+                response = await model_callable(messages, *args, **kwargs)
+            else:
+                response = await asyncio.wait_for(model_callable(messages, *args, **kwargs), timeout=remaining)
+            self.tokens += self.count_tokens(response)
+            return response
+        return budgeted_model
+
 class PromptManager:
     def __init__(self, prompt_dir: str = "prompt"):
         self.prompt_dir = prompt_dir
@@ -292,7 +343,10 @@ class PromptManager:
         max_count: int = 15,
         min_information_length: int = 100,
         prompt_retry_rate: int = 3,
-        filtering_enabled: bool = True
+        filtering_enabled: bool = True,
+        max_seconds: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        max_calls: Optional[int] = None
     ) -> List[Dict[str, Any]]:
         """
         Process the information using a distribution of prompts.
@@ -306,10 +360,17 @@ class PromptManager:
             min_information_length (int): Minimum length of the combined information string.
             prompt_retry_rate (int): Maximum number of retries for the prompt.
             filtering_enabled (bool): Whether to perform the filtering step.
+            max_seconds (float, optional): Wall-clock budget for the whole call.
+            max_tokens (int, optional): Budget of prompt and response tokens across all LLM calls.
+            max_calls (int, optional): Budget of LLM calls (generation, check and reduce).
 
         Returns:
             List[Dict[str, Any]]: List of dictionaries containing details of each processing step.
+            When a budget is exhausted, the results collected so far are returned.
         """
+        budget = PromptBudget(max_seconds, max_tokens, max_calls, count_tokens=getattr(model_callable, "count_tokens", None))
+        model_callable = budget.wrap(model_callable)
+
         results = []
         original_info = information.copy()  # Full original information for checking
         current_info = information.copy()   # Active information for prompting and reduce
@@ -322,6 +383,12 @@ class PromptManager:
             if sum(len(info) for info in current_info) < min_information_length:
                 break
 
+            # Stop with the partial results once a budget is exhausted
+            exhausted = budget.exhausted()
+            if exhausted:
+                print(f"Stopping after {len(results)} results, {exhausted} budget exhausted")
+                break
+
             # Sample a prompt based on the distribution
             prompt = self._sample_prompt_from_distribution(prompt_distribution)
 
@@ -338,6 +405,8 @@ class PromptManager:
                 qa_pairs = [
                     (output[i], output[i + 1]) for i in range(0, len(output) - 1, 2)
                 ]
+            elif budget.exhausted():
+                break  # The budget ran out during generation, keep the partial results
             else:
                 return PromptManagerError(
                     f"Error: Expected output to be a list of strings, but got {type(output)}",
@@ -0,0 +1,230 @@
+from array import array
+from collections.abc import Mapping, MutableMapping
+from typing import Any, Dict, Iterator, List, Optional
+
+# Fields of a dataset entry that are stored column-wise, everything else is kept as is
+ENCODED_FIELDS = ("image_id", "image_source", "bboxes", "captions", "QA")
+
+def _short_float(value: float) -> float:
+    # The decimal float32 can represent, so 0.1 comes back as 0.1 rather than 0.10000000149011612
+    return float(f"{value:.7g}")
+
+class InternTable:
+    """
+    Two-way mapping between strings and dense int ids, so each distinct string is stored once.
+
+    E.g.
+        labels = InternTable()
+        labels.intern("man")  # 0
+        labels[0]             # "man"
+    """
+    def __init__(self, values: Optional[List[str]] = None):
+        self.values: List[str] = []
+        self.ids: Dict[str, int] = {}
+        for value in values or []:
+            self.intern(value)
+
+    def intern(self, value: str) -> int:
+        value_id = self.ids.get(value)
+        if value_id is None:
+            value_id = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return value_id
+
+    def __getitem__(self, value_id: int) -> str:
+        return self.values[value_id]
+
+    def __len__(self):
+        return len(self.values)
+
+class RecordStore(MutableMapping):
+    """
+    Compact, dictionary-encoded replacement for the LOADED_DATA dict of
+    image -> {dataset_name: {"image_id", "image_source", "bboxes", "captions", "QA"}}.
+
+    Boxes of all images live in two flat columns: float32 coordinates (4 per box) and int32
+    label ids against one interned label table. Dataset names and image sources are interned
+    too, so per dataset entry of an image only a small tuple is kept:
+        (dataset_id, image_id, source_id, box_start, box_end, captions, QA, other_fields, key_order)
+
+    Reading an image returns an ImageRecord, a mapping that decodes each dataset entry back to
+    the original dict (with coordinates rounded to float32 precision) on access, so code written against
+    the plain dicts (main.py, HierarchicalObjectOrganizer.image_data_conversion) works unchanged.
+    Values that don't fit the schema (e.g. result_<run_id> entries or malformed boxes) are kept as is.
+
+    E.g.
+        store = RecordStore.from_data(manager.LOADED_DATA)
+        store["coco/train2017/1.jpg"]["coco_captions"]["bboxes"]  # [["man", 0.1, 0.2, 0.5, 0.9], ...]
+    """
+    def __init__(self):
+        self.labels = InternTable()
+        self.names = InternTable()  # Dataset names and image sources
+        self.coords = array('f')    # x1, y1, x2, y2 per box
+        self.label_ids = array('i')
+        self._records: Dict[str, tuple] = {}  # image -> tuple of encoded dataset entries
+        self._extras: Dict[str, dict] = {}    # image -> {key: value} not in the schema
+        self._key_tuples: Dict[tuple, tuple] = {}  # Shared key orders of the entries
+
+    @classmethod
+    def from_data(cls, data: Mapping) -> "RecordStore":
+        """Encode a LOADED_DATA style dict."""
+        store = cls()
+        for image, image_data in data.items():
+            store[image] = image_data
+        return store
+
+    # ------------------------------------------------------------------ encoding
+
+    def _encode_entry(self, dataset_name: str, entry: Any) -> Optional[tuple]:
+        if not isinstance(entry, dict) or not isinstance(entry.get("bboxes", []), list):
+            return None
+        image_source = entry.get("image_source")
+        if image_source is not None and not isinstance(image_source, str):
+            return None
+        box_start = len(self.label_ids)
+        coords, label_ids = [], []
+        for box in entry.get("bboxes", []):
+            if len(box) != 5 or not isinstance(box[0], str):
+                return None  # Not [label, x1, y1, x2, y2], keep the entry as is
+            label_ids.append(self.labels.intern(box[0]))
+            coords.extend(box[1:])
+        try:
+            coords = array('f', coords)
+        except TypeError:
+            return None
+        self.coords.extend(coords)
+        self.label_ids.extend(label_ids)
+        keys = tuple(k for k in entry if k in ENCODED_FIELDS)
+        other = {k: v for k, v in entry.items() if k not in ENCODED_FIELDS}
+        return (self.names.intern(dataset_name),
+                entry.get("image_id"),
+                self.names.intern(image_source) if image_source is not None else -1,
+                box_start, len(self.label_ids),
+                entry.get("captions"), entry.get("QA"),
+                other or None,
+                self._key_tuples.setdefault(keys, keys))
+
+    def _decode_entry(self, encoded: tuple) -> dict:
+        _, image_id, source_id, box_start, box_end, captions, qa, other, keys = encoded
+        coords, labels = self.coords, self.labels.values
+        values = {
+            "image_id": image_id,
+            "image_source": self.names[source_id] if source_id >= 0 else None,
+            "bboxes": [[labels[self.label_ids[i]]] + [_short_float(c) for c in coords[4 * i:4 * i + 4]] for i in range(box_start, box_end)],
+            "captions": captions,
+            "QA": qa,
+        }
+        entry = {k: values[k] for k in keys}
+        if other:
+            entry.update(other)
+        return entry
+
+    # ------------------------------------------------------------------ image level
+
+    def _set_image(self, image: str, image_data: Mapping):
+        encoded, extras = [], {}
+        for dataset_name, entry in image_data.items():
+            encoded_entry = self._encode_entry(dataset_name, entry)
+            if encoded_entry is None:
+                extras[dataset_name] = entry
+            else:
+                encoded.append(encoded_entry)
+        self._records[image] = tuple(encoded)
+        if extras:
+            self._extras[image] = extras
+        else:
+            self._extras.pop(image, None)
+
+    def dataset_names(self, image: str) -> List[str]:
+        """Dataset (and extra) keys of an image, without decoding anything."""
+        return [self.names[e[0]] for e in self._records[image]] + list(self._extras.get(image, ()))
+
+    def box_count(self, image: str) -> int:
+        """Number of encoded boxes of an image, without decoding anything."""
+        return sum(e[4] - e[3] for e in self._records[image])
+
+    def to_dict(self) -> Dict[str, dict]:
+        """Decode everything back into a LOADED_DATA style dict."""
+        return {image: dict(self[image]) for image in self}
+
+    def __getitem__(self, image: str) -> "ImageRecord":
+        if image not in self._records:
+            raise KeyError(image)
+        return ImageRecord(self, image)
+
+    def __setitem__(self, image: str, image_data: Mapping):
+        if isinstance(image_data, ImageRecord):
+            image_data = dict(image_data)
+        self._set_image(image, image_data)
+
+    def __delitem__(self, image: str):
+        # The image's boxes stay in the columns until the store is rebuilt with from_data
+        del self._records[image]
+        self._extras.pop(image, None)
+
+    def __contains__(self, image) -> bool:
+        return image in self._records
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._records)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def keys(self):
+        return self._records.keys()
+
+class ImageRecord(MutableMapping):
+    """Dict-like view of one image in a RecordStore: dataset name -> decoded entry."""
+    __slots__ = ("store", "image")
+
+    def __init__(self, store: RecordStore, image: str):
+        self.store = store
+        self.image = image
+
+    def _find(self, key: str) -> Optional[tuple]:
+        name_id = self.store.names.ids.get(key)
+        if name_id is None:
+            return None
+        for encoded in self.store._records[self.image]:
+            if encoded[0] == name_id:
+                return encoded
+        return None
+
+    def __getitem__(self, key: str):
+        extras = self.store._extras.get(self.image)
+        if extras is not None and key in extras:
+            return extras[key]
+        encoded = self._find(key)
+        if encoded is None:
+            raise KeyError(key)
+        return self.store._decode_entry(encoded)
+
+    def __setitem__(self, key: str, value):
+        # Extras (e.g. result_<run_id>) are stored as is, datasets are re-encoded
+        if self._find(key) is None and (key.startswith("result_") or not isinstance(value, dict)):
+            self.store._extras.setdefault(self.image, {})[key] = value
+            return
+        image_data = dict(self)
+        image_data[key] = value
+        self.store._set_image(self.image, image_data)
+
+    def __delitem__(self, key: str):
+        if key not in self:
+            raise KeyError(key)
+        image_data = dict(self)
+        del image_data[key]
+        self.store._set_image(self.image, image_data)
+
+    def __contains__(self, key) -> bool:
+        extras = self.store._extras.get(self.image)
+        return (extras is not None and key in extras) or self._find(key) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.store.dataset_names(self.image))
+
+    def __len__(self) -> int:
+        return len(self.store._records[self.image]) + len(self.store._extras.get(self.image, ()))
+
+    def __repr__(self):
+        return repr(dict(self))
@@ -0,0 +1,91 @@
+import time
+import threading
+from typing import Any, Callable, List
+
+FSYNC_POLICIES = ("none", "commit", "always")
+MAX_RETRY_DELAY = 60.0
+
+class GroupCommitWriter:
+    """
+    Asynchronous writer that batches completed results and commits them in groups.
+
+    Results are handed to `commit_fn` from a background thread once `max_batch` results are
+    pending or the oldest pending result has waited `max_delay` seconds, whichever comes first.
+    A failed commit (e.g. a full disk) is logged and its group kept pending, then retried with
+    exponential backoff, so submitting never fails because of an earlier commit.
+
+    E.g.
+        writer = GroupCommitWriter(manager._commit_results, max_batch=64, max_delay=5.0)
+        writer.submit(("coco/img_1.png", result, "run_0"))
+        writer.close()  # commits anything still pending
+    """
+    def __init__(self, commit_fn: Callable[[List[Any]], None], max_batch: int = 64, max_delay: float = 5.0):
+        self.commit_fn = commit_fn
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._pending: List[Any] = []
+        self._oldest = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="group-commit-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, item: Any):
+        """Queue an item for the next group commit."""
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("GroupCommitWriter is closed.")
+            if not self._pending:
+                self._oldest = time.monotonic()
+            self._pending.append(item)
+            if len(self._pending) >= self.max_batch:
+                self._condition.notify()
+
+    def flush(self):
+        """Commit everything pending now, from the calling thread."""
+        with self._condition:
+            batch = self._take()
+        if batch:
+            self.commit_fn(batch)
+
+    def close(self):
+        """Stop the background thread after committing everything pending."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        self.flush()
+
+    def _take(self) -> List[Any]:
+        batch, self._pending, self._oldest = self._pending, [], None
+        return batch
+
+    def _run(self):
+        retry_delay = 0.0
+        while True:
+            with self._condition:
+                retry_at = time.monotonic() + retry_delay
+                while not self._closed:
+                    now = time.monotonic()
+                    if now < retry_at:
+                        self._condition.wait(timeout=retry_at - now)
+                        continue
+                    if len(self._pending) >= self.max_batch:
+                        break
+                    if self._pending and now - self._oldest >= self.max_delay:
+                        break
+                    timeout = None if not self._pending else self.max_delay - (now - self._oldest)
+                    self._condition.wait(timeout=timeout)
+                if self._closed:
+                    return
+                batch = self._take()
+            try:
+                self.commit_fn(batch)
+                retry_delay = 0.0
+            except Exception as e:
+                retry_delay = min(MAX_RETRY_DELAY, retry_delay * 2 or 1.0)
+                print(f"Group commit of {len(batch)} results failed, retrying in {retry_delay:g}s: {e}")
+                with self._condition:
+                    # Put the batch back in front, already due once the backoff has passed
+                    self._pending = batch + self._pending
+                    self._oldest = time.monotonic() - self.max_delay
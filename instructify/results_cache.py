@@ -0,0 +1,189 @@
+import os
+import json
+from typing import Dict, List, Tuple
+
+from segment_store import SegmentStore, INDEX_SUFFIX, COMPRESSED_SUFFIX, _zstd
+
+class IncrementalResultsCache:
+    """
+    Aggregate of a run's results that is updated incrementally instead of rebuilt from scratch.
+
+    Two files live in the save directory:
+        <run_id>_results_cache.jsonl     append-only lines of {"source", "image", "results"},
+                                         or {"source", "retract": true} when a source changed or vanished
+        <run_id>_results_manifest.json   per source, what has already been ingested: the size and mtime of
+                                         a per-image JSONL file, or the bytes read of a segment's index
+                                         and the offset of the last record/frame read from it,
+                                         plus how many bytes of the aggregate it accounts for
+
+    Result files only grow while a run is live, so new bytes are read from the previous size onward and
+    segments are read from their index offset; anything else (shrunk, rewritten, removed) is retracted
+    and re-read. Sources are ingested with ingest_file/ingest_segment, then commit() persists the changes.
+    """
+    def __init__(self, save_dir: str, run_id: str):
+        self.aggregate_path = os.path.join(save_dir, f"{run_id}_results_cache.jsonl")
+        self.manifest_path = os.path.join(save_dir, f"{run_id}_results_manifest.json")
+        self.manifest = {}
+        self.entries: Dict[str, List[Tuple[str, list]]] = {}  # source -> [(image, results)]
+        self._seen = set()
+        self._lines = []
+        self._retracted = 0
+        self._loaded = False
+
+    def is_fresh(self, indicator_file_path: str) -> bool:
+        """True if nothing was written to the run since the aggregate was last updated."""
+        if not (os.path.exists(self.aggregate_path) and os.path.exists(self.manifest_path) and os.path.exists(indicator_file_path)):
+            return False
+        return os.path.getmtime(self.manifest_path) > os.path.getmtime(indicator_file_path)
+
+    def load(self):
+        """Read the manifest and replay the aggregate, dropping retracted sources."""
+        self._loaded = True
+        if not (os.path.exists(self.aggregate_path) and os.path.exists(self.manifest_path)):
+            self.manifest, self.entries = {}, {}
+            return
+        with open(self.manifest_path, 'r') as f:
+            manifest = json.load(f)
+        self.manifest = manifest["sources"]
+        # Lines past aggregate_size were appended by an interrupted update and are re-read instead
+        with open(self.aggregate_path, 'rb') as f:
+            data = f.read(manifest["aggregate_size"])
+        for line in data.splitlines():
+            entry = json.loads(line)
+            if entry.get("retract"):
+                self.entries.pop(entry["source"], None)
+                self._retracted += 1
+            else:
+                self.entries.setdefault(entry["source"], []).append((entry["image"], entry["results"]))
+        if os.path.getsize(self.aggregate_path) > manifest["aggregate_size"]:
+            with open(self.aggregate_path, 'r+b') as f:
+                f.truncate(manifest["aggregate_size"])
+
+    def results(self) -> Dict[str, list]:
+        """Image name -> list of results, in source order."""
+        if not self._loaded:
+            self.load()
+        all_results = {}
+        for entries in self.entries.values():
+            for image_name, results in entries:
+                all_results.setdefault(image_name, []).extend(results)
+        return all_results
+
+    def ingest_file(self, source: str, file_path: str, image_name: str, size: int = None, mtime: int = None):
+        """Ingest a per-image JSONL result file, reading only bytes appended since the last update."""
+        if size is None or mtime is None:
+            stat = os.stat(file_path)
+            size, mtime = stat.st_size, stat.st_mtime_ns
+        self._seen.add(source)
+        state = self.manifest.get(source)
+        if state is not None and state.get("size") == size and state.get("mtime") == mtime:
+            return
+        with open(file_path, 'rb') as f:
+            data = None
+            offset = 0
+            if state is not None and 0 < state.get("size", 0) < size:
+                # Grown since the last update: read only the appended bytes, unless the file was rewritten
+                f.seek(state["size"] - 1)
+                appended = f.read()
+                if appended[:1] == b'\n':
+                    try:
+                        results, complete = self._parse_complete_lines(appended[1:])
+                        data, offset = appended[1:], state["size"]
+                    except json.JSONDecodeError:
+                        pass
+            if data is None:
+                if state is not None:
+                    self._retract(source)
+                f.seek(0)
+                data = f.read()
+                results, complete = self._parse_complete_lines(data)
+        if results:
+            self._add(source, image_name, results)
+        self.manifest[source] = {"size": offset + len(complete), "mtime": mtime if len(complete) == len(data) else None}
+
+    @staticmethod
+    def _parse_complete_lines(data: bytes):
+        # Only consume complete lines, a partially written line is picked up next time
+        complete = data[:data.rfind(b'\n') + 1]
+        return [json.loads(line) for line in complete.splitlines() if line.strip()], complete
+
+    def ingest_segment(self, source: str, store: SegmentStore, segment: str):
+        """Ingest the records of a segment that were indexed since the last update."""
+        self._seen.add(source)
+        state = self.manifest.get(source)
+        offset = state.get("index_offset", 0) if state is not None else 0
+        # Offset of the last location read. A compressed group's index lines share one frame, which
+        # is read whole, so lines of it that were appended after the last update are already ingested
+        last_frame = state.get("last_frame") if state is not None else None
+        suffix = COMPRESSED_SUFFIX if segment.endswith(COMPRESSED_SUFFIX) else ".seg"
+        index_path = os.path.join(store.root, segment[:-len(suffix)] + INDEX_SUFFIX)
+        if not os.path.exists(index_path):
+            return
+        if os.path.getsize(index_path) < offset:
+            self._retract(source)
+            offset = 0
+            last_frame = None
+        with open(index_path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        complete = data[:data.rfind(b'\n') + 1]
+        locations = []
+        for line in complete.decode('utf-8').splitlines():
+            location_offset, length, _ = line.split("\t", 2)
+            locations.append((int(location_offset), int(length)))
+
+        # Read each new location once (records of a compressed group share one frame), in file order
+        with open(os.path.join(store.root, segment), 'rb') as f:
+            for location_offset, length in dict.fromkeys(locations):
+                if location_offset == last_frame:
+                    continue
+                last_frame = location_offset
+                f.seek(location_offset)
+                chunk = f.read(length)
+                if segment.endswith(COMPRESSED_SUFFIX):
+                    chunk = _zstd().ZstdDecompressor().decompress(chunk)
+                for line in chunk.splitlines():
+                    record = json.loads(line)
+                    self._add(source, record["image"], [record["result"]])
+        self.manifest[source] = {"index_offset": offset + len(complete), "last_frame": last_frame}
+
+    def commit(self):
+        """Retract sources that vanished, then append the new lines and save the manifest."""
+        for source in set(self.manifest) - self._seen:
+            self._retract(source)
+            del self.manifest[source]
+
+        live = sum(len(entries) for entries in self.entries.values())
+        if self._retracted > live:
+            # Mostly tombstones, rewrite the aggregate from the live entries (after invalidating
+            # the manifest, so an interruption leads to a full rebuild instead of a mismatch)
+            with open(self.manifest_path, 'w') as f:
+                json.dump({"aggregate_size": 0, "sources": {}}, f)
+            tmp_path = self.aggregate_path + ".tmp"
+            with open(tmp_path, 'w') as f:
+                for source, entries in self.entries.items():
+                    for image_name, results in entries:
+                        f.write(json.dumps({"source": source, "image": image_name, "results": results}) + '\n')
+            os.replace(tmp_path, self.aggregate_path)
+            self._retracted = 0
+        elif self._lines:
+            with open(self.aggregate_path, 'a') as f:
+                f.write("".join(self._lines))
+        self._lines = []
+
+        # The manifest is saved last, so an interrupted update is redone rather than half-applied
+        aggregate_size = os.path.getsize(self.aggregate_path) if os.path.exists(self.aggregate_path) else 0
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"aggregate_size": aggregate_size, "sources": self.manifest}, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _add(self, source: str, image_name: str, results: list):
+        self.entries.setdefault(source, []).append((image_name, results))
+        self._lines.append(json.dumps({"source": source, "image": image_name, "results": results}) + '\n')
+
+    def _retract(self, source: str):
+        if source in self.entries:
+            del self.entries[source]
+            self._lines.append(json.dumps({"source": source, "retract": True}) + '\n')
+            self._retracted += 1
@@ -0,0 +1,78 @@
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Iterator, List, Tuple
+
+# Directories and files at the top of the save directory that are not per-image results
+SKIPPED_DIRS = {"segments", "indicators", "skipped", "dead_letter"}
+SKIPPED_SUFFIXES = ('_results_cache.json', '_results_cache.jsonl', '_results_manifest.json', '.tmp')
+
+ResultEntry = namedtuple("ResultEntry", ["image", "path", "size", "mtime"])
+
+def image_name_from_path(rel_path: str, run_id: str) -> str:
+    """
+    Recover the image name from a result file path relative to the save directory,
+    e.g. 'coco/train2017/1.jpg-run_0.jsonl' -> 'coco/train2017/1.jpg'.
+    """
+    if run_id == "ALL":
+        # Remove the last suffix that matches '-<run_id>.jsonl'
+        image_name = rel_path.rsplit('-', 1)[0]
+    else:
+        suffix = f"-{run_id}.jsonl"
+        image_name = rel_path[:-len(suffix)] if rel_path.endswith(suffix) else rel_path[:-len('.jsonl')]
+    return image_name.replace(os.sep, '/')
+
+def _scan_directory(save_dir: str, directory: str, run_id: str) -> Tuple[List[ResultEntry], List[str]]:
+    entries, subdirs = [], []
+    suffix = f"-{run_id}.jsonl"
+    try:
+        iterator = os.scandir(directory)
+    except FileNotFoundError:
+        return entries, subdirs  # Removed while scanning
+    with iterator:
+        for entry in iterator:
+            if entry.is_dir(follow_symlinks=False):
+                if directory == save_dir and entry.name in SKIPPED_DIRS:
+                    continue
+                subdirs.append(entry.path)
+                continue
+            name = entry.name
+            if name.endswith(SKIPPED_SUFFIXES) or name.startswith(('indicator_', 'skipped_', 'dead_letter_')):
+                continue
+            if run_id != "ALL" and not name.endswith(suffix):
+                continue
+            try:
+                stat = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            rel_path = os.path.relpath(entry.path, save_dir)
+            entries.append(ResultEntry(image_name_from_path(rel_path, run_id), entry.path, stat.st_size, stat.st_mtime_ns))
+    return entries, subdirs
+
+def scan_results(save_dir: str, run_id: str, workers: int = 8, batch_size: int = 1024) -> Iterator[List[ResultEntry]]:
+    """
+    Walk the per-image result files of a run with os.scandir, scanning directory subtrees in parallel threads.
+
+    :param save_dir: The save directory (<INSTRUCTIFY_CACHE>/save)
+    :param run_id: Only yield files of this run_id. If "ALL", yield result files of every run.
+    :param workers: Number of threads scanning directories
+    :param batch_size: Number of entries per yielded batch
+    :return: Batches of ResultEntry(image, path, size, mtime)
+    """
+    if not os.path.isdir(save_dir):
+        return
+    batch = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        pending = {executor.submit(_scan_directory, save_dir, save_dir, run_id)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                entries, subdirs = future.result()
+                for subdir in subdirs:
+                    pending.add(executor.submit(_scan_directory, save_dir, subdir, run_id))
+                batch.extend(entries)
+                while len(batch) >= batch_size:
+                    yield batch[:batch_size]
+                    batch = batch[batch_size:]
+    if batch:
+        yield batch
@@ -0,0 +1,302 @@
+import io
+import os
+import json
+import shutil
+import socket
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+SEGMENT_SUFFIX = ".seg"
+COMPRESSED_SUFFIX = ".seg.zst"
+INDEX_SUFFIX = ".idx"
+RESERVED_SUFFIX = ".reserved"
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Compressed segments require the zstandard package (pip install zstandard).")
+    return zstandard
+
+def _fsync_dir(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class SegmentStore:
+    """
+    Append-only segment log for the results of one run, instead of one JSONL file per image.
+
+    Layout (under <save_dir>/segments/<run_id>/):
+        <writer_id>-<seq>.seg       JSON lines of {"image": ..., "result": ...}
+        <writer_id>-<seq>.seg.zst   the same, as one zstd frame per group commit (compress=True)
+        <writer_id>-<seq>.idx       "offset<TAB>length<TAB>image" per record (per frame when compressed)
+        <writer_id>.reserved        reserved image names, one per line
+
+    Every process writes to its own segments (writer_id defaults to <hostname>-<pid>), so no
+    locking is needed, and segments rotate once they reach max_segment_bytes.
+
+    E.g.
+        store = SegmentStore(os.path.join(cache_dir, "save"), "llava_replacement")
+        store.append([("coco/img_1.png", result)])
+        for image, result in store.iter_records():
+            ...
+    """
+    def __init__(self, save_dir: str, run_id: str, writer_id: str = None, compress: bool = False, max_segment_bytes: int = 256 * 1024**2):
+        self.root = os.path.join(save_dir, "segments", run_id)
+        self.run_id = run_id
+        self.writer_id = writer_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.compress = compress
+        self.max_segment_bytes = max_segment_bytes
+        self._segment = None  # Name of the segment this writer currently appends to
+        self._index = None    # Lazily loaded image -> [(segment, offset, length)]
+
+    # ------------------------------------------------------------------ writing
+
+    def append(self, records: List[Tuple[str, object]], fsync: str = "none"):
+        """
+        Append a group of (image, result) records to this writer's current segment.
+
+        :param fsync: 'none', 'commit' (one fsync per group) or 'always' (one fsync per record)
+        """
+        if not records:
+            return
+        os.makedirs(self.root, exist_ok=True)
+        segment = self._current_segment()
+        segment_path = os.path.join(self.root, segment)
+        lines = [(image, (json.dumps({"image": image, "result": result}) + "\n").encode("utf-8")) for image, result in records]
+
+        index_lines = []
+        with open(segment_path, "ab") as f:
+            offset = f.tell()
+            if self.compress:
+                frame = _zstd().ZstdCompressor().compress(b"".join(line for _, line in lines))
+                f.write(frame)
+                index_lines = [f"{offset}\t{len(frame)}\t{image}\n" for image, _ in lines]
+            else:
+                for image, line in lines:
+                    f.write(line)
+                    index_lines.append(f"{offset}\t{len(line)}\t{image}\n")
+                    offset += len(line)
+                    if fsync == "always":
+                        f.flush()
+                        os.fsync(f.fileno())
+            if fsync != "none":
+                f.flush()
+                os.fsync(f.fileno())
+
+        # The index is written after the data, so a crash can only leave records missing from
+        # the index (compact() rebuilds it from the segments), never index entries without data
+        with open(segment_path[:-len(self._suffix(segment))] + INDEX_SUFFIX, "a") as f:
+            f.write("".join(index_lines))
+            if fsync != "none":
+                f.flush()
+                os.fsync(f.fileno())
+
+        if self._index is not None:
+            for image, (offset, length) in zip((image for image, _ in records), self._offsets(index_lines)):
+                self._index.setdefault(image, []).append((segment, offset, length))
+
+    def reserve(self, images: List[str]):
+        """Record images as reserved by this writer."""
+        if not images:
+            return
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, self.writer_id + RESERVED_SUFFIX), "a") as f:
+            f.write("".join(image + "\n" for image in images))
+
+    # ------------------------------------------------------------------ reading
+
+    def segments(self) -> List[str]:
+        """All segment file names of the run, in a stable order."""
+        if not os.path.isdir(self.root):
+            return []
+        # Leftover .tmp segments of an interrupted compaction are ignored
+        return sorted(f for f in os.listdir(self.root)
+                      if (f.endswith(SEGMENT_SUFFIX) or f.endswith(COMPRESSED_SUFFIX)) and ".tmp" not in f)
+
+    def index(self, reload: bool = False) -> Dict[str, List[Tuple[str, int, int]]]:
+        """Map each image to the (segment, offset, length) locations of its records."""
+        if self._index is not None and not reload:
+            return self._index
+        index = {}
+        for segment in self.segments():
+            index_path = os.path.join(self.root, segment[:-len(self._suffix(segment))] + INDEX_SUFFIX)
+            if not os.path.exists(index_path):
+                continue
+            with open(index_path, "r") as f:
+                for line in f:
+                    parts = line.rstrip("\n").split("\t", 2)
+                    if len(parts) == 3:
+                        index.setdefault(parts[2], []).append((segment, int(parts[0]), int(parts[1])))
+        self._index = index
+        return index
+
+    def images(self) -> Set[str]:
+        """Images with at least one stored result."""
+        return set(self.index())
+
+    def reserved(self) -> Set[str]:
+        """Images reserved by any writer of the run."""
+        reserved = set()
+        if not os.path.isdir(self.root):
+            return reserved
+        for file in os.listdir(self.root):
+            if file.endswith(RESERVED_SUFFIX):
+                with open(os.path.join(self.root, file), "r") as f:
+                    reserved.update(line.rstrip("\n") for line in f if line.strip())
+        return reserved
+
+    def count(self) -> int:
+        """Number of images with results, from the index only."""
+        return len(self.index(reload=True))
+
+    def read(self, image: str) -> List[object]:
+        """Random access to the results of one image through the index."""
+        results = []
+        # Records of a compressed group share one frame, so read each location once
+        for segment, offset, length in dict.fromkeys(self.index().get(image, [])):
+            with open(os.path.join(self.root, segment), "rb") as f:
+                f.seek(offset)
+                data = f.read(length)
+            if segment.endswith(COMPRESSED_SUFFIX):
+                data = _zstd().ZstdDecompressor().decompress(data)
+            for line in data.splitlines():
+                record = json.loads(line)
+                if record["image"] == image:
+                    results.append(record["result"])
+        return results
+
+    def iter_records(self, segments: Optional[List[str]] = None) -> Iterator[Tuple[str, object]]:
+        """Read (image, result) records sequentially, segment by segment."""
+        for segment in segments if segments is not None else self.segments():
+            for record in self._iter_segment(segment):
+                yield record["image"], record["result"]
+
+    def _iter_segment(self, segment: str) -> Iterator[dict]:
+        path = os.path.join(self.root, segment)
+        if segment.endswith(COMPRESSED_SUFFIX):
+            with open(path, "rb") as raw:
+                reader = _zstd().ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+                lines = io.TextIOWrapper(reader, encoding="utf-8")
+                yield from self._parse_lines(lines)
+        else:
+            with open(path, "r", encoding="utf-8") as lines:
+                yield from self._parse_lines(lines)
+
+    @staticmethod
+    def _parse_lines(lines) -> Iterator[dict]:
+        for line in lines:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # A torn final line from an interrupted write, the index never points at it
+                continue
+
+    # ------------------------------------------------------------------ maintenance
+
+    def compact(self, compress: Optional[bool] = None) -> int:
+        """
+        Rewrite all segments of the run into one segment with a fresh index.
+
+        Reservations without a result are dropped. Only run this while no writer is active.
+
+        :param compress: Compress the compacted segment, defaults to the store's setting
+        :return: Number of records in the compacted segment
+        """
+        old_segments = self.segments()
+        if not old_segments:
+            self.clear_reservations()
+            return 0
+        compacted = SegmentStore(os.path.dirname(os.path.dirname(self.root)), self.run_id,
+                                 writer_id=f"compacted-{self.writer_id}",
+                                 compress=self.compress if compress is None else compress,
+                                 max_segment_bytes=float("inf"))
+        compacted._segment = f"{compacted.writer_id}-{0:05d}.tmp{compacted._suffix_for_new()}"
+        count = 0
+        batch = []
+        for image, result in self.iter_records(old_segments):
+            batch.append((image, result))
+            count += 1
+            if len(batch) >= 1024:
+                compacted.append(batch)
+                batch = []
+        compacted.append(batch)
+
+        if count == 0:
+            # Nothing to swap in (append() never created the .tmp segment), e.g. the segments of a
+            # crashed run that only hold reservations
+            self._remove_segments(old_segments)
+            return 0
+
+        # Swap in the compacted segment, then remove the old segments, indexes and reservations
+        tmp_segment = compacted._segment
+        final_segment = tmp_segment.replace(".tmp", "")
+        tmp_index = tmp_segment[:-len(self._suffix(tmp_segment))] + INDEX_SUFFIX
+        os.replace(os.path.join(self.root, tmp_segment), os.path.join(self.root, final_segment))
+        os.replace(os.path.join(self.root, tmp_index), os.path.join(self.root, tmp_index.replace(".tmp", "")))
+        self._remove_segments([segment for segment in old_segments if segment != final_segment])
+        return count
+
+    def _remove_segments(self, segments: List[str]):
+        """Remove segments with their indexes, and all reservations."""
+        for segment in segments:
+            os.remove(os.path.join(self.root, segment))
+            index_path = os.path.join(self.root, segment[:-len(self._suffix(segment))] + INDEX_SUFFIX)
+            if os.path.exists(index_path):
+                os.remove(index_path)
+        self.clear_reservations()
+        _fsync_dir(self.root)
+        self._index = None
+
+    def clear_reservations(self):
+        """Drop all reservation logs, images with results stay excluded through the index."""
+        if not os.path.isdir(self.root):
+            return
+        for file in os.listdir(self.root):
+            if file.endswith(RESERVED_SUFFIX):
+                os.remove(os.path.join(self.root, file))
+
+    def remove(self):
+        """Remove every segment, index and reservation of the run."""
+        if os.path.isdir(self.root):
+            shutil.rmtree(self.root)
+        self._index = None
+        self._segment = None
+
+    # ------------------------------------------------------------------ helpers
+
+    def _current_segment(self) -> str:
+        if self._segment is not None:
+            path = os.path.join(self.root, self._segment)
+            if not os.path.exists(path) or os.path.getsize(path) < self.max_segment_bytes:
+                return self._segment
+        # Start a new segment after the last one of this writer
+        own = [s for s in self.segments() if s.startswith(self.writer_id + "-")]
+        seq = 0
+        if own:
+            seq = max(int(s[len(self.writer_id) + 1:].split(".")[0]) for s in own) + 1
+        self._segment = f"{self.writer_id}-{seq:05d}{self._suffix_for_new()}"
+        return self._segment
+
+    def _suffix_for_new(self) -> str:
+        return COMPRESSED_SUFFIX if self.compress else SEGMENT_SUFFIX
+
+    @staticmethod
+    def _suffix(segment: str) -> str:
+        return COMPRESSED_SUFFIX if segment.endswith(COMPRESSED_SUFFIX) else SEGMENT_SUFFIX
+
+    @staticmethod
+    def _offsets(index_lines: List[str]) -> Iterator[Tuple[int, int]]:
+        for line in index_lines:
+            offset, length, _ = line.split("\t", 2)
+            yield int(offset), int(length)
+
+    @staticmethod
+    def run_ids(save_dir: str) -> List[str]:
+        """All run_ids with a segment store under save_dir."""
+        segments_dir = os.path.join(save_dir, "segments")
+        if not os.path.isdir(segments_dir):
+            return []
+        return sorted(d for d in os.listdir(segments_dir) if os.path.isdir(os.path.join(segments_dir, d)))
@@ -0,0 +1,328 @@
+import os
+import json
+import marshal
+import shutil
+import mmap
+import bisect
+import threading
+from array import array
+from collections import OrderedDict
+from collections.abc import Mapping, MutableMapping
+from typing import Dict, Iterable, Iterator, Tuple
+
+SHARD_PREFIX = "shard-"
+SHARD_SUFFIX = ".jsonl"
+INDEX_FILE = "index.marshal"
+KEYS_FILE = "keys.bin"
+KEY_OFFSETS_FILE = "keys.offsets"
+LOCATIONS_FILE = "locations.bin"
+MANIFEST_FILE = "manifest.json"
+FORMAT_VERSION = 2
+SUPPORTED_VERSIONS = (1, 2)
+
+def is_sharded_cache(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, MANIFEST_FILE))
+
+def write_sharded_cache(path: str, data: Mapping, shard_bytes: int = 256 * 1024**2) -> int:
+    """
+    Write a LOADED_DATA style mapping as JSONL shards plus an offset index (see write_sharded_records).
+
+    :return: Number of images written
+    """
+    return write_sharded_records(path, ((image, data[image]) for image in data), shard_bytes=shard_bytes)
+
+def write_sharded_records(path: str, records: Iterable[Tuple[str, Mapping]], shard_bytes: int = 256 * 1024**2) -> int:
+    """
+    Write (image, image_data) records as JSONL shards plus an offset index, one record at a
+    time, so a streaming loader can be written without building the whole mapping first.
+
+    Layout (under path/):
+        shard-<n>.jsonl   one JSON [image, image_data] record per line
+        index.marshal     images list plus parallel shard number/offset/length arrays (as bytes)
+        keys.bin          utf-8 image names sorted bytewise and concatenated  \
+        keys.offsets      uint64 start of each name in keys.bin, plus the end   | the same index, memory-mappable
+        locations.bin     int64 (shard, offset, length) per sorted name        /  (see SharedShardedDataset)
+        manifest.json     format version, number of images and shards, written last
+
+    The cache is written next to its final location and swapped in, so readers never see a half-written cache.
+
+    :param shard_bytes: Start a new shard once the current one reaches this size
+    :return: Number of images written
+    """
+    tmp_path = path.rstrip(os.sep) + ".tmp"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    images, shards, offsets, lengths = [], array('i'), array('q'), array('q')
+    shard, f, offset = -1, None, shard_bytes
+    try:
+        for image, image_data in records:
+            if offset >= shard_bytes:
+                if f is not None:
+                    f.close()
+                shard += 1
+                f = open(os.path.join(tmp_path, f"{SHARD_PREFIX}{shard:05d}{SHARD_SUFFIX}"), "wb")
+                offset = 0
+            line = (json.dumps([image, dict(image_data)]) + "\n").encode("utf-8")
+            f.write(line)
+            images.append(image)
+            shards.append(shard)
+            offsets.append(offset)
+            lengths.append(len(line))
+            offset += len(line)
+    finally:
+        if f is not None:
+            f.close()
+
+    with open(os.path.join(tmp_path, INDEX_FILE), "wb") as f:
+        marshal.dump((images, shards.tobytes(), offsets.tobytes(), lengths.tobytes()), f)
+    _write_sorted_index(tmp_path, images, shards, offsets, lengths)
+    with open(os.path.join(tmp_path, MANIFEST_FILE), "w") as f:
+        json.dump({"version": FORMAT_VERSION, "images": len(images), "shards": shard + 1}, f)
+
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)  # A JSON cache of the same name
+    os.replace(tmp_path, path)
+    return len(images)
+
+def _write_sorted_index(path: str, images, shards, offsets, lengths):
+    encoded = [image.encode("utf-8") for image in images]
+    order = sorted(range(len(encoded)), key=encoded.__getitem__)
+    key_offsets, locations = array('Q', [0]), array('q')
+    with open(os.path.join(path, KEYS_FILE), "wb") as f:
+        for i in order:
+            f.write(encoded[i])
+            key_offsets.append(key_offsets[-1] + len(encoded[i]))
+            locations.extend((shards[i], offsets[i], lengths[i]))
+    with open(os.path.join(path, KEY_OFFSETS_FILE), "wb") as f:
+        key_offsets.tofile(f)
+    with open(os.path.join(path, LOCATIONS_FILE), "wb") as f:
+        locations.tofile(f)
+
+def _read_manifest(path: str) -> dict:
+    with open(os.path.join(path, MANIFEST_FILE), "r") as f:
+        manifest = json.load(f)
+    if manifest.get("version") not in SUPPORTED_VERSIONS:
+        raise ValueError(f"Unsupported sharded cache version {manifest.get('version')} in {path}")
+    return manifest
+
+class ShardedDataset(MutableMapping):
+    """
+    Lazy image -> {dataset_name: {...}} mapping over a cache written by write_sharded_cache.
+
+    Opening it only reads the offset index; each record is read with one pread and decoded
+    when accessed. Recently decoded records are kept in a small LRU, so memory is proportional
+    to the images in flight rather than to the dataset. Assigned images go to an in-memory
+    overlay and are never written back; changes made inside a returned record (e.g. the
+    result_<run_id> entries added by cache_image_result) last while it stays in the LRU.
+
+    E.g.
+        data = ShardedDataset(os.path.join(cache_dir, "llava"))
+        data["coco/train2017/1.jpg"]["coco_captions"]["captions"]
+    """
+    def __init__(self, path: str, max_cached: int = 1024):
+        self.path = path
+        self.manifest = _read_manifest(path)
+        self._open_index()
+        self._fds: Dict[int, int] = {}
+        self._overlay: Dict[str, dict] = {}
+        self._deleted = set()
+        self._cache = OrderedDict()
+        self._max_cached = max_cached
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------------ index
+
+    def _open_index(self):
+        with open(os.path.join(self.path, INDEX_FILE), "rb") as f:
+            images, shards, offsets, lengths = marshal.load(f)
+        self._index: Dict[str, int] = {image: i for i, image in enumerate(images)}
+        self._shards, self._offsets, self._lengths = array('i'), array('q'), array('q')
+        self._shards.frombytes(shards)
+        self._offsets.frombytes(offsets)
+        self._lengths.frombytes(lengths)
+
+    def _locate(self, image: str):
+        """(shard, offset, length) of an image's record, or None."""
+        i = self._index.get(image)
+        if i is None:
+            return None
+        return self._shards[i], self._offsets[i], self._lengths[i]
+
+    def _iter_index(self) -> Iterator[str]:
+        return iter(self._index)
+
+    def _index_len(self) -> int:
+        return len(self._index)
+
+    def _read_record(self, shard: int, offset: int, length: int) -> bytes:
+        return os.pread(self._fd(shard), length, offset)
+
+    # ------------------------------------------------------------------ mapping
+
+    def _fd(self, shard: int) -> int:
+        fd = self._fds.get(shard)
+        if fd is None:
+            with self._lock:
+                fd = self._fds.get(shard)
+                if fd is None:
+                    fd = os.open(os.path.join(self.path, f"{SHARD_PREFIX}{shard:05d}{SHARD_SUFFIX}"), os.O_RDONLY)
+                    self._fds[shard] = fd
+        return fd
+
+    def _read(self, image: str) -> dict:
+        stored_image, image_data = json.loads(self._read_record(*self._locate(image)))
+        if stored_image != image:
+            raise ValueError(f"Sharded cache index of {self.path} is inconsistent at {image}")
+        return image_data
+
+    def __getitem__(self, image: str) -> dict:
+        if image in self._overlay:
+            return self._overlay[image]
+        if image in self._deleted or self._locate(image) is None:
+            raise KeyError(image)
+        with self._lock:
+            if image in self._cache:
+                self._cache.move_to_end(image)
+                return self._cache[image]
+        image_data = self._read(image)
+        with self._lock:
+            image_data = self._cache.setdefault(image, image_data)
+            while len(self._cache) > self._max_cached:
+                self._cache.popitem(last=False)
+        return image_data
+
+    def __setitem__(self, image: str, image_data: dict):
+        self._overlay[image] = image_data
+        self._deleted.discard(image)
+
+    def __delitem__(self, image: str):
+        if image not in self:
+            raise KeyError(image)
+        self._overlay.pop(image, None)
+        with self._lock:
+            self._cache.pop(image, None)
+        if self._locate(image) is not None:
+            self._deleted.add(image)
+
+    def __contains__(self, image) -> bool:
+        return image in self._overlay or (image not in self._deleted and self._locate(image) is not None)
+
+    def __iter__(self) -> Iterator[str]:
+        for image in self._iter_index():
+            if image not in self._deleted and image not in self._overlay:
+                yield image
+        yield from self._overlay
+
+    def __len__(self) -> int:
+        return self._index_len() - len(self._deleted) + sum(1 for image in self._overlay if self._locate(image) is None)
+
+    def close(self):
+        with self._lock:
+            for fd in self._fds.values():
+                os.close(fd)
+            self._fds = {}
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+class SharedShardedDataset(ShardedDataset):
+    """
+    ShardedDataset whose index and shards are memory-mapped read-only instead of loaded.
+
+    Lookups binary-search the sorted names in keys.bin, so no per-image Python objects are
+    created until a record is decoded. Every process that opens the same cache (one per GPU,
+    or forked workers) shares the mapped pages through the page cache, and since nothing
+    refcounted backs the index, forking does not trigger copy-on-write of the dataset either.
+    Call gc.freeze() before forking to keep the remaining objects' pages shared as well.
+
+    E.g.
+        data = SharedShardedDataset(os.path.join(cache_dir, "llava"))
+        data.key_at(0), data.position("coco/train2017/1.jpg")
+    """
+    def _open_index(self):
+        if self.manifest.get("version", 1) < 2:
+            raise ValueError(f"Sharded cache {self.path} has no memory-mappable index, write it again with DatasetManager.cache")
+        self._maps = []
+        self._keys = self._map(KEYS_FILE)
+        self._key_offsets = memoryview(self._map(KEY_OFFSETS_FILE)).cast('Q')
+        self._locations = memoryview(self._map(LOCATIONS_FILE)).cast('q')
+        self._shard_maps: Dict[int, mmap.mmap] = {}
+        self._sorted = _SortedKeys(self)
+
+    def _map(self, name: str):
+        with open(os.path.join(self.path, name), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mapped)
+        return mapped
+
+    def key_at(self, position: int) -> str:
+        """Image name at a position of the sorted index."""
+        return bytes(self._keys[self._key_offsets[position]:self._key_offsets[position + 1]]).decode("utf-8")
+
+    def position(self, image: str) -> int:
+        """Position of an image in the sorted index, or -1."""
+        key = image.encode("utf-8")
+        i = bisect.bisect_left(self._sorted, key)
+        return i if i < len(self._sorted) and self._sorted[i] == key else -1
+
+    def _locate(self, image: str):
+        i = self.position(image)
+        if i < 0:
+            return None
+        return self._locations[3 * i], self._locations[3 * i + 1], self._locations[3 * i + 2]
+
+    def _iter_index(self) -> Iterator[str]:
+        keys, offsets = self._keys, self._key_offsets
+        for i in range(self._index_len()):
+            yield keys[offsets[i]:offsets[i + 1]].decode("utf-8")
+
+    def _index_len(self) -> int:
+        return len(self._key_offsets) - 1
+
+    def _read_record(self, shard: int, offset: int, length: int) -> bytes:
+        mapped = self._shard_maps.get(shard)
+        if mapped is None:
+            with self._lock:
+                mapped = self._shard_maps.get(shard)
+                if mapped is None:
+                    with open(os.path.join(self.path, f"{SHARD_PREFIX}{shard:05d}{SHARD_SUFFIX}"), "rb") as f:
+                        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    self._shard_maps[shard] = mapped
+        return mapped[offset:offset + length]
+
+    def close(self):
+        super().close()
+        with self._lock:
+            for mapped in list(self._shard_maps.values()):
+                mapped.close()
+            self._shard_maps = {}
+            if self._maps:
+                # The index views have to be released before their maps can be closed
+                self._key_offsets.release()
+                self._locations.release()
+                for mapped in self._maps:
+                    mapped.close()
+                self._maps = []
+
+class _SortedKeys:
+    """Sequence view of the encoded names in keys.bin, for bisect."""
+    __slots__ = ("dataset", )
+
+    def __init__(self, dataset: SharedShardedDataset):
+        self.dataset = dataset
+
+    def __getitem__(self, position: int) -> bytes:
+        offsets = self.dataset._key_offsets
+        return self.dataset._keys[offsets[position]:offsets[position + 1]]
+
+    def __len__(self) -> int:
+        return len(self.dataset._key_offsets) - 1
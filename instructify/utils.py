@@ -1,8 +1,7 @@
 import os
 import re
 import json
-import requests
-from zipfile import ZipFile
+from zip_stream import extract_zip
 from nltk.stem import WordNetLemmatizer
 from difflib import SequenceMatcher
 
@@ -182,7 +181,6 @@ def download_coco_train2017_images(cache):
     
     # URL for the COCO train 2017 images
     url = "http://images.cocodataset.org/zips/train2017.zip"
-    zip_path = os.path.join(images_path, "train2017.zip")
 
     # Check if the images are already downloaded
     downloaded_flag = os.path.join(images_path, "downloaded")
@@ -190,21 +188,9 @@ def download_coco_train2017_images(cache):
         print("COCO train2017 images already downloaded.")
         return
 
-    # Download the images
-    print("Downloading COCO train2017 images...")
-    response = requests.get(url, stream=True)
-    total_size = int(response.headers.get('content-length', 0))
-    with open(zip_path, 'wb') as f:
-        for data in response.iter_content(1024):
-            f.write(data)
-
-    # Unzip the downloaded file
-    print("Extracting COCO train2017 images...")
-    with ZipFile(zip_path, 'r') as zip_ref:
-        zip_ref.extractall(images_path)
-
-    # Remove the zip file
-    os.remove(zip_path)
+    # Download the images, extracting them while the archive streams in
+    print("Downloading and extracting COCO train2017 images...")
+    extract_zip(url, images_path)
 
     # Create a flag to indicate successful download
     with open(downloaded_flag, 'w') as f:
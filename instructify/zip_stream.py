@@ -0,0 +1,359 @@
+import os
+import bz2
+import json
+import zlib
+import struct
+import fnmatch
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Union
+
+import requests
+from tqdm import tqdm
+
+from download import DownloadError, download_file, get_session, _probe, _retrying
+
+CHUNK_SIZE = 1024 * 1024
+RUN_BYTES = 64 * 1024**2
+MANIFEST_SUFFIX = ".extracted"
+
+_EOCD = struct.Struct("<4s4H2LH")
+_EOCD64_LOCATOR = struct.Struct("<4sLQL")
+_EOCD64 = struct.Struct("<4sQ2H2L4Q")
+_CENTRAL = struct.Struct("<4s4B4HL2L5H2L")
+_LOCAL = struct.Struct("<4s2B4HL2L2H")
+# End of central directory record with the longest comment, plus the zip64 locator before it
+_TAIL_BYTES = _EOCD.size + 0xFFFF + _EOCD64_LOCATOR.size + _EOCD64.size
+
+# A member of the archive, spanning the bytes [offset, end) up to the next member (or the central directory)
+ZipMember = namedtuple("ZipMember", ["name", "offset", "end", "compressed_size", "size", "crc", "method", "flags"])
+
+class ExtractError(Exception):
+    """Raised when an archive can't be read or a member does not verify."""
+    pass
+
+# ------------------------------------------------------------------ archives
+
+class _HttpArchive:
+    """Byte ranges of a remote archive, fetched with Range requests."""
+    def __init__(self, url: str, headers: Dict[str, str], size: int, validator: Optional[str], timeout: float, retries: int):
+        self.name = url
+        self.headers = headers
+        self.size = size
+        self.identity = {"source": url, "size": size, "validator": validator}
+        self.timeout = timeout
+        self.retries = retries
+
+    def stream(self, start: int, end: int) -> Iterator[bytes]:
+        headers = {**self.headers, "Range": f"bytes={start}-{end - 1}"}
+        with get_session().get(self.name, headers=headers, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise DownloadError(f"Server ignored the byte range of {self.name}")
+            yield from response.iter_content(CHUNK_SIZE)
+
+    def read(self, start: int, end: int) -> bytes:
+        return _retrying(lambda: b"".join(self.stream(start, end)), self.retries, f"Reading {start}-{end} of {self.name}")
+
+class _FileArchive:
+    """Byte ranges of a local archive."""
+    def __init__(self, path: str):
+        self.name = path
+        stat = os.stat(path)
+        self.size = stat.st_size
+        self.identity = {"source": os.path.basename(path), "size": stat.st_size, "validator": stat.st_mtime_ns}
+
+    def stream(self, start: int, end: int) -> Iterator[bytes]:
+        with open(self.name, "rb") as f:
+            f.seek(start)
+            while start < end:
+                chunk = f.read(min(CHUNK_SIZE, end - start))
+                if not chunk:
+                    return
+                start += len(chunk)
+                yield chunk
+
+    def read(self, start: int, end: int) -> bytes:
+        with open(self.name, "rb") as f:
+            f.seek(start)
+            return f.read(end - start)
+
+# ------------------------------------------------------------------ central directory
+
+def _zip64_extra(extra: bytes, size: int, compressed_size: int, offset: int):
+    i = 0
+    while i + 4 <= len(extra):
+        tag, length = struct.unpack_from("<2H", extra, i)
+        if tag == 1:
+            values = list(struct.unpack_from(f"<{length // 8}Q", extra, i + 4))
+            if size == 0xFFFFFFFF:
+                size = values.pop(0)
+            if compressed_size == 0xFFFFFFFF:
+                compressed_size = values.pop(0)
+            if offset == 0xFFFFFFFF:
+                offset = values.pop(0)
+            break
+        i += 4 + length
+    return size, compressed_size, offset
+
+def read_directory(archive) -> List[ZipMember]:
+    """Members of an archive in offset order, from its central directory (2-3 reads at the end of the file)."""
+    tail_start = max(0, archive.size - _TAIL_BYTES)
+    tail = archive.read(tail_start, archive.size)
+    position = tail.rfind(b"PK\x05\x06")
+    if position < 0:
+        raise ExtractError(f"{archive.name} is not a zip file")
+    _, _, _, _, _, directory_size, directory_offset, _ = _EOCD.unpack_from(tail, position)
+
+    locator = position - _EOCD64_LOCATOR.size
+    if locator >= 0 and tail[locator:locator + 4] == b"PK\x06\x07":
+        _, _, record_offset, _ = _EOCD64_LOCATOR.unpack_from(tail, locator)
+        if record_offset >= tail_start:
+            record = tail[record_offset - tail_start:record_offset - tail_start + _EOCD64.size]
+        else:
+            record = archive.read(record_offset, record_offset + _EOCD64.size)
+        fields = _EOCD64.unpack(record)
+        directory_size, directory_offset = fields[8], fields[9]
+
+    if directory_offset >= tail_start:
+        directory = tail[directory_offset - tail_start:directory_offset - tail_start + directory_size]
+    else:
+        directory = archive.read(directory_offset, directory_offset + directory_size)
+
+    entries, i = [], 0
+    while i + _CENTRAL.size <= len(directory):
+        (signature, _, _, _, _, flags, method, _, _, crc, compressed_size, size,
+         name_length, extra_length, comment_length, _, _, _, offset) = _CENTRAL.unpack_from(directory, i)
+        if signature != b"PK\x01\x02":
+            raise ExtractError(f"Corrupt central directory in {archive.name}")
+        name_start = i + _CENTRAL.size
+        name = directory[name_start:name_start + name_length].decode("utf-8" if flags & 0x800 else "cp437")
+        if 0xFFFFFFFF in (size, compressed_size, offset):
+            extra = directory[name_start + name_length:name_start + name_length + extra_length]
+            size, compressed_size, offset = _zip64_extra(extra, size, compressed_size, offset)
+        entries.append((offset, name, compressed_size, size, crc, method, flags))
+        i = name_start + name_length + extra_length + comment_length
+
+    entries.sort()
+    ends = [entry[0] for entry in entries[1:]] + [directory_offset]
+    return [ZipMember(name, offset, end, compressed_size, size, crc, method, flags)
+            for (offset, name, compressed_size, size, crc, method, flags), end in zip(entries, ends)]
+
+# ------------------------------------------------------------------ extraction
+
+class _Reader:
+    """Sequential reads over a stream of chunks that starts at a known archive offset."""
+    def __init__(self, chunks: Iterable[bytes], position: int):
+        self.chunks = iter(chunks)
+        self.buffer = bytearray()
+        self.position = position
+
+    def read(self, n: int) -> bytes:
+        """Up to n bytes (at least one)."""
+        if not self.buffer:
+            chunk = next(self.chunks, b"")
+            if not chunk:
+                raise requests.ConnectionError(f"Archive stream ended at byte {self.position}")
+            self.buffer += chunk
+        data = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        self.position += len(data)
+        return data
+
+    def read_exact(self, n: int) -> bytes:
+        data = b""
+        while len(data) < n:
+            data += self.read(n - len(data))
+        return data
+
+    def skip_to(self, position: int):
+        while self.position < position:
+            self.read(min(CHUNK_SIZE, position - self.position))
+
+def _decompressor(member: ZipMember):
+    if member.method == 0:
+        return None
+    if member.method == 8:
+        return zlib.decompressobj(-15)
+    if member.method == 12:
+        return bz2.BZ2Decompressor()
+    raise ExtractError(f"Unsupported compression method {member.method} of {member.name}")
+
+def _target_path(dest_dir: str, name: str) -> str:
+    # Like ZipFile.extract, never write outside dest_dir
+    parts = [part for part in name.replace("\\", "/").split("/") if part not in ("", ".", "..")]
+    return os.path.join(dest_dir, *parts)
+
+def _extract_member(reader: _Reader, member: ZipMember, dest_dir: str):
+    header = reader.read_exact(_LOCAL.size)
+    signature, _, _, _, _, _, _, _, _, _, name_length, extra_length = _LOCAL.unpack(header)
+    if signature != b"PK\x03\x04":
+        raise ExtractError(f"Bad local header of {member.name} at byte {member.offset}")
+    reader.read_exact(name_length + extra_length)
+
+    path = _target_path(dest_dir, member.name)
+    if member.name.endswith("/"):
+        os.makedirs(path, exist_ok=True)
+        return
+    if member.flags & 0x1:
+        raise ExtractError(f"{member.name} is encrypted")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    decompressor = _decompressor(member)
+    crc, remaining = 0, member.compressed_size
+    tmp_path = path + ".part"
+    with open(tmp_path, "wb") as f:
+        while remaining:
+            data = reader.read(min(CHUNK_SIZE, remaining))
+            remaining -= len(data)
+            if decompressor is not None:
+                data = decompressor.decompress(data)
+            crc = zlib.crc32(data, crc)
+            f.write(data)
+        if hasattr(decompressor, "flush"):
+            data = decompressor.flush()
+            crc = zlib.crc32(data, crc)
+            f.write(data)
+    if crc != member.crc:
+        os.remove(tmp_path)
+        raise ExtractError(f"CRC mismatch for {member.name}")
+    os.replace(tmp_path, path)
+
+class _Manifest:
+    """Append-only list of the members already extracted, headed by the identity of the archive."""
+    def __init__(self, path: str, identity: dict):
+        self.path = path
+        self.done = set()
+        header = json.dumps(identity, sort_keys=True)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                lines = f.read().split("\n")
+            if lines[0] == header:
+                # A line without its newline was cut off mid-write
+                self.done.update(line for line in lines[1:-1])
+        self._file = open(path, "a" if self.done else "w", encoding="utf-8")
+        if not self.done:
+            self._file.write(header + "\n")
+            self._file.flush()
+        self._lock = threading.Lock()
+
+    def add(self, name: str):
+        with self._lock:
+            self.done.add(name)
+            self._file.write(name + "\n")
+            self._file.flush()
+
+    def close(self, remove: bool = False):
+        self._file.close()
+        if remove:
+            os.remove(self.path)
+
+def _runs(members: List[ZipMember], run_bytes: int) -> List[List[ZipMember]]:
+    """Group members that are adjacent in the archive into runs of about run_bytes, one range request each."""
+    runs = []
+    for member in members:
+        if runs and runs[-1][-1].end == member.offset and member.end - runs[-1][0].offset <= run_bytes:
+            runs[-1].append(member)
+        else:
+            runs.append([member])
+    return runs
+
+def _selector(members) -> Callable[[str], bool]:
+    if members is None:
+        return lambda name: True
+    if callable(members):
+        return members
+    patterns = [members] if isinstance(members, str) else list(members)
+    return lambda name: any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)
+
+def extract_zip(source: str, dest_dir: str, members: Union[None, str, Iterable[str], Callable[[str], bool]] = None,
+                headers: Dict[str, str] = None, workers: int = 8, run_bytes: int = RUN_BYTES,
+                timeout: float = 60, retries: int = 5, progress: bool = True) -> List[str]:
+    """
+    Extract a zip archive, given as a URL or a local path, into dest_dir.
+
+    For a URL whose server supports byte ranges, the central directory is read from the end of
+    the file first, and the members are then streamed straight from the server into parallel
+    extractor threads, so extraction overlaps the download and the archive itself never lands
+    on disk (peak disk use is the extracted data). Only the byte ranges of the selected members
+    are fetched. Adjacent members are fetched together in runs of about run_bytes. Servers
+    without range support fall back to download_file and a local extraction.
+
+    Finished members are appended to dest_dir/.<archive>.extracted, so an interrupted
+    extraction resumes with the members that were not done. Each member is written to
+    <path>.part, CRC checked and renamed.
+
+    :param members: Members to extract: a glob pattern, a list of names/patterns or a predicate on the name, default all
+    :param headers: Extra request headers, e.g. authorization
+    :param workers: Runs extracted in parallel
+    :param run_bytes: Archive bytes per range request
+    :param retries: Retries per run, resuming after its last finished member
+    :return: Names of the extracted members
+
+    E.g. extract_zip("http://images.cocodataset.org/annotations/annotations_trainval2017.zip", dataset_path,
+                     members=["annotations/captions_train2017.json", "annotations/instances_train2017.json"])
+    """
+    headers = dict(headers or {})
+    os.makedirs(dest_dir, exist_ok=True)
+    archive_name = os.path.basename(source.split("?", 1)[0]) or "archive.zip"
+    if source.startswith(("http://", "https://")):
+        size, accepts_ranges, validator = _probe(source, headers, timeout)
+        if size is None or not accepts_ranges:
+            zip_path = download_file(source, os.path.join(dest_dir, archive_name), headers=headers,
+                                     timeout=timeout, retries=retries, progress=progress)
+            extracted = extract_zip(zip_path, dest_dir, members, workers=workers, run_bytes=run_bytes, progress=progress)
+            os.remove(zip_path)
+            return extracted
+        archive = _HttpArchive(source, headers, size, validator, timeout, retries)
+    else:
+        archive = _FileArchive(source)
+
+    selected = _selector(members)
+    wanted = [member for member in read_directory(archive) if selected(member.name)]
+    manifest = _Manifest(os.path.join(dest_dir, f".{archive_name}{MANIFEST_SUFFIX}"), archive.identity)
+    todo = [member for member in wanted if member.name not in manifest.done]
+    if len(todo) < len(wanted):
+        print(f"Resuming extraction of {archive_name}, {len(wanted) - len(todo)} of {len(wanted)} members already extracted")
+
+    bar = None
+    if progress:
+        total = sum(member.end - member.offset for member in wanted)
+        remaining = sum(member.end - member.offset for member in todo)
+        bar = tqdm(total=total, initial=total - remaining, unit="B", unit_scale=True, desc=f"Extracting {archive_name}")
+    bar_lock = threading.Lock()
+
+    def extract_run(run: List[ZipMember]):
+        def attempt():
+            remaining = [member for member in run if member.name not in manifest.done]
+            if not remaining:
+                return
+            reader = _Reader(archive.stream(remaining[0].offset, run[-1].end), remaining[0].offset)
+            for member in remaining:
+                reader.skip_to(member.offset)
+                _extract_member(reader, member, dest_dir)
+                manifest.add(member.name)
+                if bar is not None:
+                    with bar_lock:
+                        bar.update(member.end - member.offset)
+        _retrying(attempt, retries, f"Extracting {run[0].name}..{run[-1].name} of {archive_name}")
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(extract_run, run) for run in _runs(todo, run_bytes)]
+            try:
+                for future in futures:
+                    future.result()
+            except BaseException:
+                # Stop at the first failure, the manifest keeps what was done
+                for future in futures:
+                    future.cancel()
+                raise
+    except BaseException:
+        manifest.close()
+        raise
+    finally:
+        if bar is not None:
+            bar.close()
+    manifest.close(remove=True)
+    return [member.name for member in wanted]
@@ -0,0 +1,82 @@
+import os
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("aiohttp")
+from async_fetch import fetch_all
+
+@pytest.fixture
+def server():
+    """Local HTTP stand-in: /ok/<name> answers 200, /flaky/<name> 503 once then 200, anything else 404."""
+    requests = Counter()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests[self.path] += 1
+            if self.path.startswith("/ok/") or (self.path.startswith("/flaky/") and requests[self.path] > 1):
+                body = f"image {self.path}".encode()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            self.send_response(503 if self.path.startswith("/flaky/") else 404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}", requests
+    httpd.shutdown()
+    httpd.server_close()
+
+def run(jobs, ledger_path, **kwargs):
+    # In a thread, so a fetch that never returns fails the test instead of hanging it
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(ledger=fetch_all(
+        jobs, ledger_path, backoff=0.01, progress=False, **kwargs)), daemon=True)
+    thread.start()
+    thread.join(timeout=30)
+    assert not thread.is_alive(), "fetch_all did not return"
+    return result["ledger"]
+
+def test_fetch_and_restart(server, tmp_path):
+    url, requests = server
+    jobs = [("ok", f"{url}/ok/1", str(tmp_path / "1")),
+            ("missing", f"{url}/missing/2", str(tmp_path / "2")),
+            ("flaky", f"{url}/flaky/3", str(tmp_path / "3"))]
+    ledger_path = str(tmp_path / "download.ledger")
+
+    ledger = run(jobs, ledger_path, sniff=lambda heads: ["image/jpeg"] * len(heads))
+    assert ledger.entries["ok"] == (200, len(b"image /ok/1"), "image/jpeg")
+    assert ledger.entries["missing"] == (404, 0, "")
+    assert ledger.entries["flaky"] == (200, len(b"image /flaky/3"), "image/jpeg")
+    assert requests["/flaky/3"] == 2
+    with open(tmp_path / "1", "rb") as f:
+        assert f.read() == b"image /ok/1"
+    assert not os.path.exists(tmp_path / "2")
+
+    # A restart skips every key the ledger already holds
+    requests.clear()
+    ledger = run(jobs + [("new", f"{url}/ok/4", str(tmp_path / "4"))], ledger_path)
+    assert list(requests) == ["/ok/4"]
+    assert len(ledger) == 4
+
+def test_raising_sniff(server, tmp_path):
+    url, _ = server
+    jobs = [(str(i), f"{url}/ok/{i}", str(tmp_path / str(i))) for i in range(50)]
+
+    def sniff(heads):
+        raise ValueError("cannot sniff")
+
+    # Few connections and small sniff batches, so the queue fills while batches are recorded
+    ledger = run(jobs, str(tmp_path / "download.ledger"), connections=2, sniff=sniff, sniff_batch=1)
+    assert len(ledger) == 50
+    assert all(entry == (200, len(f"image /ok/{key}".encode()), "") for key, entry in ledger.items())
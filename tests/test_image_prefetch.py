@@ -0,0 +1,41 @@
+import numpy as np
+from PIL import Image
+
+from image_prefetch import ImagePrefetcher
+
+def write_images(tmp_path, count, size=16):
+    paths = []
+    for i in range(count):
+        path = str(tmp_path / f"{i}.png")
+        Image.new("RGB", (size, size), (i, i, i)).save(path)
+        paths.append(path)
+    return paths
+
+def test_prefetch_ahead_fits_budget(tmp_path):
+    paths = write_images(tmp_path, 10)
+    # Room for two worst-case (16x16) decodes at a time
+    prefetcher = ImagePrefetcher(max_bytes=2 * 16 * 16 * 3, max_resolution=16, workers=4)
+    prefetcher.prefetch(paths)
+    try:
+        for i, path in enumerate(paths):
+            image = prefetcher.get(path)
+            assert image[0, 0, 0] == i
+            assert prefetcher._bytes + len(prefetcher._pending) * prefetcher._estimate <= prefetcher.max_bytes
+            prefetcher.pop(path)
+        assert len(prefetcher) == 0
+    finally:
+        prefetcher.close()
+
+def test_pop_drops_unused_images(tmp_path):
+    paths = write_images(tmp_path, 4)
+    prefetcher = ImagePrefetcher(max_bytes=16 * 16 * 3, max_resolution=16, workers=1)
+    prefetcher.prefetch(paths)
+    try:
+        # Skipped images are released, waiting or in flight, so they never take up the budget
+        for path in paths[:3]:
+            prefetcher.pop(path)
+        assert np.array_equal(prefetcher.get(paths[3]), np.full((16, 16, 3), 3, dtype=np.uint8))
+        prefetcher._executor.shutdown(wait=True)
+        assert list(prefetcher._cache) == [paths[3]]
+    finally:
+        prefetcher.close()
@@ -0,0 +1,11 @@
+import json
+
+from json_stream import iter_json_arrays
+
+def test_numbers_cut_by_chunk_end(tmp_path):
+    path = tmp_path / "numbers.json"
+    items = [1.5, -2e-3, 10, 1e21, 0.25, True, None, -7]
+    path.write_text(json.dumps({"values": items, "more": [{"x": 3.0e2}]}))
+    for chunk_size in range(1, 16):
+        assert list(iter_json_arrays(str(path), chunk_size=chunk_size)) == \
+            [("values", item) for item in items] + [("more", {"x": 300.0})]
@@ -0,0 +1,26 @@
+import time
+
+import result_writer
+from result_writer import GroupCommitWriter
+
+def test_failed_commit_is_retried(monkeypatch):
+    monkeypatch.setattr(result_writer, "MAX_RETRY_DELAY", 0.05)
+    committed, failures = [], [2]
+
+    def commit(batch):
+        if failures[0]:
+            failures[0] -= 1
+            raise OSError(28, "No space left on device")
+        committed.extend(batch)
+
+    writer = GroupCommitWriter(commit, max_batch=2, max_delay=0.01)
+    for i in range(5):
+        writer.submit(i)  # Never raises, even while commits are failing
+    deadline = time.monotonic() + 5
+    while len(committed) < 4 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    writer.submit(5)
+    writer.close()
+
+    assert failures[0] == 0
+    assert sorted(committed) == [0, 1, 2, 3, 4, 5]
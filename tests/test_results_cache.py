@@ -0,0 +1,31 @@
+import os
+
+import pytest
+
+from segment_store import SegmentStore
+from results_cache import IncrementalResultsCache
+
+def test_ingest_compressed_group_read_in_parts(tmp_path):
+    pytest.importorskip("zstandard")
+    store = SegmentStore(str(tmp_path), "run", writer_id="writer", compress=True)
+    store.append([(f"coco/img_{i}.png", {"answer": i}) for i in range(3)])
+    segment = store.segments()[0]
+    index_path = os.path.join(store.root, segment[:-len(".seg.zst")] + ".idx")
+    with open(index_path) as f:
+        index_lines = f.readlines()
+
+    # The first update sees only the first index line of the group, the next one the rest
+    with open(index_path, "w") as f:
+        f.write(index_lines[0])
+    cache = IncrementalResultsCache(str(tmp_path), "run")
+    cache.load()
+    cache.ingest_segment(segment, store, segment)
+    cache.commit()
+    with open(index_path, "w") as f:
+        f.writelines(index_lines)
+    cache = IncrementalResultsCache(str(tmp_path), "run")
+    cache.load()
+    cache.ingest_segment(segment, store, segment)
+    cache.commit()
+
+    assert cache.results() == {f"coco/img_{i}.png": [{"answer": i}] for i in range(3)}
@@ -0,0 +1,24 @@
+import os
+
+from segment_store import SegmentStore
+
+def test_compact_reservations_only(tmp_path):
+    # A crashed writer left a segment without any complete record, plus its reservations
+    store = SegmentStore(str(tmp_path), "run", writer_id="crashed")
+    store.reserve(["coco/img_1.png", "coco/img_2.png"])
+    with open(os.path.join(store.root, "crashed-00000.seg"), "w") as f:
+        f.write('{"image": "coco/img_1.png", "res')
+    open(os.path.join(store.root, "crashed-00000.idx"), "w").close()
+
+    assert store.compact() == 0
+    assert os.listdir(store.root) == []
+    assert store.index() == {}
+
+def test_compact_keeps_records(tmp_path):
+    store = SegmentStore(str(tmp_path), "run", writer_id="writer")
+    store.reserve(["coco/img_1.png", "coco/img_2.png"])
+    store.append([("coco/img_1.png", {"answer": 1})])
+
+    assert store.compact() == 1
+    assert dict(store.iter_records()) == {"coco/img_1.png": {"answer": 1}}
+    assert not any(f.endswith(".reserved") for f in os.listdir(store.root))